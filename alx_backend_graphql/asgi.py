@@ -12,5 +12,22 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+os.environ.setdefault('GRAPHQL_ASYNC_VIEW', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from alx_backend_graphql.schema import schema  # noqa: E402
+from crm.subscriptions import GraphQLWebSocket  # noqa: E402
+
+graphql_ws = GraphQLWebSocket(schema.graphql_schema)
+
+
+async def application(scope, receive, send):
+    """Django for HTTP; GraphQL subscriptions for WebSockets on /graphql/."""
+    if scope['type'] == 'websocket':
+        if scope['path'] == '/graphql/':
+            return await graphql_ws(scope, receive, send)
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 4404})
+    return await django_application(scope, receive, send)
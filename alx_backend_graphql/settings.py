@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -77,6 +80,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds a writer waits for the write lock; stock writes take it at
+            # BEGIN (crm.inventory.write_transaction) so they always wait here
+            'timeout': 20,
+        },
+        # A file rather than shared-cache memory so tests can write from several threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -121,10 +131,93 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Add at the end of settings.py
 GRAPHENE = {
-    'SCHEMA': 'alx_backend_graphql.schema.schema'
+    'SCHEMA': 'alx_backend_graphql.schema.schema',
+    'MIDDLEWARE': ['crm.tracing.TracingMiddleware'] + (
+        ['graphene_django.debug.DjangoDebugMiddleware'] if DEBUG else []
+    ),
+    # GraphiQL runs subscriptions over the ASGI WebSocket endpoint
+    'SUBSCRIPTION_PATH': '/graphql/',
 }
 
+# Per-resolver timings and SQL counts; clients opt into a trace with X-GraphQL-Trace
+GRAPHQL_TRACING = True
+
+# Each web/Celery/cron process dumps its metrics here (None: a directory under /tmp)
+# at most every CRM_METRICS_FLUSH_INTERVAL seconds; /metrics adds them up
+CRM_METRICS_DIR = None
+CRM_METRICS_FLUSH_INTERVAL = 5
+
+# Serve /graphql/ with the async view (set by asgi.py) and the threads it runs ORM work on
+GRAPHQL_ASYNC_VIEW = os.environ.get('GRAPHQL_ASYNC_VIEW') == '1'
+GRAPHQL_ASYNC_WORKERS = 8
+
+# Subscription events: memory:// within one process, redis://host:6379/0 across processes
+# (needs the redis package); each subscription buffers at most CRM_SUBSCRIBER_QUEUE_SIZE events
+CRM_BROADCAST_URL = 'memory://'
+CRM_SUBSCRIBER_QUEUE_SIZE = 100
+
+# Seconds to cache query responses (None disables); invalidated per model on writes.
+# Use a cache shared by all workers, e.g. django.core.cache.backends.redis.RedisCache
+GRAPHQL_RESPONSE_CACHE_TTL = None
+GRAPHQL_RESPONSE_CACHE_ALIAS = 'default'
+
+# Parsed/validated document cache and Automatic Persisted Queries
+GRAPHQL_DOCUMENT_CACHE_SIZE = 512
+# Set to only execute the hashes listed in GRAPHQL_PERSISTED_QUERIES_MANIFEST
+GRAPHQL_PERSISTED_QUERIES_ONLY = False
+GRAPHQL_PERSISTED_QUERIES_MANIFEST = None
+
+# Static query cost limits and the per-client budget (None disables each)
+GRAPHQL_MAX_QUERY_DEPTH = 6
+GRAPHQL_MAX_QUERY_COST = 10000
+GRAPHQL_CLIENT_BUDGET = 50000
+GRAPHQL_CLIENT_BUDGET_REFILL_RATE = 500
+
+# Rows per query/INSERT for bulk mutations
+CRM_BULK_BATCH_SIZE = 500
+
+# Rows fetched (and prefetched) per round trip by streaming exports
+CRM_EXPORT_CHUNK_SIZE = 2000
+
+# Rows validated and committed per transaction (and checkpoint) by crm_import
+CRM_IMPORT_BATCH_SIZE = 20000
+
+# Customers recomputed per transaction by rebuild_customer_stats
+CRM_CUSTOMER_STATS_CHUNK_SIZE = 10000
+
+# Changed orders folded into the sales rollups per transaction, and how old an
+# order update must be before the refresh task reads it
+CRM_ROLLUP_BATCH_SIZE = 10000
+CRM_ROLLUP_SETTLE_SECONDS = 60
+
+# Restock policy of products without their own reorder point/quantity, and the
+# products updateLowStockProducts examines per transaction
+CRM_REORDER_POINT = 10
+CRM_REORDER_QUANTITY = 10
+CRM_RESTOCK_CHUNK_SIZE = 10000
+
+# Dotted path of a crm.search backend class; None picks FTS5 on SQLite when indexed
+CRM_SEARCH_BACKEND = None
+
 CRONJOBS = [
     ('*/5 * * * *', 'crm.cron.log_crm_heartbeat'),
     ('0 */12 * * *', 'crm.cron.update_low_stock'),
 ]
+
+# --- Celery Configuration ---
+
+CELERY_BROKER_URL = 'redis://localhost:6379/0'
+CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_TIMEZONE = TIME_ZONE
+
+CELERY_BEAT_SCHEDULE = {
+    'generate-crm-report': {
+        'task': 'crm.tasks.generate_crm_report',
+        'schedule': crontab(day_of_week='mon', hour=6, minute=0),
+    },
+    # Folds the orders changed since the last run into the sales rollups
+    'refresh-sales-rollups': {
+        'task': 'crm.tasks.refresh_sales_rollups',
+        'schedule': crontab(minute='*/5'),
+    },
+}
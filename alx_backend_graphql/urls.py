@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+
+from crm.views import AsyncCRMGraphQLView, CRMGraphQLView, export_view, metrics_view
+
+GraphQLView = AsyncCRMGraphQLView if settings.GRAPHQL_ASYNC_VIEW else CRMGraphQLView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('metrics', metrics_view),
+    path('export/<slug:name>.<slug:format>', export_view),
 ]
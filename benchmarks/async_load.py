@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Compare throughput and latency of /graphql/ served by WSGI and by ASGI.
+
+Start both servers on the same seeded database (asgi.py switches /graphql/
+to the async view), with any WSGI/ASGI server, e.g.:
+
+    gunicorn alx_backend_graphql.wsgi -b 127.0.0.1:8000 --threads 32
+    uvicorn alx_backend_graphql.asgi:application --port 8001
+
+then load them in turn:
+
+    python benchmarks/async_load.py \\
+        --target wsgi=http://127.0.0.1:8000/graphql/ \\
+        --target asgi=http://127.0.0.1:8001/graphql/ \\
+        --clients 50 200 1000 --duration 20
+
+Every client sends its own X-Api-Key, so the cost budget applies per client;
+requests rejected with 429 are counted apart from other errors.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+QUERY = """
+{
+  crmStats { customerCount orderCount totalRevenue }
+  allOrders(first: 10) { edges { node { totalAmount customer { name } } } }
+  allProducts(first: 10) { edges { node { name stock } } }
+}
+"""
+
+
+async def client(session, url, index, deadline, latencies, outcomes):
+    body = json.dumps({'query': QUERY})
+    headers = {'Content-Type': 'application/json', 'X-Api-Key': f'bench-{index}'}
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            async with session.post(url, data=body, headers=headers) as response:
+                payload = await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            outcomes['failed'] += 1
+            continue
+        if status == 429:
+            outcomes['throttled'] += 1
+            await asyncio.sleep(1)
+        elif status != 200 or b'"errors"' in payload:
+            outcomes['failed'] += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+
+
+async def run(url, clients, duration):
+    """Hit ``url`` from ``clients`` concurrent clients for ``duration`` seconds."""
+    latencies = []
+    outcomes = {'failed': 0, 'throttled': 0}
+    connector = aiohttp.TCPConnector(limit=clients)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(
+            client(session, url, index, deadline, latencies, outcomes) for index in range(clients)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else float('nan'),
+        'p99': latencies[int(len(latencies) * 0.99)] if latencies else float('nan'),
+        **outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, metavar='LABEL=URL')
+    parser.add_argument('--clients', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    args = parser.parse_args()
+
+    targets = [target.split('=', 1) for target in args.target]
+    print(f"{'target':<8} {'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'429':>6} {'failed':>6}")
+    for clients in args.clients:
+        for label, url in targets:
+            asyncio.run(run(url, min(clients, 10), args.warmup))
+            result = asyncio.run(run(url, clients, args.duration))
+            print(
+                f"{label:<8} {clients:>7} {result['throughput']:>9.1f} {result['p50'] * 1000:>9.1f} "
+                f"{result['p99'] * 1000:>9.1f} {result['throttled']:>6} {result['failed']:>6}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Compare the row-by-row and bulk paths of BulkCreateCustomers.
+
+Runs against a throwaway test database, e.g.:
+
+    python benchmarks/bulk_create_customers.py --rows 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+# Setup Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+
+import django
+
+django.setup()
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment
+
+from crm.bulk import bulk_create_customers
+from crm.models import Customer
+from crm.schema import validate_phone
+
+
+def create_customers_row_by_row(rows):
+    """The original BulkCreateCustomers.mutate loop, kept as the baseline."""
+    created_customers = []
+    errors = []
+
+    with transaction.atomic():
+        for idx, customer_data in enumerate(rows):
+            try:
+                validate_email(customer_data['email'])
+                if Customer.objects.filter(email=customer_data['email']).exists():
+                    errors.append(f"Customer {idx}: Email already exists - {customer_data['email']}")
+                    continue
+                validate_phone(customer_data['phone'])
+
+                customer = Customer(
+                    name=customer_data['name'],
+                    email=customer_data['email'],
+                    phone=customer_data['phone'] or ''
+                )
+                customer.save()
+                created_customers.append(customer)
+            except ValidationError as e:
+                errors.append(f"Customer {idx}: {str(e)}")
+
+    return created_customers, errors
+
+
+def make_rows(count):
+    # 1% duplicates and 1% invalid emails so both error paths are exercised
+    rows = []
+    for i in range(count):
+        email = f"customer{i}@example.com"
+        if i % 100 == 1:
+            email = f"customer{i - 1}@example.com"
+        elif i % 100 == 2:
+            email = "not-an-email"
+        rows.append({'name': f"Customer {i}", 'email': email, 'phone': "+1234567890"})
+    return rows
+
+
+def run(label, create, rows):
+    Customer.objects.all().delete()
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        start = time.perf_counter()
+        created, errors = create(rows)
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:<12} rows={len(rows):<8} created={len(created):<8} errors={len(errors):<6} "
+        f"queries={queries[0]:<8} seconds={elapsed:.2f} rows/sec={len(rows) / elapsed:,.0f}"
+    )
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        for count in args.rows:
+            rows = make_rows(count)
+            old_errors = run('row-by-row', create_customers_row_by_row, rows)
+            new_errors = run('bulk', bulk_create_customers, rows)
+            assert old_errors == new_errors, "Both paths must report the same errors"
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Compare ways of loading customers: seed_db.py's objects.create loop, the
+bulk_create_customers helper behind BulkCreateCustomers, and crm_import.
+
+Runs against a throwaway test database, e.g.:
+
+    python benchmarks/crm_import.py --rows 100000 1000000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+# Setup Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+
+import django
+
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment
+
+from crm.bulk import bulk_create_customers
+from crm.importer import IMPORT_BATCH_SIZE
+from crm.models import Customer
+
+
+def create_one_by_one(path):
+    """seed_db.py's approach, in one transaction so it is not also paying a commit per row."""
+    with open(path, newline='') as f, transaction.atomic():
+        next(f)
+        for line in f:
+            name, email, phone = line.rstrip('\n').split(',')
+            Customer.objects.create(name=name, email=email, phone=phone)
+
+
+def create_in_bulk(path):
+    with open(path, newline='') as f, transaction.atomic():
+        next(f)
+        rows = []
+        for line in f:
+            name, email, phone = line.rstrip('\n').split(',')
+            rows.append({'name': name, 'email': email, 'phone': phone})
+        bulk_create_customers(rows)
+
+
+def crm_import(batch_size):
+    def run(path):
+        call_command('crm_import', 'customers', path, '--batch-size', str(batch_size), '--no-checkpoint',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+    return run
+
+
+def write_rows(path, count):
+    with open(path, 'w') as f:
+        f.write("name,email,phone\n")
+        for i in range(count):
+            f.write(f"Customer {i},customer{i}@example.com,+1234567890\n")
+
+
+def run(label, load, path, count):
+    Customer.objects.all().delete()
+    start = time.perf_counter()
+    load(path)
+    elapsed = time.perf_counter() - start
+    assert Customer.objects.count() == count, label
+    print(f"{label:<22} rows={count:<9} seconds={elapsed:<7.2f} rows/sec={count / elapsed:,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[5000, IMPORT_BATCH_SIZE])
+    parser.add_argument('--skip-slow', action='store_true', help="Only time crm_import.")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for count in args.rows:
+                path = os.path.join(directory, f'customers-{count}.csv')
+                write_rows(path, count)
+                if not args.skip_slow:
+                    run('objects.create', create_one_by_one, path, count)
+                    run('bulk_create_customers', create_in_bulk, path, count)
+                for batch_size in args.batch_size:
+                    run(f'crm_import batch={batch_size}', crm_import(batch_size), path, count)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Benchmark the GraphQL API's hot paths in-process, through the schema.
+
+Seeds a throwaway test database with a generated dataset (see crm/seed.py)
+and runs each operation repeatedly, recording latency percentiles, SQL
+queries and peak Python memory. Every run happens in a transaction that is
+rolled back, so mutations see the same data each time. E.g.:
+
+    python benchmarks/graphql_api.py --scale small --save
+    python benchmarks/graphql_api.py --scale small      # compare with the baseline
+
+Results are compared with the baseline JSON (benchmarks/baselines/<scale>.json
+by default) and the run exits with status 1 when an operation's p50/p95
+latency or peak memory grew by more than --threshold, or it issues more
+queries. Latency baselines only mean something on the machine that saved them.
+--database benchmarks an already seeded SQLite file instead, e.g. one loaded
+with `seed_db.py --scale large`.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Setup Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+
+import django
+
+django.setup()
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+
+from crm import seed
+from crm.client import LocalClient
+from crm.models import Customer, Order, Product
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+ALL_ORDERS = """
+query($after: String) {
+  allOrders(first: 50, after: $after) {
+    edges { node {
+      id totalAmount orderDate
+      customer { name email }
+      products { edges { node { name price } } }
+    } }
+    pageInfo { endCursor hasNextPage }
+  }
+}
+"""
+
+FILTERED_PRODUCTS = """
+query($name: String, $minPrice: Decimal, $minStock: Decimal) {
+  allProducts(first: 50, name: $name, price_Gte: $minPrice, stock_Gte: $minStock, orderBy: "-price") {
+    edges { node { id name price stock } }
+  }
+}
+"""
+
+CREATE_ORDER = """
+mutation($input: OrderInput!) {
+  createOrder(input: $input) { order { id totalAmount products { edges { node { id } } } } }
+}
+"""
+
+BULK_CREATE_CUSTOMERS = """
+mutation($input: [CustomerInput]!) {
+  bulkCreateCustomers(input: $input) { customers { id } errors }
+}
+"""
+
+UPDATE_LOW_STOCK = """
+mutation { updateLowStockProducts { products { id stock } message } }
+"""
+
+UPDATE_LOW_STOCK_SUMMARY = """
+mutation { updateLowStockProducts(summaryOnly: true) { count units cursor message } }
+"""
+
+
+def operations():
+    """``(name, query, variables)`` for each benchmarked operation, built from the seeded data."""
+    client = LocalClient()
+    # The second page, so pagination seeks past a cursor
+    first_page = client.execute(ALL_ORDERS)['allOrders']['pageInfo']['endCursor']
+    customer = Customer.objects.order_by('pk').values_list('pk', flat=True).first()
+    products = list(Product.objects.filter(stock__gt=0).order_by('pk').values_list('pk', flat=True)[:20])
+    if customer is None or len(products) < 20:
+        raise SystemExit("The dataset needs at least one customer and 20 products in stock.")
+    return [
+        ('allOrders', ALL_ORDERS, {'after': first_page}),
+        ('allProducts', FILTERED_PRODUCTS, {'name': 'Wireless', 'minPrice': '20', 'minStock': '1'}),
+        ('createOrder', CREATE_ORDER, {
+            'input': {'customerId': str(customer), 'productIds': [str(pk) for pk in products]},
+        }),
+        ('bulkCreateCustomers', BULK_CREATE_CUSTOMERS, {'input': [
+            {'name': f"Bench Customer {i}", 'email': f"bench{i}@example.com", 'phone': '+1234567890'}
+            for i in range(1000)
+        ]}),
+        ('updateLowStockProducts', UPDATE_LOW_STOCK, None),
+        ('updateLowStockSummary', UPDATE_LOW_STOCK_SUMMARY, None),
+    ]
+
+
+def run_once(client, query, variables):
+    """Run the operation and roll back whatever it wrote."""
+    with transaction.atomic():
+        client.execute(query, variables)
+        transaction.set_rollback(True)
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+def measure(query, variables, iterations, warmup):
+    client = LocalClient()
+    for _ in range(warmup):
+        run_once(client, query, variables)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run_once(client, query, variables)
+        timings.append((time.perf_counter() - start) * 1000)
+    # Queries and memory are counted on a separate run, so their bookkeeping is not timed
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            run_once(client, query, variables)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': len(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def regressions(results, baseline, threshold, min_delta_ms):
+    """Messages for every metric that got worse than ``baseline`` allows."""
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'peak_memory_kb'):
+            limit = before[metric] * (1 + threshold)
+            if metric.endswith('_ms'):
+                # Sub-millisecond operations jitter by more than any sensible fraction
+                limit = max(limit, before[metric] + min_delta_ms)
+            if result[metric] > limit:
+                found.append(f"{name}: {metric} {before[metric]} -> {result[metric]}")
+        if result['queries'] > before['queries']:
+            found.append(f"{name}: queries {before['queries']} -> {result['queries']}")
+    return found
+
+
+def counts():
+    return {
+        'customers': Customer.objects.count(),
+        'products': Product.objects.count(),
+        'orders': Order.objects.count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=list(seed.SCALES), default='small')
+    parser.add_argument('--customers', type=int, help="Override the scale's size.")
+    parser.add_argument('--products', type=int, help="Override the scale's size.")
+    parser.add_argument('--orders', type=int, help="Override the scale's size.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help="Processes generating the dataset.")
+    parser.add_argument('--database', help="Benchmark this seeded SQLite file instead of seeding one.")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', nargs='+', metavar='OPERATION', help="Run only these operations.")
+    parser.add_argument('--baseline', help="Baseline JSON (default: benchmarks/baselines/<scale>.json).")
+    parser.add_argument('--save', action='store_true', help="Write the results as the new baseline.")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed growth of latency and memory, as a fraction (default: 0.25).")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="Latency growth below this is never a regression (default: 1.0).")
+    args = parser.parse_args()
+    if args.iterations < 2:
+        parser.error("--iterations must be at least 2")
+
+    setup_test_environment()
+    if args.database:
+        connection.settings_dict['NAME'] = args.database
+        old_name = None
+    else:
+        old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        if old_name is not None:
+            dataset = seed.Dataset.for_scale(args.scale, seed=args.seed)
+            dataset = dataset._replace(**{
+                kind: getattr(args, kind) for kind in ('customers', 'products', 'orders') if getattr(args, kind)
+            })
+            start = time.perf_counter()
+            seed.load(dataset, workers=args.workers)
+            print(f"Seeded {dataset.customers:,} customers, {dataset.products:,} products and "
+                  f"{dataset.orders:,} orders in {time.perf_counter() - start:.0f}s")
+        sizes = counts()
+        results = {}
+        for name, query, variables in operations():
+            if args.only and name not in args.only:
+                continue
+            result = results[name] = measure(query, variables, args.iterations, args.warmup)
+            print(f"{name:<24} p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+                  f"p99={result['p99_ms']:.2f}ms queries={result['queries']} "
+                  f"peak={result['peak_memory_kb']:,.0f}KiB")
+    finally:
+        if old_name is not None:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    path = args.baseline or os.path.join(BASELINES_DIR, f'{args.scale}.json')
+    if args.save:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'dataset': sizes, 'python': platform.python_version(), 'machine': platform.machine(),
+                'operations': results,
+            }, f, indent=2)
+            f.write('\n')
+        print(f"Saved the baseline to {path}")
+        return
+    if not os.path.exists(path):
+        print(f"No baseline at {path}; pass --save to record one.")
+        return
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline['dataset'] != sizes:
+        sys.exit(f"The baseline was recorded on {baseline['dataset']}, not {sizes}.")
+    found = regressions(results, baseline['operations'], args.threshold, args.min_delta_ms)
+    if found:
+        print(f"Regressions over {args.threshold:.0%}:")
+        for message in found:
+            print(f"  {message}")
+        sys.exit(1)
+    print(f"No regressions over {args.threshold:.0%} against {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Measure what the tracing middleware adds to a typical allOrders page.
+
+Runs against a throwaway test database, e.g.:
+
+    python benchmarks/tracing_overhead.py --orders 200 --requests 300
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Setup Django environment
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
+
+import django
+
+django.setup()
+
+from decimal import Decimal
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment
+
+from crm.models import Customer, Order, OrderLine, Product
+from crm.tracing import TracingMiddleware
+from crm.views import CRMGraphQLView
+
+QUERY = """
+{ allOrders(first: 50) { edges { node {
+    id totalAmount orderDate customer { name email } products { edges { node { name price } } }
+} } } }
+"""
+
+
+class TracedView(CRMGraphQLView):
+    budget = None
+
+
+class UntracedView(TracedView):
+    tracing = False
+
+
+def seed(count):
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal('10.00'), stock=100) for i in range(10)
+    )
+    customers = Customer.objects.bulk_create(
+        Customer(name=f"Customer {i}", email=f"customer{i}@example.com") for i in range(count)
+    )
+    orders = Order.objects.bulk_create(
+        Order(customer=customer, total_amount=Decimal('30.00')) for customer in customers
+    )
+    OrderLine.objects.bulk_create(
+        OrderLine(order=order, product=products[(order.pk + i) % 10], unit_price=Decimal('10.00'))
+        for order in orders for i in range(3)
+    )
+
+
+def compare(variants, requests):
+    """Time ``(label, view, headers)`` variants on interleaved requests, so drift hits all alike."""
+    factory = RequestFactory()
+    body = json.dumps({'query': QUERY})
+    timings = {label: [] for label, _, _ in variants}
+    for _ in range(requests):
+        for label, view, headers in variants:
+            request = factory.post('/graphql/', body, content_type='application/json', headers=headers)
+            start = time.perf_counter()
+            response = view(request)
+            timings[label].append(time.perf_counter() - start)
+            assert response.status_code == 200, response.content
+    medians = {}
+    for label, values in timings.items():
+        values.sort()
+        medians[label] = statistics.median(values)
+        print(f"{label:<16} median={medians[label] * 1000:.2f}ms p95={values[int(len(values) * 0.95)] * 1000:.2f}ms")
+    return medians
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        seed(args.orders)
+        untraced = UntracedView.as_view(middleware=[])
+        traced = TracedView.as_view(middleware=[TracingMiddleware()])
+        variants = [
+            ('no tracing', untraced, {}),
+            ('histogram only', traced, {}),
+            ('emitting', traced, {'X-GraphQL-Trace': '1'}),
+        ]
+        compare(variants, 20)
+        medians = compare(variants, args.requests)
+        overhead = medians['histogram only'] / medians['no tracing'] - 1
+        print(f"overhead when not emitting: {overhead * 100:.1f}%")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        from .metrics import connect_task_signals
+        from .response_cache import connect_signals
+        from .rollups import connect_order_signals as connect_rollup_signals
+        from .stats import connect_order_signals
+        connect_task_signals()
+        connect_signals()
+        connect_order_signals()
+        connect_rollup_signals()
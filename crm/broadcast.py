@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import Counter
+
+# memory:// fans events out within one process; redis://... across web, Celery and cron processes
+BROADCAST_URL = getattr(settings, 'CRM_BROADCAST_URL', 'memory://')
+SUBSCRIBER_QUEUE_SIZE = getattr(settings, 'CRM_SUBSCRIBER_QUEUE_SIZE', 100)
+
+dropped_events = Counter(
+    'crm_broadcast_dropped_events_total',
+    'Events dropped because a subscriber fell a full queue behind.',
+    labelnames=('channel',),
+)
+
+
+class Subscriber:
+    """
+    Bounded queue of events for one subscription, fed from any thread.
+
+    A subscriber that cannot keep up loses its oldest events rather than
+    slowing down the publisher or growing without bound.
+    """
+
+    def __init__(self, channel, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The subscriber's loop is closed
+            pass
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            dropped_events.inc(labels=(self.channel,))
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class MemoryBackend:
+    """Delivers events to the subscribers of this process only."""
+
+    def __init__(self, url=None):
+        pass
+
+    def publish(self, broadcast, channel, message):
+        broadcast.deliver(channel, message)
+
+    def has_subscribers(self, broadcast, channel):
+        return broadcast.has_local_subscribers(channel)
+
+    async def listen(self, broadcast):
+        pass
+
+
+class RedisBackend:
+    """
+    Redis pub/sub, so events published by any process reach every subscriber.
+
+    Publishing uses a blocking client, as events are sent from request threads
+    and jobs; each process with subscribers runs one listener task on its loop.
+    """
+
+    prefix = 'crm:events:'
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("CRM_BROADCAST_URL uses Redis but the redis package is not installed.")
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self._listeners = {}
+
+    def publish(self, broadcast, channel, message):
+        self.client.publish(self.prefix + channel, json.dumps(message))
+
+    def has_subscribers(self, broadcast, channel):
+        # Subscribers may be in any process
+        return True
+
+    async def listen(self, broadcast):
+        loop = asyncio.get_running_loop()
+        if loop not in self._listeners:
+            self._listeners[loop] = loop.create_task(self._listen(broadcast))
+
+    async def _listen(self, broadcast):
+        import redis.asyncio
+
+        pubsub = redis.asyncio.Redis.from_url(self.url).pubsub()
+        await pubsub.psubscribe(self.prefix + '*')
+        async for message in pubsub.listen():
+            if message['type'] == 'pmessage':
+                channel = message['channel'].decode()[len(self.prefix):]
+                broadcast.deliver(channel, json.loads(message['data']))
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'redis': RedisBackend,
+    'rediss': RedisBackend,
+}
+
+
+class Broadcast:
+    """
+    Publish/subscribe bus for CRM events.
+
+    ``publish`` is plain sync code callable from any thread; ``subscribe`` is an
+    async iterator of the messages of one channel. The backend decides how far
+    messages travel, see ``CRM_BROADCAST_URL``.
+    """
+
+    def __init__(self, url=BROADCAST_URL, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        scheme = url.split(':', 1)[0]
+        if scheme not in BACKENDS:
+            raise ImproperlyConfigured(f"Unsupported CRM_BROADCAST_URL scheme: {scheme}")
+        self.backend = BACKENDS[scheme](url)
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        self.backend.publish(self, channel, message)
+
+    def has_subscribers(self, channel):
+        return self.backend.has_subscribers(self, channel)
+
+    def has_local_subscribers(self, channel):
+        return bool(self._subscribers.get(channel))
+
+    def deliver(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    async def subscribe(self, channel):
+        await self.backend.listen(self)
+        subscriber = Subscriber(channel, self.queue_size)
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await subscriber.get()
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+
+
+broadcast = Broadcast()
@@ -0,0 +1,279 @@
+import threading
+from collections import Counter
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, connection, transaction
+
+from .events import orders_created
+from .inventory import InsufficientStock, order_quantities, reserve_stock
+from .models import Customer, Product, Order, OrderLine
+from .response_cache import models_changed
+
+BULK_BATCH_SIZE = getattr(settings, 'CRM_BULK_BATCH_SIZE', 500)
+
+_pending = threading.local()
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def on_commit_batched(flush, values):
+    """
+    Add ``values`` to the set ``flush`` is called with, in its own transaction,
+    once the current transaction commits.
+
+    Signal handlers run per row, e.g. for every order a cascade deletes; this
+    turns them into one ``flush``. Values of a rolled-back transaction stay
+    pending until the next commit, so ``flush`` must recompute from the database.
+    """
+    batches = _pending.__dict__.setdefault('batches', {})
+    batches.setdefault(flush, set()).update(values)
+    transaction.on_commit(lambda: flush_batched(flush))
+
+
+def flush_batched(flush):
+    values = _pending.__dict__.get('batches', {}).pop(flush, None)
+    if values:
+        with transaction.atomic():
+            flush(values)
+
+
+def existing_values(model, field, values, batch_size=BULK_BATCH_SIZE):
+    """Return which of ``values`` are already stored in ``model.field``, one query per chunk."""
+    found = set()
+    for chunk in chunked(values, batch_size):
+        found.update(model.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+    return found
+
+
+def insert_rows(table, fields, rows, on_conflict=''):
+    """
+    Insert tuples of database values for ``fields`` into ``table``.
+
+    Uses multi-row ``INSERT`` statements as large as the backend allows, like
+    ``bulk_create`` does, but without building model instances. ``on_conflict``
+    is appended to every statement.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    placeholders = f"({', '.join(['%s'] * len(fields))})"
+    batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1)
+    with connection.cursor() as cursor:
+        for chunk in chunked(rows, batch_size):
+            cursor.execute(
+                f"INSERT INTO {quote(table)} ({columns}) VALUES {', '.join([placeholders] * len(chunk))}{on_conflict}",
+                [item for row in chunk for item in row],
+            )
+
+
+def bulk_create_customers(rows, batch_size=BULK_BATCH_SIZE):
+    """
+    Validate and insert customer rows (mappings with name/email/phone).
+
+    Returns ``(customers, errors)`` where ``errors`` holds one message per rejected
+    row, in input order, worded like the row-by-row ``BulkCreateCustomers`` did.
+    """
+    # Avoid a circular import: the schema module uses this helper
+    from .schema import validate_phone
+
+    errors = {}
+    candidates = []
+    for idx, row in enumerate(rows):
+        try:
+            validate_email(row.get('email'))
+            candidates.append((idx, row))
+        except ValidationError as e:
+            errors[idx] = f"Customer {idx}: {str(e)}"
+        except Exception as e:
+            errors[idx] = f"Customer {idx}: {str(e)}"
+
+    taken = existing_values(Customer, 'email', [row.get('email') for _, row in candidates], batch_size)
+
+    pending = []
+    for idx, row in candidates:
+        email = row.get('email')
+        if email in taken:
+            errors[idx] = f"Customer {idx}: Email already exists - {email}"
+            continue
+        try:
+            validate_phone(row.get('phone'))
+        except ValidationError as e:
+            errors[idx] = f"Customer {idx}: {str(e)}"
+            continue
+        # Later duplicates within the same batch are rejected like existing rows
+        taken.add(email)
+        pending.append((idx, Customer(name=row.get('name'), email=email, phone=row.get('phone') or '')))
+
+    created = []
+    for chunk in chunked(pending, batch_size):
+        try:
+            with transaction.atomic():
+                Customer.objects.bulk_create([customer for _, customer in chunk])
+            created.extend(customer for _, customer in chunk)
+        except IntegrityError:
+            # A concurrent writer took some of these emails; fall back to row-by-row
+            for idx, customer in chunk:
+                customer.pk = None
+                try:
+                    with transaction.atomic():
+                        customer.save()
+                    created.append(customer)
+                except IntegrityError:
+                    errors[idx] = f"Customer {idx}: Email already exists - {customer.email}"
+
+    # bulk_create sends no post_save
+    if created:
+        models_changed(Customer)
+    return created, [errors[idx] for idx in sorted(errors)]
+
+
+def parse_ids(ids):
+    """Split raw ID arguments into integer primary keys and the ones that are not numbers."""
+    pks, invalid = [], []
+    for value in ids:
+        try:
+            pks.append(int(value))
+        except (TypeError, ValueError):
+            invalid.append(value)
+    return pks, invalid
+
+
+def load_in_bulk(model, ids, batch_size=BULK_BATCH_SIZE):
+    """Return ``{pk: instance}`` for ``ids`` with one ``in_bulk`` query per chunk."""
+    found = {}
+    for chunk in chunked(set(ids), batch_size):
+        found.update(model.objects.in_bulk(chunk))
+    return found
+
+
+def missing_products_message(missing):
+    label = "Invalid product ID" if len(missing) == 1 else "Invalid product IDs"
+    return f"{label}: {', '.join(str(product_id) for product_id in missing)}"
+
+
+def resolve_products(product_ids, products_by_pk):
+    """Return ``(products, missing_ids)`` for one order's ``product_ids``, keeping input order."""
+    products, missing = [], []
+    for product_id in product_ids:
+        try:
+            product = products_by_pk.get(int(product_id))
+        except (TypeError, ValueError):
+            product = None
+        if product is None:
+            missing.append(product_id)
+        else:
+            products.append(product)
+    return products, missing
+
+
+def bulk_add_lines(orders_with_lines, batch_size=BULK_BATCH_SIZE):
+    """Write the unsaved ``OrderLine`` rows of saved orders with chunked ``bulk_create``."""
+    rows = []
+    for order, lines in orders_with_lines:
+        for line in lines:
+            line.order = order
+            rows.append(line)
+    OrderLine.objects.bulk_create(rows, batch_size=batch_size)
+    # Neither bulk_create sends signals
+    models_changed(Order)
+    orders_created([order for order, _ in orders_with_lines])
+
+
+def order_lines(row):
+    """Return ``[(product_id, quantity)]`` for an order input; each of ``product_ids`` counts once."""
+    lines = [(product_id, 1) for product_id in row.get('product_ids') or []]
+    lines += [(line.get('product_id'), line.get('quantity')) for line in row.get('lines') or []]
+    return lines
+
+
+def prepare_order(customer, row, products_by_pk):
+    """
+    Validate one order input against preloaded products.
+
+    Returns ``(order, lines, quantities)``: an unsaved order, one unsaved
+    ``OrderLine`` per product capturing its current price, and the units per
+    product. The order's total is the sum of the lines. Raises
+    ``ValidationError`` for invalid input.
+    """
+    requested = order_lines(row)
+    if not requested:
+        raise ValidationError("At least one product is required")
+    products, missing = resolve_products([product_id for product_id, _ in requested], products_by_pk)
+    if missing:
+        raise ValidationError(missing_products_message(missing))
+    quantities = order_quantities(
+        (product.pk, quantity) for product, (_, quantity) in zip(products, requested)
+    )
+    lines = [
+        OrderLine(product_id=pk, quantity=quantity, unit_price=products_by_pk[pk].price)
+        for pk, quantity in quantities.items()
+    ]
+    order = Order(
+        customer=customer,
+        order_date=row.get('order_date'),
+        total_amount=sum((line.amount for line in lines), Decimal('0.00')),
+    )
+    return order, lines, quantities
+
+
+def bulk_create_orders(rows, batch_size=BULK_BATCH_SIZE):
+    """
+    Validate and insert order rows (mappings with customer_id, product_ids/lines, order_date).
+
+    Customers and products are resolved with ``in_bulk`` for the whole batch, stock
+    for all rows is reserved in one conditional update, and orders and their lines
+    are written with chunked ``bulk_create``. Returns ``(orders, errors)`` with
+    one message per rejected row, in input order.
+    """
+    rows = list(rows)
+    customer_pks, _ = parse_ids(row.get('customer_id') for row in rows)
+    product_pks, _ = parse_ids(product_id for row in rows for product_id, _ in order_lines(row))
+    customers = load_in_bulk(Customer, customer_pks, batch_size)
+    products_by_pk = load_in_bulk(Product, product_pks, batch_size)
+
+    errors = {}
+    pending = []
+    for idx, row in enumerate(rows):
+        try:
+            customer = customers.get(int(row.get('customer_id')))
+        except (TypeError, ValueError):
+            customer = None
+        if customer is None:
+            errors[idx] = f"Order {idx}: Invalid customer ID"
+            continue
+        try:
+            pending.append((idx, *prepare_order(customer, row, products_by_pk)))
+        except ValidationError as e:
+            errors[idx] = f"Order {idx}: {e.messages[0]}"
+
+    totals = Counter()
+    for _, _, _, quantities in pending:
+        totals.update(quantities)
+    try:
+        reserve_stock(dict(totals))
+    except InsufficientStock:
+        # Not everything fits: reserve row by row so only the rows that overflow are rejected
+        accepted = []
+        for entry in pending:
+            idx, _, _, quantities = entry
+            try:
+                reserve_stock(quantities)
+                accepted.append(entry)
+            except InsufficientStock as e:
+                errors[idx] = f"Order {idx}: {e.messages[0]}"
+        pending = accepted
+
+    Order.objects.bulk_create([order for _, order, _, _ in pending], batch_size=batch_size)
+    bulk_add_lines([(order, lines) for _, order, lines, _ in pending], batch_size)
+    return [order for _, order, _, _ in pending], [errors[idx] for idx in sorted(errors)]
@@ -0,0 +1,93 @@
+import os
+from types import SimpleNamespace
+
+import requests
+from graphql import execute
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .documents import document_cache
+from .loaders import Loaders
+
+GRAPHQL_ENDPOINT = os.environ.get("GRAPHQL_ENDPOINT", "http://127.0.0.1:8000/graphql/")
+
+# "local" runs operations in-process against the schema, "http" posts them to GRAPHQL_ENDPOINT
+GRAPHQL_TRANSPORT = os.environ.get("GRAPHQL_TRANSPORT", "local")
+
+
+class GraphQLClientError(Exception):
+    """Raised when an operation comes back with GraphQL errors."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(error.get('message', str(error)) for error in errors))
+
+
+def get_schema():
+    from alx_backend_graphql.schema import schema
+    return schema.graphql_schema
+
+
+def get_document(query):
+    """Parse and validate ``query`` through the shared document cache."""
+    document, errors = document_cache.get(get_schema(), query)
+    if errors:
+        raise GraphQLClientError([error.formatted for error in errors])
+    return document
+
+
+class LocalClient:
+    """Executes operations directly against the schema, without a web server."""
+
+    def execute(self, query, variables=None):
+        result = execute(
+            get_schema(),
+            get_document(query),
+            variable_values=variables,
+            context_value=SimpleNamespace(loaders=Loaders()),
+        )
+        if result.errors:
+            raise GraphQLClientError([error.formatted for error in result.errors])
+        return result.data
+
+
+class HTTPClient:
+    """Posts operations to a GraphQL endpoint over one pooled, reused session."""
+
+    def __init__(self, url=GRAPHQL_ENDPOINT, retries=3, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=Retry(connect=retries, read=0, backoff_factor=0.3))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def execute(self, query, variables=None):
+        response = self.session.post(
+            self.url, json={'query': query, 'variables': variables}, timeout=self.timeout
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+        if body.get('errors'):
+            raise GraphQLClientError(body['errors'])
+        response.raise_for_status()
+        return body.get('data')
+
+
+_clients = {}
+
+
+def get_client(transport=None):
+    """Return the shared client for ``transport`` (defaults to GRAPHQL_TRANSPORT)."""
+    transport = transport or GRAPHQL_TRANSPORT
+    if transport not in _clients:
+        if transport == 'local':
+            _clients[transport] = LocalClient()
+        elif transport == 'http':
+            _clients[transport] = HTTPClient()
+        else:
+            raise ValueError(f"Unknown GraphQL transport: {transport}")
+    return _clients[transport]
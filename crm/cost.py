@@ -0,0 +1,150 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode,
+    get_named_type, get_operation_ast,
+)
+from graphql.execution.values import get_argument_values, get_variable_values
+
+MAX_QUERY_DEPTH = getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', 6)
+MAX_QUERY_COST = getattr(settings, 'GRAPHQL_MAX_QUERY_COST', 10000)
+CLIENT_BUDGET = getattr(settings, 'GRAPHQL_CLIENT_BUDGET', 50000)
+CLIENT_BUDGET_REFILL_RATE = getattr(settings, 'GRAPHQL_CLIENT_BUDGET_REFILL_RATE', 500)
+
+
+class QueryCostError(GraphQLError):
+    """Raised when an operation is deeper or more expensive than allowed."""
+
+
+def is_connection_plumbing(parent_type):
+    # Relay connection and edge types only wrap the nodes that carry the cost
+    fields = getattr(parent_type, 'fields', {})
+    return 'pageInfo' in fields or 'cursor' in fields
+
+
+class CostAnalyzer:
+    """
+    Static cost of an operation, computed from the document before it runs.
+
+    Every field that returns an object costs 1 and scalars are free. Selections
+    under a connection are multiplied by its page size (``first``/``last``, or
+    the relay max limit when neither is given), so nested connections grow the
+    cost geometrically the same way their result sets do. Relay ``edges`` and
+    ``node`` wrappers add neither cost nor depth.
+    """
+
+    def __init__(self, schema, default_page_size=None):
+        self.schema = schema
+        self.default_page_size = default_page_size or graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+
+    def analyze(self, document, operation_name=None, variables=None):
+        """Return ``(cost, depth)`` of the operation that would be executed."""
+        operation = get_operation_ast(document, operation_name)
+        if operation is None:
+            return 0, 0
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.variables = get_variable_values(
+            self.schema, operation.variable_definitions or [], variables or {}
+        )
+        if isinstance(self.variables, list):
+            # Invalid variables are reported by execution, which stops before resolving
+            self.variables = {}
+        root = self.schema.get_root_type(operation.operation)
+        return self.selection_cost(root, operation.selection_set)
+
+    def selection_cost(self, parent_type, selection_set, fragments=frozenset()):
+        cost = depth = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_cost, field_depth = self.field_cost(parent_type, selection, fragments)
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                type_ = self.schema.get_type(condition.name.value) if condition else parent_type
+                field_cost, field_depth = self.selection_cost(type_, selection.selection_set, fragments)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in fragments:
+                    continue
+                type_ = self.schema.get_type(fragment.type_condition.name.value)
+                field_cost, field_depth = self.selection_cost(
+                    type_, fragment.selection_set, fragments | {name}
+                )
+            else:
+                continue
+            cost += field_cost
+            depth = max(depth, field_depth)
+        return cost, depth
+
+    def field_cost(self, parent_type, node, fragments):
+        field = getattr(parent_type, 'fields', {}).get(node.name.value)
+        if field is None or node.selection_set is None:
+            # Scalars and introspection fields
+            return 0, 0
+        cost, depth = self.selection_cost(get_named_type(field.type), node.selection_set, fragments)
+        if is_connection_plumbing(parent_type):
+            return cost, depth
+        return 1 + self.page_size(field, node) * cost, 1 + depth
+
+    def page_size(self, field, node):
+        if 'first' not in field.args and 'last' not in field.args:
+            return 1
+        try:
+            args = get_argument_values(field, node, self.variables)
+        except GraphQLError:
+            args = {}
+        sizes = [args[name] for name in ('first', 'last') if args.get(name) is not None]
+        return max(min(sizes), 0) if sizes else self.default_page_size
+
+
+class TokenBucket:
+    """
+    Per-client cost budget that refills continuously.
+
+    Buckets live in the Django cache so workers sharing a cache share budgets;
+    with a non-atomic cache backend concurrent requests can overdraw slightly.
+    """
+
+    def __init__(self, capacity=CLIENT_BUDGET, refill_rate=CLIENT_BUDGET_REFILL_RATE,
+                 prefix='crm:budget:'):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def key(self, client_id):
+        return self.prefix + hashlib.sha256(str(client_id).encode('utf-8')).hexdigest()
+
+    def consume(self, client_id, amount):
+        """
+        Take ``amount`` tokens from ``client_id``'s bucket.
+
+        Returns ``(allowed, remaining, retry_after)``; nothing is taken when the
+        bucket cannot cover ``amount``, and ``retry_after`` says in how many
+        seconds it will.
+        """
+        key = self.key(client_id)
+        with self._lock:
+            now = time.time()
+            tokens, updated = cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            allowed = amount <= tokens
+            if allowed:
+                tokens -= amount
+            # Idle buckets expire once they would have refilled anyway
+            cache.set(key, (tokens, now), timeout=math.ceil(self.capacity / self.refill_rate) + 1)
+        retry_after = 0 if allowed else math.ceil((min(amount, self.capacity) - tokens) / self.refill_rate)
+        return allowed, int(tokens), retry_after
+
+    def clear(self, client_id):
+        cache.delete(self.key(client_id))
@@ -1,54 +1,45 @@
-import os
 from datetime import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 from requests.exceptions import ConnectionError
-from gql.transport.exceptions import TransportQueryError
 
-LOG_FILE = "/tmp/crm_heartbeat_log.txt"
+from .client import GRAPHQL_ENDPOINT, GraphQLClientError, get_client
+from .metrics import cron_job
 
-GRAPHQL_ENDPOINT = os.environ.get("GRAPHQL_ENDPOINT", "http://127.0.0.1:8000/graphql/")
+LOG_FILE = "/tmp/crm_heartbeat_log.txt"
 
 
+@cron_job
 def log_crm_heartbeat():
     """
-    Logs a heartbeat message by executing a live query against the GraphQL endpoint.
+    Logs a heartbeat message by executing a live query against the GraphQL schema.
     """
     now = datetime.now()
     timestamp = now.strftime("%d/%m/%Y-%H:%M:%S")
 
     gql_status = ""
+    error = None
 
     try:
-        # 1. Set up the transport
-        transport = RequestsHTTPTransport(
-            url=GRAPHQL_ENDPOINT,
-            verify=False,  # Set to True in production with valid SSL
-            retries=3,
-        )
-
-        # 2. Create the GQL client
-        client = Client(transport=transport, fetch_schema_from_transport=False)
+        # 1. Get the shared client (in-process unless GRAPHQL_TRANSPORT=http)
+        client = get_client()
 
-        # 3. Define the simple "hello" query
-        query = gql("{ hello }")
-
-        # 4. Execute the query
-        result = client.execute(query)
+        # 2. Execute the simple "hello" query
+        result = client.execute("{ hello }")
 
         if result and result.get('hello'):
             gql_status = f"GraphQL OK ({result.get('hello')})"
         else:
             gql_status = f"GraphQL query returned unexpected data: {result}"
 
-    except ConnectionError:
+    except ConnectionError as e:
         # This error happens if the server is not running
+        error = e
         gql_status = f"GraphQL Error: Connection refused at {GRAPHQL_ENDPOINT} (Server is down)"
     except Exception as e:
         # Catch any other exceptions (e.g., query errors, timeouts)
+        error = e
         gql_status = f"GraphQL Exception: {e}"
 
-    # 5. Format the final log message and append to file
+    # 3. Format the final log message and append to file
     message = f"{timestamp} CRM is alive. {gql_status}\n"
 
     try:
@@ -58,75 +49,76 @@ def log_crm_heartbeat():
         # Fallback if logging to file fails
         print(f"Error writing to {LOG_FILE}: {e}")
 
+    # 4. Re-raise once logged so the run is recorded as failed
+    if error:
+        raise error
+
 LOW_STOCK_LOG_FILE = "/tmp/low_stock_updates_log.txt"
 
+UPDATE_LOW_STOCK_MUTATION = """
+    mutation UpdateStock {
+      updateLowStockProducts(summaryOnly: true) {
+        count
+        units
+        message
+      }
+    }
+"""
 
+
+@cron_job
 def update_low_stock():
     """
     Executes the UpdateLowStockProducts mutation via GraphQL
-    and logs the updated products.
+    and logs how many products were restocked.
     """
     now = datetime.now()
     timestamp = now.strftime("%d/%m/%Y-%H:%M:%S")
     log_messages = [f"--- Cron Job Start: {timestamp} ---"]
+    error = None
 
     try:
-        # 1. Set up transport
-        transport = RequestsHTTPTransport(
-            url=GRAPHQL_ENDPOINT,
-            verify=False,
-            retries=3,
-        )
-
-        # 2. Create client
-        client = Client(transport=transport, fetch_schema_from_transport=False)
-
-        # 3. Define the mutation query
-        mutation = gql("""
-            mutation UpdateStock {
-              updateLowStockProducts {
-                products {
-                  name
-                  stock
-                }
-                message
-              }
-            }
-        """)
-
-        # 4. Execute the mutation
-        result = client.execute(mutation)
-
-        # 5. Process and log the result
+        # 1. Get the shared client (in-process unless GRAPHQL_TRANSPORT=http)
+        client = get_client()
+
+        # 2. Execute the mutation
+        result = client.execute(UPDATE_LOW_STOCK_MUTATION)
+
+        # 3. Process and log the result
         if result and 'updateLowStockProducts' in result:
             data = result['updateLowStockProducts']
             log_messages.append(f"GraphQL OK: {data.get('message')}")
 
-            products = data.get('products', [])
-            if products:
-                log_messages.append("Updated products:")
-                for prod in products:
-                    log_messages.append(f"  - Name: {prod.get('name')}, New Stock: {prod.get('stock')}")
+            # Only the summary: the restocked products of a large catalog would not fit a log line
+            if data.get('count'):
+                log_messages.append(f"Restocked products: {data.get('count')}, units added: {data.get('units')}")
             else:
                 log_messages.append("No products were updated.")
         else:
             log_messages.append(f"GraphQL query returned unexpected data: {result}")
 
-    except ConnectionError:
+    except ConnectionError as e:
+        error = e
         log_messages.append(f"GraphQL Error: Connection refused at {GRAPHQL_ENDPOINT} (Server is down)")
-    except TransportQueryError as e:
+    except GraphQLClientError as e:
         # Catches errors from the GraphQL server (e.g., mutation failed)
+        error = e
         log_messages.append(f"GraphQL Query Error: {e}")
     except Exception as e:
+        error = e
         log_messages.append(f"General Exception: {e}")
 
     log_messages.append(f"--- Cron Job End: {datetime.now().strftime('%d/%m/%Y-%H:%M:%S')} ---")
 
-    # 6. Write all messages to the log file
+    # 4. Write all messages to the log file
     try:
         with open(LOW_STOCK_LOG_FILE, "a") as f:
             for line in log_messages:
                 f.write(f"{line}\n")
     except Exception as e:
         # Fallback if logging fails
-        print(f"Error writing to {LOW_STOCK_LOG_FILE}: {e}")
\ No newline at end of file
+        print(f"Error writing to {LOW_STOCK_LOG_FILE}: {e}")
+
+    # 5. Re-raise once logged so the run is recorded as failed
+    if error:
+        raise error
@@ -9,49 +9,61 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 django.setup()
 
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+from django.utils import timezone
 
+from crm.client import get_client
+from crm.metrics import cron_job
 
-def send_order_reminders():
-    # Calculate date 7 days ago
-    seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-
-    # Setup GraphQL client
-    transport = RequestsHTTPTransport(
-        url='http://localhost:8000/graphql',
-        use_json=True,
-    )
-
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # Define GraphQL query
-    query = gql("""
-        query GetPendingOrders($startDate: String!) {
-            orders(orderDate_Gte: $startDate) {
-                id
-                orderDate
-                customer {
-                    email
+# Define GraphQL query
+PENDING_ORDERS_QUERY = """
+    query GetPendingOrders($startDate: DateTime!, $after: String) {
+        allOrders(orderDate_Gte: $startDate, first: 100, after: $after) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    id
+                    orderDate
+                    customer {
+                        email
+                    }
                 }
             }
         }
-    """)
+    }
+"""
 
-    try:
-        # Execute query
-        result = client.execute(query, variable_values={"startDate": seven_days_ago})
 
+@cron_job
+def send_order_reminders():
+    # Calculate date 7 days ago
+    seven_days_ago = (timezone.now() - timedelta(days=7)).isoformat()
+
+    # Shared client: runs in-process against the schema unless GRAPHQL_TRANSPORT=http
+    client = get_client()
+
+    try:
         # Get current timestamp
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        # Log reminders
+        # Log reminders, one keyset page at a time
         with open('/tmp/order_reminders_log.txt', 'a') as log_file:
-            for order in result.get('orders', []):
-                order_id = order['id']
-                customer_email = order['customer']['email']
-                log_entry = f"[{timestamp}] Order ID: {order_id}, Customer Email: {customer_email}\n"
-                log_file.write(log_entry)
+            after = None
+            while True:
+                result = client.execute(PENDING_ORDERS_QUERY, {"startDate": seven_days_ago, "after": after})
+                for edge in result['allOrders']['edges']:
+                    order = edge['node']
+                    order_id = order['id']
+                    customer_email = order['customer']['email']
+                    log_entry = f"[{timestamp}] Order ID: {order_id}, Customer Email: {customer_email}\n"
+                    log_file.write(log_entry)
+
+                page_info = result['allOrders']['pageInfo']
+                if not page_info['hasNextPage']:
+                    break
+                after = page_info['endCursor']
 
         print("Order reminders processed!")
 
@@ -60,6 +72,8 @@ def send_order_reminders():
         with open('/tmp/order_reminders_log.txt', 'a') as log_file:
             log_file.write(f"[{timestamp}] ERROR: {str(e)}\n")
         print(f"Error processing reminders: {e}")
+        # Re-raise so the run is recorded as failed
+        raise
 
 
 if __name__ == "__main__":
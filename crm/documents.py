@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql import parse
+from graphql.validation import validate
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class DocumentCache:
+    """
+    Bounded LRU of parsed documents and their validation errors.
+
+    Entries are keyed by the sha256 of the query text, so the dozen operations
+    our clients repeat are parsed and validated once per process. Syntax errors
+    are not cached.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, query, rules=None, max_errors=None):
+        """Return ``(document, validation_errors)`` for ``query``."""
+        key = (query_hash(query), tuple(rules) if rules else None)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        document = parse(query)
+        entry = (document, validate(schema, document, rules, max_errors))
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+document_cache = DocumentCache(getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 512))
+
+
+class PersistedQueryError(Exception):
+    pass
+
+
+class PersistedQueries:
+    """
+    Automatic Persisted Queries (``extensions.persistedQuery.sha256Hash``).
+
+    Hashes learned from clients are kept in Django's cache. When
+    ``GRAPHQL_PERSISTED_QUERIES_ONLY`` is set only the hashes listed in the
+    ``GRAPHQL_PERSISTED_QUERIES_MANIFEST`` JSON file (``{hash: query}``) are
+    accepted and full query text is rejected.
+    """
+
+    CACHE_PREFIX = 'crm:apq:'
+
+    def __init__(self, manifest_path=None, locked=False):
+        self.locked = locked
+        self.manifest = {}
+        if manifest_path:
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def lookup(self, sha256_hash):
+        query = self.manifest.get(sha256_hash)
+        if query is None and not self.locked:
+            query = cache.get(self.CACHE_PREFIX + sha256_hash)
+        return query
+
+    def register(self, sha256_hash, query):
+        if query_hash(query) != sha256_hash:
+            raise PersistedQueryError("provided sha does not match query")
+        if self.locked:
+            if sha256_hash not in self.manifest:
+                raise PersistedQueryError("PersistedQueryNotAllowed")
+            return
+        cache.set(self.CACHE_PREFIX + sha256_hash, query, None)
+
+    def resolve(self, query, extensions):
+        """Return the query text to execute for a request's ``query`` and ``extensions``."""
+        persisted = (extensions or {}).get('persistedQuery')
+        if not persisted:
+            if query and self.locked and query_hash(query) not in self.manifest:
+                raise PersistedQueryError("PersistedQueryNotAllowed")
+            return query
+        if persisted.get('version') != 1:
+            raise PersistedQueryError("Unsupported persisted query version")
+        sha256_hash = persisted.get('sha256Hash', '')
+        if query:
+            self.register(sha256_hash, query)
+            return query
+        query = self.lookup(sha256_hash)
+        if query is None:
+            raise PersistedQueryError("PersistedQueryNotFound")
+        return query
+
+
+persisted_queries = PersistedQueries(
+    manifest_path=getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_MANIFEST', None),
+    locked=getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_ONLY', False),
+)
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .broadcast import broadcast
+from .models import Product
+
+ORDERS_CHANNEL = 'orders'
+STOCK_CHANNEL = 'stock'
+
+
+def orders_created(orders):
+    """Announce ``orders`` to ``orderCreated`` subscribers once the transaction commits."""
+    pks = [order.pk for order in orders]
+
+    def publish():
+        for pk in pks:
+            broadcast.publish(ORDERS_CHANNEL, {'id': pk})
+
+    transaction.on_commit(publish)
+
+
+def stock_changed(product_pks):
+    """Announce the committed stock and effective reorder point of ``product_pks`` to stock subscribers."""
+    pks = list(product_pks)
+
+    def publish():
+        # Inventory publishes through this module, so its default is imported late
+        from .inventory import REORDER_POINT
+
+        # Read after commit, and only when someone listens
+        if not pks or not broadcast.has_subscribers(STOCK_CHANNEL):
+            return
+        products = Product.objects.filter(pk__in=pks).annotate(
+            point=Coalesce('reorder_point', Value(REORDER_POINT)),
+        )
+        for pk, stock, point in products.values_list('pk', 'stock', 'point'):
+            broadcast.publish(STOCK_CHANNEL, {'id': pk, 'stock': stock, 'reorder_point': point})
+
+    transaction.on_commit(publish)
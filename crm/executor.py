@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from graphql import ExecutionContext
+
+# Threads running ORM work for the async view, each with its own DB connection
+ASYNC_WORKERS = getattr(settings, 'GRAPHQL_ASYNC_WORKERS', 8)
+
+executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='graphql')
+
+
+def release_connections():
+    """
+    Keep the worker's connections for its next task, unless an error broke them.
+
+    Reconnecting on every task would cost more than the work it runs, and the
+    bounded pool already caps the connections at ``ASYNC_WORKERS``.
+    """
+    for conn in connections.all(initialized_only=True):
+        if conn.errors_occurred:
+            if conn.is_usable():
+                conn.errors_occurred = False
+            else:
+                conn.close()
+
+
+def run_sync(func):
+    """``func`` as a coroutine function running on the bounded ``executor``."""
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release_connections()
+    return sync_to_async(call, thread_sensitive=False, executor=executor)
+
+
+class ThreadedExecutionContext(ExecutionContext):
+    """
+    Resolves every root field, with everything below it, in its own worker thread.
+
+    The root fields of a query are independent, so graphql-core awaits them
+    concurrently; below the root, resolution stays synchronous so DataLoaders
+    batch exactly as in the sync view. Not for mutations, whose fields must run
+    serially inside the transaction of a single connection.
+    """
+
+    def execute_field(self, parent_type, source, field_nodes, path):
+        if path.prev is not None:
+            return super().execute_field(parent_type, source, field_nodes, path)
+        return run_sync(self.execute_root_field)(parent_type, source, field_nodes, path)
+
+    def execute_root_field(self, parent_type, source, field_nodes, path):
+        trace = getattr(self.context_value, 'trace', None)
+        # Execute wrappers are per connection, and so per thread
+        with connection.execute_wrapper(trace) if trace is not None else nullcontext():
+            return super().execute_field(parent_type, source, field_nodes, path)
@@ -0,0 +1,203 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .filters import CustomerFilter, OrderFilter, ProductFilter
+from .metrics import Counter
+from .models import Customer, Order, OrderLine, Product
+from .search import get_search_backend, search_orders
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'CRM_EXPORT_CHUNK_SIZE', 2000)
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+export_rows = Counter(
+    'crm_export_rows_total',
+    'Rows written by streaming exports.',
+    labelnames=('export', 'format'),
+)
+
+
+class Column:
+    """
+    One export column: how to read it from a row, and what the queryset must
+    fetch for that (``select_related`` / ``prefetch_related`` lookups).
+    """
+
+    def __init__(self, value, select=None, prefetch=None):
+        self.value = value
+        self.select = select
+        self.prefetch = prefetch
+
+
+def attribute(name):
+    return Column(lambda instance: getattr(instance, name))
+
+
+# Lines of an order, and their products, come from one prefetch per chunk
+ORDER_LINES = Prefetch('lines', queryset=OrderLine.objects.select_related('product').only(
+    'order_id', 'quantity', 'unit_price', 'product__id', 'product__name',
+).order_by('product_id'))
+
+
+def order_lines(read):
+    return Column(lambda order: [read(line) for line in order.lines.all()], prefetch=ORDER_LINES)
+
+
+class Export:
+    """A model, the FilterSet scoping its rows (as on its connection) and its columns."""
+
+    def __init__(self, model, filterset_class, columns, search):
+        self.model = model
+        self.filterset_class = filterset_class
+        self.columns = columns
+        self.search = search
+
+    def parse_columns(self, fields):
+        """Columns named in ``fields`` (comma separated or a list), or all of them."""
+        if not fields:
+            return list(self.columns)
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        names = [name.strip() for name in fields if name.strip()]
+        unknown = [name for name in names if name not in self.columns]
+        if unknown:
+            raise ValidationError(
+                f"Unknown columns: {', '.join(unknown)}. Available: {', '.join(self.columns)}"
+            )
+        return names
+
+    def queryset(self, filters=None, search=None, columns=None):
+        """Rows matching the FilterSet ``filters`` and ``search``, fetching only what ``columns`` need."""
+        filterset = self.filterset_class(data=filters or {}, queryset=self.model.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(
+                '; '.join(f"{name}: {' '.join(errors)}" for name, errors in filterset.errors.items())
+            )
+        queryset = filterset.qs
+        if search:
+            queryset = self.search(queryset, search)
+
+        columns = [self.columns[name] for name in columns or self.columns]
+        select = {column.select for column in columns if column.select}
+        prefetch = {column.prefetch for column in columns if column.prefetch}
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        # Primary key order walks the table once and keeps exports repeatable
+        return queryset.order_by('pk')
+
+    def rows(self, queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+        """Yield one dict per row; at most ``chunk_size`` rows (and their prefetches) are in memory."""
+        readers = [(name, self.columns[name].value) for name in columns]
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            yield {name: value(instance) for name, value in readers}
+
+
+EXPORTS = {
+    'customers': Export(
+        Customer, CustomerFilter,
+        {
+            'id': attribute('pk'),
+            'name': attribute('name'),
+            'email': attribute('email'),
+            'phone': attribute('phone'),
+            'created_at': attribute('created_at'),
+            'updated_at': attribute('updated_at'),
+        },
+        search=lambda queryset, text: get_search_backend().matching(queryset, text),
+    ),
+    'products': Export(
+        Product, ProductFilter,
+        {
+            'id': attribute('pk'),
+            'name': attribute('name'),
+            'price': attribute('price'),
+            'stock': attribute('stock'),
+            'reorder_point': attribute('reorder_point'),
+            'reorder_quantity': attribute('reorder_quantity'),
+            'created_at': attribute('created_at'),
+            'updated_at': attribute('updated_at'),
+        },
+        search=lambda queryset, text: get_search_backend().matching(queryset, text),
+    ),
+    'orders': Export(
+        Order, OrderFilter,
+        {
+            'id': attribute('pk'),
+            'order_date': attribute('order_date'),
+            'total_amount': attribute('total_amount'),
+            'customer_id': attribute('customer_id'),
+            'customer_name': Column(lambda order: order.customer.name, select='customer'),
+            'customer_email': Column(lambda order: order.customer.email, select='customer'),
+            'product_ids': order_lines(lambda line: line.product_id),
+            'product_names': order_lines(lambda line: line.product.name),
+            'quantities': order_lines(lambda line: line.quantity),
+            'unit_prices': order_lines(lambda line: line.unit_price),
+        },
+        search=search_orders,
+    ),
+}
+
+
+class Echo:
+    """File-like object handing back what csv.writer writes, so rows can be yielded."""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv_value(value):
+    # Lists become one cell; csv quotes it if needed
+    if isinstance(value, (list, tuple)):
+        return ';'.join(str(item) for item in value)
+    return value
+
+
+def render(rows, columns, format):
+    """Yield the export as text lines in ``format`` (``ndjson`` or ``csv``)."""
+    if format == 'ndjson':
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+    elif format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([encode_csv_value(row[name]) for name in columns])
+    else:
+        raise ValidationError(f"Unknown format {format}; use one of: {', '.join(FORMATS)}")
+
+
+def export(name, format, filters=None, search=None, fields=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream the rows of export ``name`` as ``format`` text lines.
+
+    Invalid names, filters or columns raise ``ValidationError`` before anything
+    is yielded, so callers can still report them.
+    """
+    if name not in EXPORTS:
+        raise ValidationError(f"Unknown export {name}; use one of: {', '.join(EXPORTS)}")
+    if format not in FORMATS:
+        raise ValidationError(f"Unknown format {format}; use one of: {', '.join(FORMATS)}")
+    definition = EXPORTS[name]
+    columns = definition.parse_columns(fields)
+    queryset = definition.queryset(filters, search, columns)
+    rows = counted(definition.rows(queryset, columns, chunk_size), name, format)
+    return render(rows, columns, format)
+
+
+def counted(rows, name, format):
+    count = 0
+    try:
+        for row in rows:
+            yield row
+            count += 1
+    finally:
+        export_rows.inc(count, (name, format))
@@ -0,0 +1,135 @@
+from functools import partial
+
+from django.db.models.query import QuerySet
+from graphene_django.filter import DjangoFilterConnectionField
+
+from .loaders import get_loaders
+from .optimizer import optimize_queryset, sub_fields
+from .pagination import is_keyset_cursor, keyset_connection, offset_connection, supports_keyset
+
+
+class CRMConnectionField(DjangoFilterConnectionField):
+    """
+    Filterable relay connection used throughout the CRM schema.
+
+    Nodes of every page are registered with the request's DataLoaders so their
+    relations batch together. Passing ``loader`` resolves a relation connection
+    (e.g. ``Customer.orders``) through that loader instead of one query per parent.
+    Passing ``optimize=True`` restricts the queryset to what the selection set reads,
+    and ``keyset=True`` pages by seeking on the ordering columns instead of OFFSET.
+    Offset pages read forwards skip ``COUNT(*)`` unless ``totalCount`` is selected.
+    ``order_by`` and ``search`` argument types are exposed to clients as field arguments.
+    """
+
+    def __init__(self, type_, *args, loader=None, optimize=False, keyset=False, order_by=None,
+                 search=None, **kwargs):
+        self.loader = loader
+        self.optimize = optimize
+        self.keyset = keyset
+        super().__init__(type_, *args, **kwargs)
+        for name, arg in (('order_by', order_by), ('search', search)):
+            if arg is not None:
+                self._base_args = {**(self._base_args or {}), name: arg}
+
+    def resolve_batched(self, parent_resolver, root, info, **args):
+        # Filtered relations still go through the related manager and the FilterSet
+        if any(args.get(name) is not None for name in self.filtering_args):
+            return parent_resolver(root, info, **args)
+        return getattr(get_loaders(info), self.loader).load(root.pk)
+
+    def wrap_resolve(self, parent_resolver):
+        resolver = self.resolver or parent_resolver
+        if self.loader:
+            resolver = partial(self.resolve_batched, resolver)
+        return partial(
+            self.connection_resolver,
+            resolver,
+            self.connection_type,
+            self.get_manager(),
+            self.get_queryset_resolver(),
+            self.max_limit,
+            self.enforce_first_or_last,
+            keyset=self.keyset,
+        )
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class,
+                         optimize=False):
+        if isinstance(iterable, list):
+            # Already loaded (and unfiltered) by a DataLoader
+            return iterable
+        qs = super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+        if optimize:
+            qs = optimize_queryset(qs, info)
+        return qs
+
+    def get_queryset_resolver(self):
+        return partial(super().get_queryset_resolver(), optimize=self.optimize)
+
+    @staticmethod
+    def wants_keyset(args):
+        # Offsets and offset cursors from before keyset mode keep the offset path
+        if args.get('offset') is not None:
+            return False
+        cursors = [args[name] for name in ('after', 'before') if args.get(name)]
+        return all(is_keyset_cursor(cursor) for cursor in cursors)
+
+    @staticmethod
+    def wants_count(info, args):
+        # Pages counted back from the end need the row count to place their cursors
+        if args.get('last') is not None or args.get('before'):
+            return True
+        return 'totalCount' in sub_fields(info, info.field_nodes)
+
+    @classmethod
+    def paginated_connection_resolver(cls, paginate, resolver, connection, default_manager,
+                                      queryset_resolver, max_limit, enforce_first_or_last, root,
+                                      info, **args):
+        first = args.get('first')
+        last = args.get('last')
+
+        if enforce_first_or_last:
+            assert first or last, (
+                "You must provide a `first` or `last` value to properly paginate the `{}` connection."
+            ).format(info.field_name)
+
+        if max_limit:
+            for name, value in (('first', first), ('last', last)):
+                assert value is None or value <= max_limit, (
+                    "Requesting {} records on the `{}` connection exceeds the `{}` limit of {} records."
+                ).format(value, info.field_name, name, max_limit)
+
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = default_manager
+        iterable = queryset_resolver(connection, iterable, info, args)
+        if not isinstance(iterable, QuerySet):
+            return cls.resolve_connection(connection, args, iterable, max_limit=max_limit)
+        if (
+            paginate is keyset_connection
+            and not args.get('after') and not args.get('before')
+            and not supports_keyset(iterable)
+        ):
+            # Related or unknown orderings page by offset, as before keyset mode
+            if cls.wants_count(info, args):
+                return cls.resolve_connection(connection, args, iterable, max_limit=max_limit)
+            paginate = offset_connection
+        return paginate(connection, iterable, args, max_limit=max_limit)
+
+    @classmethod
+    def connection_resolver(cls, resolver, connection, default_manager, queryset_resolver,
+                            max_limit, enforce_first_or_last, root, info, keyset=False, **args):
+        if keyset and cls.wants_keyset(args):
+            resolve = partial(cls.paginated_connection_resolver, keyset_connection)
+        elif not cls.wants_count(info, args):
+            resolve = partial(cls.paginated_connection_resolver, offset_connection)
+        else:
+            resolve = super().connection_resolver
+        result = resolve(
+            resolver, connection, default_manager, queryset_resolver,
+            max_limit, enforce_first_or_last, root, info, **args
+        )
+        get_loaders(info).register(edge.node for edge in result.edges)
+        return result
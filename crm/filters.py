@@ -1,21 +1,37 @@
 import django_filters
-from .models import Customer, Product, Order
+from .models import Customer, Product, Order, OrderLine
+from .search import get_search_backend
 
 
-class CustomerFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(lookup_expr='icontains')
-    email = django_filters.CharFilter(lookup_expr='icontains')
+class SearchFilterMixin:
+    """Answers substring filters from the search backend's index instead of LIKE '%x%'."""
+
+    def filter_contains(self, queryset, name, value):
+        if not value:
+            return queryset
+        return get_search_backend().filter(queryset, value, [name])
+
+
+class CustomerFilter(SearchFilterMixin, django_filters.FilterSet):
+    name = django_filters.CharFilter(method='filter_contains')
+    email = django_filters.CharFilter(method='filter_contains')
     created_at__gte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='gte')
     created_at__lte = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lte')
-    phone_pattern = django_filters.CharFilter(field_name='phone', lookup_expr='startswith')
+    phone_pattern = django_filters.CharFilter(field_name='phone', method='filter_phone_prefix')
 
     class Meta:
         model = Customer
         fields = ['name', 'email', 'created_at', 'phone']
 
+    def filter_phone_prefix(self, queryset, name, value):
+        # A range instead of LIKE 'x%' so the phone index is usable on every backend
+        if not value:
+            return queryset
+        return queryset.filter(**{f'{name}__gte': value, f'{name}__lt': value + '\U0010ffff'})
 
-class ProductFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(lookup_expr='icontains')
+
+class ProductFilter(SearchFilterMixin, django_filters.FilterSet):
+    name = django_filters.CharFilter(method='filter_contains')
     price__gte = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     price__lte = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
     stock__gte = django_filters.NumberFilter(field_name='stock', lookup_expr='gte')
@@ -32,10 +48,24 @@ class OrderFilter(django_filters.FilterSet):
     total_amount__lte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lte')
     order_date__gte = django_filters.DateTimeFilter(field_name='order_date', lookup_expr='gte')
     order_date__lte = django_filters.DateTimeFilter(field_name='order_date', lookup_expr='lte')
-    customer_name = django_filters.CharFilter(field_name='customer__name', lookup_expr='icontains')
-    product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains')
+    customer_name = django_filters.CharFilter(method='filter_customer_name')
+    product_name = django_filters.CharFilter(method='filter_product_name')
     product_id = django_filters.NumberFilter(field_name='products__id', lookup_expr='exact')
 
     class Meta:
         model = Order
         fields = ['total_amount', 'order_date', 'customer_name', 'product_name']
+
+    def filter_customer_name(self, queryset, name, value):
+        if not value:
+            return queryset
+        customers = get_search_backend().filter(Customer.objects.all(), value, ['name'])
+        return queryset.filter(customer__in=customers.values('pk'))
+
+    def filter_product_name(self, queryset, name, value):
+        # A subquery rather than a join on products, which repeated orders once per match
+        if not value:
+            return queryset
+        products = get_search_backend().filter(Product.objects.all(), value, ['name'])
+        lines = OrderLine.objects.filter(product__in=products.values('pk'))
+        return queryset.filter(pk__in=lines.values('order_id'))
@@ -0,0 +1,488 @@
+import csv
+import gzip
+import json
+import os
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import EmailValidator
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .bulk import chunked, insert_rows, missing_products_message
+from .metrics import Counter
+from .models import Customer, ImportCheckpoint, Order, OrderLine, Product
+from .response_cache import models_changed
+from .rollups import recompute_sales_rollups
+from .schema import validate_phone
+from .search import bulk_indexing
+from .stats import record_orders
+
+IMPORT_BATCH_SIZE = getattr(settings, 'CRM_IMPORT_BATCH_SIZE', 20000)
+
+import_rows = Counter(
+    'crm_import_rows_total',
+    'Rows read by crm_import by result.',
+    labelnames=('import', 'result'),
+)
+
+
+class ImportEmailValidator(EmailValidator):
+    """``validate_email`` remembering which domains passed; an import sees few distinct ones."""
+
+    # EmailValidator defines __eq__ only; lru_cache keys on the instance
+    __hash__ = object.__hash__
+
+    @lru_cache(maxsize=1024)
+    def validate_domain_part(self, domain_part):
+        return super().validate_domain_part(domain_part)
+
+
+validate_email = ImportEmailValidator()
+
+
+def detect_format(path):
+    """``csv`` or ``ndjson`` from a file name, looking past a ``.gz`` suffix."""
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return None
+
+
+def open_source(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(stream, format):
+    """
+    Yield one mapping per record of ``stream``.
+
+    CSV values are strings and lists are ``;`` separated, as ``export_crm``
+    writes them. An NDJSON line that does not decode is yielded as the
+    ``ValidationError`` to report for it, so record numbers stay stable.
+    """
+    if format == 'csv':
+        reader = csv.reader(stream)
+        header = next(reader, [])
+        for record in reader:
+            yield dict(zip(header, record))
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield ValidationError(f"Invalid JSON: {e}")
+            continue
+        yield row if isinstance(row, dict) else ValidationError("Each line must be a JSON object")
+
+
+def value(row, name):
+    """The value of column ``name``, with empty CSV cells and JSON nulls as ``None``."""
+    found = row.get(name)
+    return None if found == '' else found
+
+
+def parse_int(row, name):
+    return to_int(value(row, name), name)
+
+
+def to_int(raw, name):
+    if raw is None or raw == '':
+        return None
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid {name}: {raw}")
+
+
+def parse_decimal(row, name):
+    return to_decimal(value(row, name), name)
+
+
+def to_decimal(raw, name):
+    if raw is None or raw == '':
+        return None
+    try:
+        number = Decimal(str(raw))
+    except InvalidOperation:
+        raise ValidationError(f"Invalid {name}: {raw}")
+    if not number.is_finite():
+        raise ValidationError(f"Invalid {name}: {raw}")
+    return number
+
+
+def parse_timestamp(row, name):
+    raw = value(row, name)
+    if raw is None:
+        return None
+    parsed = parse_datetime(str(raw))
+    if parsed is None:
+        raise ValidationError(f"Invalid {name}: {raw}")
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_list(row, name):
+    raw = value(row, name)
+    if raw is None:
+        return []
+    if isinstance(raw, str):
+        return [item.strip() for item in raw.split(';') if item.strip()]
+    if isinstance(raw, list):
+        return raw
+    raise ValidationError(f"Invalid {name}: {raw}")
+
+
+def require(row, name):
+    found = value(row, name)
+    if found is None or not str(found).strip():
+        raise ValidationError(f"{name} is required")
+    return found
+
+
+def write_rows(model, names, rows):
+    """
+    Insert ``[pk, *values]`` rows of ``model`` (database values for the fields
+    ``names``) and add them to its search index; call inside a transaction.
+    """
+    opts = model._meta
+    fields = [opts.pk] + [opts.get_field(name) for name in names]
+    with bulk_indexing(model) as index:
+        insert_rows(opts.db_table, fields, rows)
+        index(row[0] for row in rows)
+
+
+def reset_sequences(*models):
+    """Move primary key sequences past explicitly inserted keys, as ``loaddata`` does."""
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+class Importer:
+    """
+    Validates rows of one model and inserts them in batches.
+
+    Existing keys are loaded once into in-memory maps, so duplicate and foreign
+    key checks cost no queries. ``prepare`` turns a row into ``[pk, *values]``
+    (database values for ``fields``) and ``save`` writes a batch of them with
+    ``insert_rows``: ``bulk_create`` spends more time compiling each value than
+    SQLite spends inserting it.
+    """
+
+    model = None
+    # Columns ``prepare`` returns values for, after the primary key
+    fields = ()
+
+    def __init__(self):
+        self.started = timezone.now()
+        self.now = connection.ops.adapt_datetimefield_value(self.started)
+        self.pks = set(self.model.objects.values_list('pk', flat=True).iterator())
+        self.db_prep = {name: self.model._meta.get_field(name).get_db_prep_save for name in self.fields}
+
+    def prepare(self, row):
+        """Return ``[pk, *values]`` for ``row`` (``pk`` is ``None`` unless given) or raise ``ValidationError``."""
+        raise NotImplementedError
+
+    def db_value(self, name, value):
+        return self.db_prep[name](value, connection)
+
+    def claim_pk(self, row):
+        pk = parse_int(row, 'id')
+        if pk is not None:
+            if pk in self.pks:
+                raise ValidationError(f"{self.model._meta.verbose_name.capitalize()} ID already exists - {pk}")
+            self.pks.add(pk)
+        return pk
+
+    def timestamps(self, row, *names):
+        """Database values for the timestamp columns ``names``; missing ones are the import's start."""
+        values = []
+        for name in names:
+            parsed = parse_timestamp(row, name)
+            values.append(self.now if parsed is None else self.db_value(name, parsed))
+        return values
+
+    def assign_pks(self, rows):
+        # Handing out keys here lets related rows and the search index be
+        # written without reading ids back
+        next_pk = (self.model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        for row in rows:
+            if row[0] is None:
+                while next_pk in self.pks:
+                    next_pk += 1
+                row[0] = next_pk
+                self.pks.add(next_pk)
+
+    def save(self, rows):
+        """Insert prepared ``rows``; call inside a transaction."""
+        if not rows:
+            return
+        self.assign_pks(rows)
+        write_rows(self.model, self.fields, rows)
+        # Raw inserts send no post_save
+        models_changed(self.model)
+
+    def finish(self):
+        reset_sequences(self.model)
+
+
+class CustomerImporter(Importer):
+    """Customers, validated with the rules of ``CreateCustomer``; emails must be new."""
+
+    model = Customer
+    fields = ('name', 'email', 'phone', 'created_at', 'updated_at')
+
+    def __init__(self):
+        super().__init__()
+        self.emails = set(Customer.objects.values_list('email', flat=True).iterator())
+
+    def prepare(self, row):
+        name = require(row, 'name')
+        email = value(row, 'email')
+        validate_email(email)
+        if email in self.emails:
+            raise ValidationError(f"Email already exists - {email}")
+        phone = value(row, 'phone') or ''
+        validate_phone(phone)
+        timestamps = self.timestamps(row, 'created_at', 'updated_at')
+        prepared = [self.claim_pk(row), name, email, phone, *timestamps]
+        # Later duplicates within the file are rejected like existing rows
+        self.emails.add(email)
+        return prepared
+
+
+class ProductImporter(Importer):
+    """Products, validated with the rules of ``CreateProduct``."""
+
+    model = Product
+    fields = ('name', 'price', 'stock', 'reorder_point', 'reorder_quantity', 'created_at', 'updated_at')
+
+    def prepare(self, row):
+        name = require(row, 'name')
+        price = parse_decimal(row, 'price')
+        if price is None or price <= 0:
+            raise ValidationError("Price must be positive")
+        stock = parse_int(row, 'stock') or 0
+        if stock < 0:
+            raise ValidationError("Stock cannot be negative")
+        reorder_point = parse_int(row, 'reorder_point')
+        if reorder_point is not None and reorder_point < 0:
+            raise ValidationError("Reorder point cannot be negative")
+        reorder_quantity = parse_int(row, 'reorder_quantity')
+        if reorder_quantity is not None and reorder_quantity < 1:
+            raise ValidationError("Reorder quantity must be at least 1")
+        timestamps = self.timestamps(row, 'created_at', 'updated_at')
+        return [
+            self.claim_pk(row), name, self.db_value('price', price), stock, reorder_point, reorder_quantity,
+            *timestamps,
+        ]
+
+
+# What record_orders reads of an order
+OrderTotal = namedtuple('OrderTotal', 'customer_id total_amount order_date')
+
+
+class OrderImporter(Importer):
+    """
+    Orders as ``export_crm orders`` writes them.
+
+    The customer is matched by ``customer_id`` or else ``customer_email``, the
+    products by ``product_ids``, with the units and price of each in the
+    optional ``quantities`` and ``unit_prices`` lists. Without them every ID is
+    one unit at the product's current price. ``total_amount`` defaults to the
+    sum of the lines. Imported orders are history, so stock is not reserved.
+    """
+
+    model = Order
+    fields = ('customer_id', 'total_amount', 'order_date', 'created_at', 'updated_at')
+
+    def __init__(self):
+        super().__init__()
+        self.customers = dict(Customer.objects.values_list('email', 'pk').iterator())
+        self.customer_pks = set(self.customers.values())
+        self.prices = dict(Product.objects.values_list('pk', 'price').iterator())
+        self.line_price = OrderLine._meta.get_field('unit_price').get_db_prep_save
+        # Lines and statistics of the prepared rows, in the same order
+        self.lines = []
+        self.totals = []
+
+    def customer_pk(self, row):
+        pk = parse_int(row, 'customer_id')
+        if pk is not None:
+            if pk in self.customer_pks:
+                return pk
+        else:
+            pk = self.customers.get(value(row, 'customer_email'))
+            if pk is not None:
+                return pk
+        raise ValidationError("Invalid customer ID")
+
+    def order_lines(self, row):
+        """``{product_pk: [quantity, unit_price]}``; repeated products add up their units."""
+        product_ids = parse_list(row, 'product_ids')
+        quantities = parse_list(row, 'quantities') or [1] * len(product_ids)
+        unit_prices = parse_list(row, 'unit_prices') or [None] * len(product_ids)
+        if not len(product_ids) == len(quantities) == len(unit_prices):
+            raise ValidationError("quantities and unit_prices must match product_ids")
+        lines, missing = {}, []
+        for product_id, quantity, unit_price in zip(product_ids, quantities, unit_prices):
+            try:
+                pk = int(product_id)
+            except (TypeError, ValueError):
+                pk = None
+            if pk not in self.prices:
+                missing.append(product_id)
+                continue
+            quantity = to_int(quantity, 'quantity')
+            if quantity is None or quantity < 1:
+                raise ValidationError("Quantity must be at least 1")
+            unit_price = to_decimal(unit_price, 'unit_price')
+            if unit_price is not None and unit_price < 0:
+                raise ValidationError("Unit price cannot be negative")
+            line = lines.setdefault(pk, [0, self.prices[pk] if unit_price is None else unit_price])
+            line[0] += quantity
+        if missing:
+            raise ValidationError(missing_products_message(missing))
+        if not lines:
+            raise ValidationError("At least one product is required")
+        return lines
+
+    def prepare(self, row):
+        customer_pk = self.customer_pk(row)
+        lines = self.order_lines(row)
+        total_amount = parse_decimal(row, 'total_amount')
+        if total_amount is None:
+            total_amount = sum((price * quantity for quantity, price in lines.values()), Decimal('0.00'))
+        timestamps = self.timestamps(row, 'order_date', 'created_at', 'updated_at')
+        prepared = [self.claim_pk(row), customer_pk, self.db_value('total_amount', total_amount), *timestamps]
+        self.lines.append(lines)
+        self.totals.append(OrderTotal(customer_pk, total_amount, parse_timestamp(row, 'order_date') or self.started))
+        return prepared
+
+    def save(self, rows):
+        lines, self.lines = self.lines, []
+        totals, self.totals = self.totals, []
+        super().save(rows)
+        opts = OrderLine._meta
+        insert_rows(
+            opts.db_table, [opts.get_field(name) for name in ('order', 'product', 'quantity', 'unit_price')],
+            [
+                (row[0], product_pk, quantity, self.line_price(unit_price, connection))
+                for row, order_lines in zip(rows, lines) for product_pk, (quantity, unit_price) in order_lines.items()
+            ],
+        )
+        record_orders(totals)
+        # Imported orders keep their own updated_at, which may be behind the
+        # rollups' watermark, so their hours are recomputed here
+        recompute_sales_rollups(total.order_date for total in totals)
+
+
+IMPORTERS = {
+    'customers': CustomerImporter,
+    'products': ProductImporter,
+    'orders': OrderImporter,
+}
+
+
+class Checkpoint:
+    """
+    ``ImportCheckpoint`` row, named ``label``, recording how far an import got.
+
+    It is saved in the transaction of each batch, so a resumed import neither
+    skips nor replays a batch however it was interrupted. It names the source
+    file by path, size and modification time, so a resumed import cannot skip
+    records of a different file.
+    """
+
+    def __init__(self, label, name, source):
+        self.label = label
+        stat = os.stat(source)
+        self.key = {'import': name, 'source': os.path.abspath(source), 'size': stat.st_size,
+                    'mtime': stat.st_mtime}
+
+    def load(self):
+        """The saved progress (``offset``, ``created``, ``rejected``), or ``None``."""
+        state = ImportCheckpoint.objects.filter(label=self.label).values_list('state', flat=True).first()
+        if state is None:
+            return None
+        if {name: state.get(name) for name in self.key} != self.key:
+            raise ValidationError(
+                f"Checkpoint {self.label} belongs to another import or the file changed; "
+                "pass --restart to start over."
+            )
+        return state
+
+    def save(self, **progress):
+        """Record ``progress``; call inside the transaction that wrote it."""
+        ImportCheckpoint.objects.update_or_create(label=self.label, defaults={'state': {**self.key, **progress}})
+
+    def clear(self):
+        ImportCheckpoint.objects.filter(label=self.label).delete()
+
+
+class ImportResult:
+    def __init__(self, offset=0, created=0, rejected=0):
+        self.offset = offset
+        self.created = created
+        self.rejected = rejected
+
+
+def run_import(name, rows, batch_size=IMPORT_BATCH_SIZE, checkpoint=None, on_error=None):
+    """
+    Import ``rows`` (mappings, see ``read_rows``) as ``name`` in batches of ``batch_size``.
+
+    Each batch is validated, then written and recorded in ``checkpoint`` in
+    one transaction; a saved checkpoint skips the records it covers. Rejected
+    records are passed to ``on_error(number, message)`` with their 1-based
+    number. Returns an ``ImportResult`` covering the resumed run too.
+    """
+    state = checkpoint.load() if checkpoint is not None else None
+    result = ImportResult(**{key: state[key] for key in ('offset', 'created', 'rejected')}) if state else ImportResult()
+    importer = IMPORTERS[name]()
+
+    rows = islice(rows, result.offset, None)
+    for batch in chunked(rows, batch_size):
+        prepared = []
+        rejected = 0
+        for number, row in enumerate(batch, result.offset + 1):
+            try:
+                if isinstance(row, ValidationError):
+                    raise row
+                prepared.append(importer.prepare(row))
+            except ValidationError as e:
+                rejected += 1
+                if on_error is not None:
+                    on_error(number, ' '.join(e.messages))
+        progress = {
+            'offset': result.offset + len(batch),
+            'created': result.created + len(prepared),
+            'rejected': result.rejected + rejected,
+        }
+        with transaction.atomic():
+            importer.save(prepared)
+            if checkpoint is not None:
+                checkpoint.save(**progress)
+
+        result = ImportResult(**progress)
+        import_rows.inc(len(prepared), (name, 'created'))
+        import_rows.inc(rejected, (name, 'rejected'))
+    importer.finish()
+    return result
@@ -0,0 +1,175 @@
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Max, Min, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .events import stock_changed
+from .models import Product
+from .response_cache import models_changed
+
+# Products below their reorder point, this one unless set, are restocked by
+# their reorder quantity; lowStockAlert without a threshold alerts at the same point
+REORDER_POINT = getattr(settings, 'CRM_REORDER_POINT', 10)
+REORDER_QUANTITY = getattr(settings, 'CRM_REORDER_QUANTITY', 10)
+# Products examined, and restocked, per transaction by restock_low_stock
+RESTOCK_CHUNK_SIZE = getattr(settings, 'CRM_RESTOCK_CHUNK_SIZE', 10000)
+
+# What a restock sweep did: ``products`` is None when not kept, ``cursor`` the
+# last product ID examined when it stopped early
+Restock = namedtuple('Restock', 'products count units cursor')
+
+
+class InsufficientStock(ValidationError):
+    """Raised when a reservation would take a product's stock below zero."""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        label = "Insufficient stock for product ID" if len(product_ids) == 1 else "Insufficient stock for product IDs"
+        super().__init__(f"{label}: {', '.join(str(pk) for pk in product_ids)}")
+
+
+@contextmanager
+def write_transaction():
+    """
+    ``transaction.atomic()`` for blocks that read rows and then write stock.
+
+    SQLite has no row locks: a transaction that read before writing fails at
+    once, rather than waiting on the busy timeout, when another writer got the
+    write lock first. An outermost block therefore begins ``IMMEDIATE`` there,
+    taking the write lock up front as ``SELECT ... FOR UPDATE`` would elsewhere.
+    Nested blocks join the enclosing transaction as they are.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+    # Connecting resets the mode from the settings
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic():
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
+
+
+def order_quantities(lines):
+    """Sum ``(product_pk, quantity)`` pairs into ``{product_pk: quantity}``."""
+    quantities = Counter()
+    for product_pk, quantity in lines:
+        if quantity is None or quantity < 1:
+            raise ValidationError("Quantity must be at least 1")
+        quantities[product_pk] += quantity
+    return dict(quantities)
+
+
+def reserve_stock(quantities):
+    """
+    Decrement stock by ``{product_pk: quantity}`` or raise ``InsufficientStock``.
+
+    Every line is taken in one conditional ``UPDATE ... WHERE stock >= quantity``,
+    so stock can never go negative however many checkouts run at once. Where the
+    backend supports it the rows are first locked with ``SELECT ... FOR UPDATE``
+    in primary key order, which keeps concurrent multi-product orders from
+    deadlocking. Call inside a transaction so the decrement commits with the order.
+    """
+    if not quantities:
+        return
+    pks = sorted(quantities)
+
+    if connection.features.has_select_for_update:
+        list(Product.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk'))
+
+    condition = Q()
+    for pk in pks:
+        condition |= Q(pk=pk, stock__gte=quantities[pk])
+    decrement = Case(
+        *[When(pk=pk, then=Value(quantities[pk])) for pk in pks],
+        output_field=IntegerField(),
+    )
+
+    try:
+        with write_transaction():
+            updated = Product.objects.filter(condition).update(
+                stock=F('stock') - decrement, updated_at=timezone.now()
+            )
+            if updated != len(pks):
+                # Undo the lines that did fit before reporting the ones that did not
+                raise InsufficientStock([])
+            models_changed(Product)
+            stock_changed(pks)
+    except InsufficientStock:
+        stock = dict(Product.objects.filter(pk__in=pks).values_list('pk', 'stock'))
+        raise InsufficientStock([pk for pk in pks if stock.get(pk, 0) < quantities[pk]])
+
+
+def low_stock(queryset):
+    """Products of ``queryset`` below their reorder point, annotated with their ``restock`` units."""
+    return queryset.alias(
+        point=Coalesce('reorder_point', Value(REORDER_POINT)),
+    ).filter(stock__lt=F('point')).annotate(
+        restock=Coalesce('reorder_quantity', Value(REORDER_QUANTITY)),
+    )
+
+
+def restock_low_stock(dry_run=False, keep_products=True, first=None, after=None, chunk_size=RESTOCK_CHUNK_SIZE):
+    """
+    Add its reorder quantity to every product below its reorder point.
+
+    Products are walked in primary key ranges of ``chunk_size`` after
+    ``after``, each range read and updated in its own short transaction, so no
+    write lock is held across the catalog. ``first`` stops the sweep once that
+    many products were restocked and returns a cursor to resume from. With
+    ``dry_run`` only reads are made and the products keep their stock;
+    ``keep_products=False`` drops them after each range and only counts.
+    """
+    bounds = Product.objects.aggregate(bottom=Min('pk'), top=Max('pk'))
+    last_pk = bounds['top'] or 0
+    start = int(after) if after else (bounds['bottom'] or 1) - 1
+    products = [] if keep_products else None
+    count = units = 0
+    while start < last_pk and (first is None or count < first):
+        end = min(start + chunk_size, last_pk)
+        chunk = low_stock(Product.objects.filter(pk__gt=start, pk__lte=end)).order_by('pk')
+        if dry_run:
+            found = list(chunk[:limit(first, count)])
+        else:
+            with write_transaction():
+                if connection.features.has_select_for_update:
+                    chunk = chunk.select_for_update()
+                found = list(chunk[:limit(first, count)])
+                restock(found)
+        if keep_products:
+            products.extend(found)
+        count += len(found)
+        units += sum(product.restock for product in found)
+        # Stopped inside the range: resume after the last product taken
+        start = found[-1].pk if first is not None and count == first else end
+    return Restock(products, count, units, start if start < last_pk else None)
+
+
+def limit(first, count):
+    return None if first is None else first - count
+
+
+def restock(products):
+    """Add each of ``products``' ``restock`` units to its stock in one UPDATE; call inside a transaction."""
+    if not products:
+        return
+    now = timezone.now()
+    pks = [product.pk for product in products]
+    Product.objects.filter(pk__in=pks).update(
+        stock=F('stock') + Coalesce('reorder_quantity', Value(REORDER_QUANTITY)), updated_at=now,
+    )
+    for product in products:
+        product.stock += product.restock
+        product.updated_at = now
+    models_changed(Product)
+    stock_changed(pks)
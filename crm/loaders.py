@@ -0,0 +1,156 @@
+import threading
+from collections import defaultdict
+
+from django.db.models import F
+
+from .models import Customer, CustomerStats, Product, Order, OrderLine
+
+
+class DataLoader:
+    """
+    Per-request cache in front of a batch load function.
+
+    Keys that are queued (because their parent rows were fetched in the same
+    batch) are loaded together with the first miss, so resolving a relation
+    for every node of a page costs a single ``IN (...)`` query. Loaders that
+    queue into each other share one ``lock``, so threads resolving sibling
+    root fields can use them together.
+    """
+
+    def __init__(self, batch_load_fn, lock=None):
+        self.batch_load_fn = batch_load_fn
+        self._cache = {}
+        self._pending = {}
+        self._lock = lock or threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def queue(self, keys):
+        with self._lock:
+            for key in keys:
+                if key not in self._cache:
+                    self._pending[key] = None
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache.setdefault(key, value)
+            self._pending.pop(key, None)
+
+    def load(self, key):
+        with self._lock:
+            if key not in self._cache:
+                self._pending[key] = None
+                keys = list(self._pending)
+                self._pending.clear()
+                self._cache.update(zip(keys, self.batch_load_fn(keys)))
+            return self._cache[key]
+
+    def load_many(self, keys):
+        with self._lock:
+            self.queue(keys)
+            return [self.load(key) for key in keys]
+
+    def clear(self, key=None):
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+
+class Loaders:
+    """The DataLoaders shared by all resolvers of one GraphQL request."""
+
+    def __init__(self):
+        lock = threading.RLock()
+        self.order_customer = DataLoader(self.load_customers, lock)
+        self.order_products = DataLoader(self.load_order_products, lock)
+        self.order_lines = DataLoader(self.load_order_lines, lock)
+        self.customer_orders = DataLoader(self.load_customer_orders, lock)
+        self.product_orders = DataLoader(self.load_product_orders, lock)
+        self.customer_stats = DataLoader(self.load_customer_stats, lock)
+
+    def register(self, instances):
+        """Queue the relations of freshly fetched rows so siblings batch together."""
+        for instance in instances:
+            if isinstance(instance, Order):
+                if Order.customer.is_cached(instance):
+                    self.register([instance.customer])
+                elif 'customer_id' not in instance.get_deferred_fields():
+                    self.order_customer.queue([instance.customer_id])
+                self._queue_or_prime(self.order_products, instance, 'products')
+                self._queue_or_prime(self.order_lines, instance, 'lines')
+            elif isinstance(instance, Customer):
+                self._queue_or_prime(self.customer_orders, instance, 'orders')
+                self.customer_stats.queue([instance.pk])
+            elif isinstance(instance, Product):
+                self._queue_or_prime(self.product_orders, instance, 'orders')
+
+    def _queue_or_prime(self, loader, instance, relation):
+        # Rows from prefetch_related() already carry the relation; reuse it
+        prefetched = getattr(instance, '_prefetched_objects_cache', {})
+        if instance.pk in loader:
+            return
+        if relation in prefetched:
+            rows = list(prefetched[relation])
+            loader.prime(instance.pk, rows)
+            self.register(rows)
+        else:
+            loader.queue([instance.pk])
+
+    def load_customers(self, keys):
+        customers = Customer.objects.in_bulk(keys)
+        self.register(customers.values())
+        return [customers.get(key) for key in keys]
+
+    def load_customer_stats(self, keys):
+        stats = CustomerStats.objects.in_bulk(keys)
+        return [stats.get(key) for key in keys]
+
+    def load_customer_orders(self, keys):
+        grouped = defaultdict(list)
+        for order in Order.objects.filter(customer_id__in=keys):
+            grouped[order.customer_id].append(order)
+        return self._collect(keys, grouped)
+
+    def load_order_products(self, keys):
+        grouped = defaultdict(list)
+        products = Product.objects.filter(orders__in=keys).annotate(batch_key=F('orders'))
+        for product in products:
+            grouped[product.batch_key].append(product)
+        return self._collect(keys, grouped)
+
+    def load_order_lines(self, keys):
+        grouped = defaultdict(list)
+        lines = OrderLine.objects.filter(order_id__in=keys).select_related('product').order_by('pk')
+        for line in lines:
+            grouped[line.order_id].append(line)
+        self.register(line.product for lines in grouped.values() for line in lines)
+        return [grouped.get(key, []) for key in keys]
+
+    def load_product_orders(self, keys):
+        grouped = defaultdict(list)
+        orders = Order.objects.filter(products__in=keys).annotate(batch_key=F('products'))
+        for order in orders:
+            grouped[order.batch_key].append(order)
+        return self._collect(keys, grouped)
+
+    def _collect(self, keys, grouped):
+        results = [grouped.get(key, []) for key in keys]
+        for rows in results:
+            self.register(rows)
+        return results
+
+
+def get_loaders(info):
+    """Return the loaders attached to the request context, creating them if needed."""
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        try:
+            info.context.loaders = loaders
+        except AttributeError:
+            # Contexts that cannot carry attributes (None, dicts) only batch within one call
+            pass
+    return loaders
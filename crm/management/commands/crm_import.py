@@ -0,0 +1,66 @@
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importer import (
+    IMPORT_BATCH_SIZE, IMPORTERS, Checkpoint, detect_format, open_source, read_rows, run_import,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import customers, products or orders from a CSV or NDJSON file (optionally gzipped), "
+        "in batches that are checkpointed so an interrupted import resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('import', choices=list(IMPORTERS))
+        parser.add_argument('path', help="File to read, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Default: from the file name.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help="Rows validated and committed together.")
+        parser.add_argument('--checkpoint', help="Name the progress is saved under (default: PATH.checkpoint).")
+        parser.add_argument('--no-checkpoint', action='store_true', help="Do not record or resume progress.")
+        parser.add_argument('--restart', action='store_true', help="Ignore a saved checkpoint.")
+
+    def handle(self, *args, **options):
+        name, path = options['import'], options['path']
+        format = options['format'] or detect_format(path)
+        if format is None:
+            raise CommandError("Pass --format; it cannot be told from the file name.")
+
+        checkpoint = None
+        if path != '-' and not options['no_checkpoint']:
+            checkpoint = Checkpoint(options['checkpoint'] or f'{path}.checkpoint', name, path)
+            if options['restart']:
+                checkpoint.clear()
+
+        def on_error(number, message):
+            self.stderr.write(f"Row {number}: {message}")
+
+        stream = sys.stdin if path == '-' else open_source(path)
+        start = time.perf_counter()
+        try:
+            state = checkpoint.load() if checkpoint is not None else None
+            if state:
+                self.stdout.write(f"Resuming after row {state['offset']}")
+            result = run_import(
+                name, read_rows(stream, format), batch_size=options['batch_size'], checkpoint=checkpoint,
+                on_error=on_error,
+            )
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - start
+
+        if checkpoint is not None:
+            checkpoint.clear()
+        read = result.offset - (state['offset'] if state else 0)
+        self.stdout.write(
+            f"Imported {name}: {result.created} created, {result.rejected} rejected of {result.offset} rows "
+            f"({read} read in {elapsed:.2f}s, {read / elapsed if elapsed else 0:,.0f} rows/sec)"
+        )
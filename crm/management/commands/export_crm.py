@@ -0,0 +1,53 @@
+import gzip
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.export import EXPORT_CHUNK_SIZE, EXPORTS, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream customers, products or orders as NDJSON or CSV. Rows are scoped with the "
+        "filters of the matching GraphQL connection, e.g. --filter order_date__gte=2025-01-01."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--fields', help="Comma separated columns (default: all).")
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='NAME=VALUE',
+            help="FilterSet filter, may be repeated.",
+        )
+        parser.add_argument('--search', help="Full text search, as on the connection.")
+        parser.add_argument('--output', '-o', help="File to write (default: stdout).")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output (implied by a .gz output).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        filters = {}
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Filters are NAME=VALUE, got: {item}")
+            filters[name] = value
+
+        try:
+            lines = export(
+                options['export'], options['format'], filters=filters, search=options['search'],
+                fields=options['fields'], chunk_size=options['chunk_size'],
+            )
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        path = options['output']
+        compress = options['gzip'] or (path or '').endswith('.gz')
+        if not path and not compress:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        opener = gzip.open if compress else open
+        with opener(path or sys.stdout.buffer, 'wt', encoding='utf-8', newline='') as stream:
+            stream.writelines(lines)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.stats import CUSTOMER_STATS_CHUNK_SIZE, rebuild_customer_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every customer's order statistics from the orders, one transaction per chunk "
+        "of customers, and report the rows that had drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CUSTOMER_STATS_CHUNK_SIZE,
+                            help="Customers recomputed per transaction.")
+        parser.add_argument('--check', action='store_true',
+                            help="Only report drift; exit with status 1 if there is any.")
+
+    def handle(self, *args, **options):
+        check = options['check']
+        start = time.perf_counter()
+        drift = rebuild_customer_stats(chunk_size=options['chunk_size'], write=not check)
+        elapsed = time.perf_counter() - start
+
+        drifted = drift.missing + drift.changed + drift.stale
+        self.stdout.write(
+            f"{'Checked' if check else 'Rebuilt'} {drift.customers} customers in {elapsed:.2f}s: "
+            f"{drift.missing} missing, {drift.changed} changed, {drift.stale} stale"
+        )
+        if check and drifted:
+            raise CommandError("Customer statistics have drifted; run without --check to rebuild them.")
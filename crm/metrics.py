@@ -0,0 +1,425 @@
+import atexit
+import functools
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: folds are not locked against other processes
+    fcntl = None
+
+from django.conf import settings
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# Every process writes its own values here, and /metrics adds up all the files
+METRICS_DIR = getattr(settings, 'CRM_METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'crm_metrics')
+METRICS_FLUSH_INTERVAL = getattr(settings, 'CRM_METRICS_FLUSH_INTERVAL', 5)
+
+
+class Registry:
+    """
+    The metrics of this process, and their sum with every other process.
+
+    Web workers, Celery workers and cron runs each keep their own values in
+    memory and ``dump`` them to one file per process; rendering merges the
+    live values of this process with the files of the others, so nothing but
+    a shared directory is needed. The values of processes that have exited
+    are folded into one aggregate file, so the directory holds a file per
+    running process rather than one per process ever started.
+    """
+
+    AGGREGATE = 'aggregate.json'
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.last_dump = 0
+        # The process whose file this registry has claimed, see ``dump``
+        self.claimed_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def path(self, pid=None):
+        return os.path.join(self.directory, f'{socket.gethostname()}-{pid or os.getpid()}.json')
+
+    def collect(self):
+        return {name: metric.collect() for name, metric in self.metrics.items()}
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        """Hold the directory lock: shared to read the files, exclusive to fold them."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def dump(self):
+        """Write this process's values to its file in ``directory``."""
+        if self.claimed_pid != os.getpid():
+            # A file already at this path was left by an earlier process with the same PID
+            with self.locked(exclusive=True):
+                self.fold([self.path()])
+            self.claimed_pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path() + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(encode(self.collect()), f)
+        os.replace(temporary, self.path())
+        self.last_dump = time.monotonic()
+
+    def maybe_dump(self):
+        if time.monotonic() - self.last_dump >= self.flush_interval:
+            self.dump()
+
+    def close(self):
+        """Fold this process's values into the aggregate at exit, removing its file."""
+        if self.claimed_pid != os.getpid() or not os.path.isdir(self.directory):
+            return
+        with self.locked(exclusive=True):
+            self.merge_into_aggregate(self.collect())
+            try:
+                os.remove(self.path())
+            except FileNotFoundError:
+                pass
+        self.claimed_pid = None
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def merge(self, merged, values):
+        for metric_name, series in values.items():
+            metric = self.metrics.get(metric_name)
+            if metric is None:
+                continue
+            target = merged.setdefault(metric_name, {})
+            for labels, value in series:
+                labels = tuple(labels)
+                target[labels] = metric.merge(target.get(labels), value)
+        return merged
+
+    def merge_into_aggregate(self, values):
+        total = self.merge({}, self.read(self.AGGREGATE) or {})
+        for metric_name, series in values.items():
+            metric = self.metrics.get(metric_name)
+            if metric is None:
+                continue
+            target = total.setdefault(metric_name, {})
+            for labels, value in series.items():
+                target[labels] = metric.merge(target.get(labels), value)
+        temporary = os.path.join(self.directory, self.AGGREGATE + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(encode(total), f)
+        os.replace(temporary, os.path.join(self.directory, self.AGGREGATE))
+
+    def fold(self, paths):
+        """Add the files at ``paths`` to the aggregate and delete them; hold the exclusive lock."""
+        for path in paths:
+            values = self.read(os.path.basename(path))
+            if values is not None:
+                self.merge_into_aggregate(self.merge({}, values))
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def exited(self, name):
+        """Whether the file ``name`` belongs to a process of this host that is gone."""
+        # Files named by PID alone predate the host prefix
+        host, _, pid = name[:-len('.json')].rpartition('-')
+        if os.name != 'posix' or host not in ('', socket.gethostname()) or not pid.isdigit():
+            # Other hosts prune their own files
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def collect_all(self):
+        """Values of this process plus the last dump of every other one and the exited ones' aggregate."""
+        own = os.path.basename(self.path())
+        gone = [name for name in self.files() if name not in (own, self.AGGREGATE) and self.exited(name)]
+        if gone:
+            with self.locked(exclusive=True):
+                self.fold([os.path.join(self.directory, name) for name in gone])
+
+        merged = self.collect()
+        with self.locked():
+            for name in self.files():
+                if name == own:
+                    continue
+                values = self.read(name)
+                if values is not None:
+                    self.merge(merged, values)
+        return merged
+
+    def files(self):
+        try:
+            return [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        values = self.collect_all()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(values.get(name, {}).items()):
+                lines.extend(metric.samples(labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+def encode(values):
+    """``{name: {labels: value}}`` as JSON-friendly ``{name: [[labels, value], ...]}``."""
+    return {
+        name: [[list(labels), value] for labels, value in series.items()]
+        for name, series in values.items()
+    }
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.close)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """
+    Base for metrics with one series per label values.
+
+    Each thread writes to its own shard, so recording never takes a lock;
+    shards are only merged when the metric is read.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged_shards(self):
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for labels, series in list(shard.items()):
+                merged[labels] = self.merge(merged.get(labels), self.copy(series))
+        return merged
+
+    def clear(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def copy(value):
+        return value
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def collect(self):
+        """Return ``{labels: value}`` merged over every shard."""
+        return self._merged_shards()
+
+    def samples(self, labels, value):
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {value}']
+
+
+class Histogram(Metric):
+    """Bucketed distribution of observations."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One count per bucket, then +Inf, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @staticmethod
+    def copy(series):
+        return list(series)
+
+    @staticmethod
+    def merge(total, series):
+        if total is None:
+            return list(series)
+        return [a + b for a, b in zip(total, series)]
+
+    def collect(self):
+        """Return ``{labels: [bucket counts..., +Inf count, sum]}`` merged over every shard."""
+        return self._merged_shards()
+
+    def samples(self, labels, series):
+        samples, running = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+            running += count
+            samples.append(
+                f'{self.name}_bucket{format_labels(self.labelnames, labels, [("le", bound)])} {running}'
+            )
+        samples.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {series[-1]}')
+        samples.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {running}')
+        return samples
+
+
+MAX_OPERATION_NAMES = 200
+_operation_names = set()
+
+
+def operation_label(name):
+    """Client-chosen operation names, capped so they cannot grow the series without bound."""
+    name = name or 'anonymous'
+    if name not in _operation_names:
+        if len(_operation_names) >= MAX_OPERATION_NAMES:
+            return 'other'
+        _operation_names.add(name)
+    return name
+
+
+operation_duration = Histogram(
+    'graphql_operation_duration_seconds',
+    'Execution time of GraphQL operations.',
+    labelnames=('operation', 'type'),
+)
+operations = Counter(
+    'graphql_operations_total',
+    'Executed GraphQL operations by outcome.',
+    labelnames=('operation', 'type', 'status'),
+)
+operation_queries = Histogram(
+    'graphql_operation_sql_queries',
+    'SQL queries run by each GraphQL operation.',
+    labelnames=('operation',),
+    buckets=COUNT_BUCKETS,
+)
+mutations = Counter(
+    'graphql_mutations_total',
+    'Root mutation fields by outcome.',
+    labelnames=('mutation', 'status'),
+)
+bulk_rows = Counter(
+    'crm_bulk_rows_total',
+    'Rows sent to bulk mutations, created or rejected.',
+    labelnames=('mutation', 'outcome'),
+)
+job_duration = Histogram(
+    'crm_job_duration_seconds',
+    'Duration of Celery tasks and cron jobs.',
+    labelnames=('job', 'kind'),
+    buckets=JOB_BUCKETS,
+)
+job_runs = Counter(
+    'crm_job_runs_total',
+    'Celery task and cron job runs by outcome.',
+    labelnames=('job', 'kind', 'status'),
+)
+
+
+def record_job(job, kind, duration, failed):
+    job_duration.observe(duration, (job, kind))
+    job_runs.inc(labels=(job, kind, 'failure' if failed else 'success'))
+    REGISTRY.dump()
+
+
+def cron_job(func):
+    """Record the duration and outcome of a cron job; a job fails by raising."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record_job(func.__name__, 'cron', time.perf_counter() - start, failed)
+    return wrapper
+
+
+_task_starts = {}
+
+
+def task_prerun(task_id=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+
+
+def task_postrun(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    if start is None or task is None:
+        return
+    record_job(task.name.rsplit('.', 1)[-1], 'celery', time.perf_counter() - start, state == 'FAILURE')
+
+
+def connect_task_signals():
+    """Record Celery task durations and outcomes; called once the app is ready."""
+    try:
+        from celery import signals
+    except ImportError:
+        return
+    signals.task_prerun.connect(task_prerun, weak=False, dispatch_uid='crm.metrics.task_prerun')
+    signals.task_postrun.connect(task_postrun, weak=False, dispatch_uid='crm.metrics.task_postrun')
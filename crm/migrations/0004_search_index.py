@@ -0,0 +1,90 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:14
+
+import crm.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+# External-content FTS5 tables with the trigram tokenizer, so substring searches
+# (what icontains did) are answered from the index. Triggers rather than signals
+# keep them in sync, which also covers bulk_create, update() and raw SQL writes.
+SEARCH_INDEXES = {
+    'crm_customer_fts': ('crm_customer', ['name', 'email']),
+    'crm_product_fts': ('crm_product', ['name']),
+}
+
+
+def index_statements(table, content, columns):
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    insert = f"INSERT INTO {table}(rowid, {names}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {table}({table}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    return [
+        f"CREATE VIRTUAL TABLE {table} USING fts5({names}, content='{content}', "
+        f"content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {table}_ai AFTER INSERT ON {content} BEGIN {insert} END",
+        f"CREATE TRIGGER {table}_ad AFTER DELETE ON {content} BEGIN {delete} END",
+        f"CREATE TRIGGER {table}_au AFTER UPDATE OF {names} ON {content} BEGIN {delete} {insert} END",
+        f"INSERT INTO {table}({table}) VALUES ('rebuild')",
+    ]
+
+
+def has_fts5_trigram(connection):
+    # The trigram tokenizer shipped with SQLite 3.34
+    if connection.vendor != 'sqlite' or connection.Database.sqlite_version_info < (3, 34):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+def create_search_indexes(apps, schema_editor):
+    if not has_fts5_trigram(schema_editor.connection):
+        return
+    for table, (content, columns) in SEARCH_INDEXES.items():
+        for statement in index_statements(table, content, columns):
+            schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, (content, columns) in SEARCH_INDEXES.items():
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearch',
+            fields=[
+                ('customer', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='crm.customer')),
+                ('document', crm.models.SearchDocumentField(db_column='crm_customer_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'crm_customer_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='crm.product')),
+                ('document', crm.models.SearchDocumentField(db_column='crm_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'crm_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_customer_stats(apps, schema_editor):
+    # The same figures as rebuild_customer_stats, for the orders already stored
+    Order = apps.get_model('crm', 'Order')
+    CustomerStats = apps.get_model('crm', 'CustomerStats')
+    totals = (
+        Order.objects.order_by().values('customer_id')
+        .annotate(
+            order_count=Count('id'), lifetime_revenue=Sum('total_amount'),
+            first_order_date=Min('order_date'), last_order_date=Max('order_date'),
+        )
+    )
+    CustomerStats.objects.bulk_create(
+        (CustomerStats(**row) for row in totals.iterator(chunk_size=2000)), batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='crm.customer')),
+                ('order_count', models.PositiveIntegerField()),
+                ('lifetime_revenue', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('first_order_date', models.DateTimeField()),
+                ('last_order_date', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'customer stats',
+                'indexes': [models.Index(fields=['order_count'], name='crm_custstats_count_idx'), models.Index(fields=['lifetime_revenue'], name='crm_custstats_revenue_idx'), models.Index(fields=['first_order_date'], name='crm_custstats_first_idx'), models.Index(fields=['last_order_date'], name='crm_custstats_last_idx')],
+            },
+        ),
+        migrations.RunPython(populate_customer_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:02
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+
+# Lines filled per transaction
+BACKFILL_CHUNK_SIZE = 50000
+
+
+def backfill_order_lines(apps, schema_editor):
+    # The many-to-many rows recorded neither, so every existing line is one
+    # unit at its product's current price. Chunks commit one by one and
+    # filled lines are skipped, so an interrupted run picks up where it stopped.
+    OrderLine = apps.get_model('crm', 'OrderLine')
+    Product = apps.get_model('crm', 'Product')
+    price = Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]
+    last_pk = OrderLine.objects.aggregate(top=Max('pk'))['top'] or 0
+    for start in range(0, last_pk, BACKFILL_CHUNK_SIZE):
+        with transaction.atomic(using=schema_editor.connection.alias):
+            OrderLine.objects.filter(
+                pk__gt=start, pk__lte=start + BACKFILL_CHUNK_SIZE, unit_price__isnull=True,
+            ).update(quantity=1, unit_price=Subquery(price))
+
+
+class Migration(migrations.Migration):
+    # The backfill commits chunk by chunk rather than as one transaction
+    atomic = False
+
+    dependencies = [
+        ('crm', '0007_order_lines'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+    ]
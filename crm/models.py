@@ -13,12 +13,22 @@ class Customer(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Default ordering, created_at range filters and stable keyset pagination
+            models.Index(fields=['created_at', 'id'], name='crm_customer_created_id_idx'),
+            # phone_pattern prefix filter
+            models.Index(fields=['phone'], name='crm_customer_phone_idx'),
+        ]
 
 
 class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    # Restocked by this many units when stock falls below the reorder point;
+    # unset, CRM_REORDER_POINT and CRM_REORDER_QUANTITY apply
+    reorder_point = models.PositiveIntegerField(null=True, blank=True)
+    reorder_quantity = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -27,11 +37,17 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='crm_product_name_id_idx'),
+            models.Index(fields=['price'], name='crm_product_price_idx'),
+            # Stock filters
+            models.Index(fields=['stock'], name='crm_product_stock_idx'),
+        ]
 
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product, related_name='orders')
+    products = models.ManyToManyField(Product, through='OrderLine', related_name='orders')
     order_date = models.DateTimeField(auto_now_add=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -42,3 +58,150 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            # Default ordering, order_date range filters and stable keyset pagination
+            models.Index(fields=['order_date', 'id'], name='crm_order_date_id_idx'),
+            models.Index(fields=['total_amount'], name='crm_order_total_idx'),
+            # Customer.orders loads, newest first
+            models.Index(fields=['customer', 'order_date'], name='crm_order_customer_date_idx'),
+            # Sales rollups read the orders changed since their watermark
+            models.Index(fields=['updated_at', 'id'], name='crm_order_updated_id_idx'),
+        ]
+
+
+class OrderLine(models.Model):
+    """One product of an order: the units bought and the price each was sold at."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='order_lines')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        # The table of the plain many-to-many field this replaced
+        db_table = 'crm_order_products'
+        unique_together = [('order', 'product')]
+
+    @property
+    def amount(self):
+        return self.unit_price * self.quantity
+
+
+class CustomerStats(models.Model):
+    """
+    Lifetime order figures of a customer, kept up to date as orders are written.
+
+    Only customers with orders have a row. ``rebuild_customer_stats`` recomputes
+    the table from the orders and reports any drift.
+    """
+    customer = models.OneToOneField(
+        Customer, primary_key=True, on_delete=models.CASCADE, related_name='stats',
+    )
+    order_count = models.PositiveIntegerField()
+    lifetime_revenue = models.DecimalField(max_digits=14, decimal_places=2)
+    first_order_date = models.DateTimeField()
+    last_order_date = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = 'customer stats'
+        indexes = [
+            # allCustomers ordered by the statistics
+            models.Index(fields=['order_count'], name='crm_custstats_count_idx'),
+            models.Index(fields=['lifetime_revenue'], name='crm_custstats_revenue_idx'),
+            models.Index(fields=['first_order_date'], name='crm_custstats_first_idx'),
+            models.Index(fields=['last_order_date'], name='crm_custstats_last_idx'),
+        ]
+
+
+class SalesGranularity(models.TextChoices):
+    HOUR = 'hour'
+    DAY = 'day'
+
+
+class SalesRollup(models.Model):
+    """Orders, units and revenue of every order placed in one UTC hour or day."""
+    granularity = models.CharField(max_length=4, choices=SalesGranularity.choices)
+    period = models.DateTimeField()
+    order_count = models.PositiveIntegerField()
+    units = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period'], name='crm_salesrollup_period_uniq'),
+        ]
+
+
+class ProductSalesRollup(models.Model):
+    """Orders, units and revenue of one product in one UTC hour or day."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups')
+    granularity = models.CharField(max_length=4, choices=SalesGranularity.choices)
+    period = models.DateTimeField()
+    order_count = models.PositiveIntegerField()
+    units = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            # Also serves a product's time series
+            models.UniqueConstraint(
+                fields=['product', 'granularity', 'period'], name='crm_productsalesrollup_uniq',
+            ),
+        ]
+        indexes = [
+            # Replacing the rows of a range of periods
+            models.Index(fields=['granularity', 'period'], name='crm_prodsales_period_idx'),
+        ]
+
+
+class SalesRollupWatermark(models.Model):
+    """How far the rollups have read the orders, by ``(updated_at, id)``; a single row."""
+    updated_at = models.DateTimeField(null=True)
+    order_id = models.BigIntegerField(default=0)
+
+
+class ImportCheckpoint(models.Model):
+    """How far a ``crm_import`` got, committed with each batch it wrote."""
+    label = models.CharField(max_length=1024, unique=True)
+    state = models.JSONField()
+
+
+class SearchDocumentField(models.TextField):
+    """The hidden column of an FTS5 table, named after the table itself."""
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+class CustomerSearch(models.Model):
+    """Read-only view of the SQLite FTS5 index over customer names and emails."""
+    customer = models.OneToOneField(
+        Customer, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+        related_name='search_index',
+    )
+    document = SearchDocumentField(db_column='crm_customer_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'crm_customer_fts'
+
+
+class ProductSearch(models.Model):
+    """Read-only view of the SQLite FTS5 index over product names."""
+    product = models.OneToOneField(
+        Product, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+        related_name='search_index',
+    )
+    document = SearchDocumentField(db_column='crm_product_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'crm_product_fts'
@@ -0,0 +1,123 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.query import QuerySet
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+# Connection arguments that only paginate; anything else filters the relation
+PAGINATION_ARGS = {'first', 'last', 'before', 'after', 'offset'}
+
+
+def collect_fields(info, selection_set):
+    """Map each selected field name to its field nodes, expanding fragments."""
+    fields = {}
+    if selection_set is None:
+        return fields
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            if not selection.name.value.startswith('__'):
+                fields.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            merge_fields(fields, collect_fields(info, selection.selection_set))
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = info.fragments[selection.name.value]
+            merge_fields(fields, collect_fields(info, fragment.selection_set))
+    return fields
+
+
+def merge_fields(fields, other):
+    for name, nodes in other.items():
+        fields.setdefault(name, []).extend(nodes)
+
+
+def sub_fields(info, nodes):
+    """Collect the fields selected below any of ``nodes``."""
+    fields = {}
+    for node in nodes:
+        merge_fields(fields, collect_fields(info, node.selection_set))
+    return fields
+
+
+def node_fields(info, connection_nodes):
+    """Collect the fields selected on ``edges { node { ... } }`` of a connection."""
+    edges = sub_fields(info, connection_nodes).get('edges', [])
+    return sub_fields(info, sub_fields(info, edges).get('node', []))
+
+
+def relation_fields(info, nodes):
+    """Collect the fields selected on a relation's rows, as a connection or a plain list."""
+    fields = sub_fields(info, nodes)
+    if fields.keys() & {'edges', 'pageInfo', 'totalCount'}:
+        return node_fields(info, nodes)
+    return fields
+
+
+def get_model_field(model, name):
+    if name == 'id':
+        return model._meta.pk
+    try:
+        return model._meta.get_field(to_snake_case(name))
+    except FieldDoesNotExist:
+        return None
+
+
+def is_paginated_only(nodes):
+    return all(
+        argument.name.value in PAGINATION_ARGS
+        for node in nodes for argument in node.arguments
+    )
+
+
+class QueryPlan:
+    """The ``only()``/``select_related()``/``prefetch_related()`` calls for a selection."""
+
+    def __init__(self):
+        self.only = set()
+        self.restrict = True
+        self.select_related = []
+        self.prefetch_related = []
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        if self.restrict:
+            queryset = queryset.only(*self.only)
+        return queryset
+
+
+def build_plan(info, model, fields, plan=None, prefix=''):
+    """Walk ``fields`` (as returned by ``collect_fields``) against ``model``."""
+    plan = plan or QueryPlan()
+    plan.only.add(prefix + model._meta.pk.name)
+    for name, nodes in fields.items():
+        field = get_model_field(model, name)
+        if field is None:
+            # Computed field: its resolver may need any column, so load them all
+            plan.restrict = False
+            continue
+        if not field.is_relation:
+            plan.only.add(prefix + field.name)
+        elif field.many_to_one or field.one_to_one:
+            plan.only.add(prefix + field.name)
+            plan.select_related.append(prefix + field.name)
+            build_plan(info, field.related_model, sub_fields(info, nodes), plan, prefix + field.name + '__')
+        elif is_paginated_only(nodes):
+            related_plan = build_plan(info, field.related_model, relation_fields(info, nodes))
+            if field.one_to_many:
+                # The prefetcher matches rows back to parents through the foreign key
+                related_plan.only.add(field.field.name)
+            plan.prefetch_related.append(Prefetch(
+                prefix + field.name,
+                queryset=related_plan.apply(field.related_model._default_manager.all()),
+            ))
+    return plan
+
+
+def optimize_queryset(queryset, info):
+    """Restrict a connection's queryset to the columns and relations ``info`` selects."""
+    if not isinstance(queryset, QuerySet):
+        return queryset
+    fields = node_fields(info, info.field_nodes)
+    return build_plan(info, queryset.model, fields).apply(queryset)
@@ -0,0 +1,208 @@
+import base64
+import json
+from decimal import Decimal
+
+import graphene
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from graphene.relay import PageInfo
+from graphql_relay import get_offset_with_default, offset_to_cursor
+
+KEYSET_PREFIX = 'keyset:'
+
+
+class CountableConnection(graphene.relay.Connection):
+    """Relay connection with a ``totalCount`` that is only counted when selected."""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        if root.length is None:
+            iterable = root.iterable
+            root.length = len(iterable) if isinstance(iterable, list) else iterable.count()
+        return root.length
+
+
+def is_keyset_cursor(cursor):
+    try:
+        return base64.b64decode(cursor).decode('utf-8').startswith(KEYSET_PREFIX)
+    except (ValueError, UnicodeDecodeError):
+        return False
+
+
+def get_ordering_keys(queryset):
+    """Return ``(field, descending)`` pairs for the queryset ordering, ending with the pk."""
+    model = queryset.model
+    ordering = queryset.query.order_by or model._meta.ordering
+    keys = []
+    for name in ordering:
+        if not isinstance(name, str) or name == '?':
+            raise ValueError("Keyset pagination requires ordering by model fields")
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if '__' in name:
+            raise ValueError(f"Keyset pagination cannot order by '{name}'")
+        try:
+            field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValueError(f"Keyset pagination cannot order by '{name}'")
+        if field.is_relation:
+            raise ValueError(f"Keyset pagination cannot order by '{name}'")
+        keys.append((field, descending))
+    if not any(field.primary_key for field, _ in keys):
+        # The primary key makes every cursor position unique
+        keys.append((model._meta.pk, keys[0][1] if keys else False))
+    return keys
+
+
+def supports_keyset(queryset):
+    """Whether ``queryset`` is ordered by columns a keyset cursor can seek on."""
+    try:
+        get_ordering_keys(queryset)
+    except ValueError:
+        return False
+    return True
+
+
+def encode_cursor(node, keys):
+    values = []
+    for field, _ in keys:
+        value = getattr(node, field.attname)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        values.append(value)
+    payload = KEYSET_PREFIX + json.dumps(values, separators=(',', ':'))
+    return base64.b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, keys):
+    try:
+        payload = base64.b64decode(cursor).decode('utf-8')
+        values = json.loads(payload[len(KEYSET_PREFIX):])
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError(f"Cursor does not match the ordering: {cursor}")
+    return [field.to_python(value) for (field, _), value in zip(keys, values)]
+
+
+def seek_filter(keys, values, forward=True):
+    """Rows strictly after ``values`` in ``keys`` order (strictly before when not ``forward``)."""
+    condition = None
+    for index, (field, descending) in enumerate(keys):
+        lookup = 'lt' if descending == forward else 'gt'
+        term = Q(**{f'{field.name}__{lookup}': values[index]})
+        for (previous, _), value in zip(keys[:index], values):
+            term &= Q(**{previous.name: value})
+        condition = term if condition is None else condition | term
+    # Redundant bound on the leading key so the planner can range-scan its index
+    field, descending = keys[0]
+    lookup = 'lte' if descending == forward else 'gte'
+    return Q(**{f'{field.name}__{lookup}': values[0]}) & condition
+
+
+def load_ordering_fields(queryset, keys):
+    # Cursors read the ordering columns, so they must survive an only() restriction
+    names, defer = queryset.query.deferred_loading
+    if names and not defer:
+        queryset = queryset.only(*names, *(field.name for field, _ in keys))
+    return queryset
+
+
+def keyset_connection(connection, queryset, args, max_limit=None):
+    """
+    Build a page of ``connection`` by seeking on the ordering columns.
+
+    Cursors encode the ordering key tuple of their node, e.g. ``(order_date, id)``,
+    so deep pages cost the same as the first one. Ordering by related fields or
+    nullable columns is not supported.
+    """
+    keys = get_ordering_keys(queryset)
+    page = load_ordering_fields(queryset, keys).order_by(*[
+        ('-' if descending else '') + field.name for field, descending in keys
+    ])
+
+    after, before = args.get('after'), args.get('before')
+    if after:
+        page = page.filter(seek_filter(keys, decode_cursor(after, keys)))
+    if before:
+        page = page.filter(seek_filter(keys, decode_cursor(before, keys), forward=False))
+
+    first, last = args.get('first'), args.get('last')
+    if first is None and last is None:
+        first = max_limit
+
+    if first is None:
+        # Only `last` was given: read the page backwards from the end
+        nodes = list(page.reverse()[:last + 1])
+        has_previous_page = len(nodes) > last
+        nodes = nodes[:last][::-1]
+        has_next_page = bool(before)
+    else:
+        nodes = list(page[:first + 1])
+        has_next_page = len(nodes) > first
+        nodes = nodes[:first]
+        if last is not None:
+            nodes = nodes[-last:] if last else []
+        has_previous_page = bool(after)
+
+    edges = [connection.Edge(node=node, cursor=encode_cursor(node, keys)) for node in nodes]
+    result = connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        ),
+    )
+    result.iterable = queryset
+    result.length = None
+    return result
+
+
+def offset_connection(connection, queryset, args, max_limit=None):
+    """
+    Build a forward page of ``connection`` by OFFSET without counting the rows.
+
+    One extra row is read to tell whether there is a next page, so ``COUNT(*)``
+    only runs if ``totalCount`` is resolved. Cursors are graphene's offset cursors,
+    interchangeable with the counted path; ``last`` and ``before`` need the count.
+    """
+    start = get_offset_with_default(args.get('after'), -1) + 1
+    if args.get('offset'):
+        start += args['offset']
+
+    first = args.get('first')
+    if first is None:
+        first = max_limit
+
+    if first is None:
+        nodes = list(queryset[start:])
+        has_next_page = False
+    else:
+        nodes = list(queryset[start:start + first + 1])
+        has_next_page = len(nodes) > first
+        nodes = nodes[:first]
+
+    edges = [
+        connection.Edge(node=node, cursor=offset_to_cursor(start + index))
+        for index, node in enumerate(nodes)
+    ]
+    result = connection(
+        edges=edges,
+        page_info=PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=False,
+            has_next_page=has_next_page,
+        ),
+    )
+    result.iterable = queryset
+    result.length = None
+    return result
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from graphene_django import DjangoObjectType
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, InlineFragmentNode, get_named_type, parse,
+    print_ast,
+)
+
+from .documents import query_hash
+from .metrics import Counter
+from .models import Customer, Order, OrderLine, Product
+
+RESPONSE_CACHE_TTL = getattr(settings, 'GRAPHQL_RESPONSE_CACHE_TTL', None)
+RESPONSE_CACHE_ALIAS = getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS', 'default')
+# Operations whose model dependencies are remembered, least recently used dropped first
+RESPONSE_CACHE_DEPENDENCIES_SIZE = getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 512)
+CACHED_MODELS = (Customer, Product, Order)
+
+response_cache_lookups = Counter(
+    'graphql_response_cache_lookups_total',
+    'Response cache lookups by result.',
+    labelnames=('result',),
+)
+
+
+@lru_cache(maxsize=512)
+def normalized_hash(query):
+    """Hash of the printed document, so formatting and comments do not split entries."""
+    return query_hash(print_ast(parse(query)))
+
+
+def selected_types(schema, document, operation):
+    """Every named type the operation's selection set reaches, through fragments too."""
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    types = set()
+
+    def visit(parent_type, selection_set, seen):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = getattr(parent_type, 'fields', {}).get(selection.name.value)
+                if field is None:
+                    continue
+                type_ = get_named_type(field.type)
+                types.add(type_)
+                if selection.selection_set:
+                    visit(type_, selection.selection_set, seen)
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                visit(schema.get_type(condition.name.value) if condition else parent_type,
+                      selection.selection_set, seen)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is not None and fragment.name.value not in seen:
+                    visit(schema.get_type(fragment.type_condition.name.value),
+                          fragment.selection_set, seen | {fragment.name.value})
+
+    visit(schema.get_root_type(operation.operation), operation.selection_set, frozenset())
+    return types
+
+
+def operation_models(schema, document, operation):
+    """
+    Models whose changes can alter the operation's result.
+
+    A Django type depends on its model and on the models its foreign keys and
+    many-to-many fields point to, which their filters and search may read.
+    Other object types can list the models they read in ``cache_models``.
+    """
+    models = set()
+    for type_ in selected_types(schema, document, operation):
+        graphene_type = getattr(type_, 'graphene_type', None)
+        if graphene_type is None:
+            continue
+        models.update(getattr(graphene_type, 'cache_models', ()))
+        if isinstance(graphene_type, type) and issubclass(graphene_type, DjangoObjectType):
+            model = graphene_type._meta.model
+            models.add(model)
+            models.update(
+                field.related_model for field in model._meta.get_fields()
+                if field.concrete and field.is_relation
+            )
+    return models
+
+
+class ResponseCache:
+    """
+    Cache of query results in Django's cache framework.
+
+    Entries are keyed on the normalized document, operation name, variables,
+    auth scope and the current version of every model the operation reads.
+    Writes bump the versions of the models they touch, so later lookups miss
+    exactly the entries that could have changed and the old ones expire.
+    """
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, alias=RESPONSE_CACHE_ALIAS, prefix='crm:rc:',
+                 dependencies_size=RESPONSE_CACHE_DEPENDENCIES_SIZE):
+        self.ttl = ttl
+        self.alias = alias
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        # Bounded like the document cache, since clients choose the queries
+        self.dependencies_size = dependencies_size
+        self._dependencies = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, model):
+        return f'{self.prefix}version:{model._meta.label_lower}'
+
+    def dependencies(self, schema, query, document, operation):
+        key = (normalized_hash(query), operation.name.value if operation.name else None)
+        with self._lock:
+            models = self._dependencies.get(key)
+            if models is not None:
+                self._dependencies.move_to_end(key)
+                return models
+        models = sorted(operation_models(schema, document, operation), key=lambda model: model._meta.label_lower)
+        with self._lock:
+            self._dependencies[key] = models
+            while len(self._dependencies) > self.dependencies_size:
+                self._dependencies.popitem(last=False)
+        return models
+
+    def key(self, schema, query, document, operation, variables, scope):
+        models = self.dependencies(schema, query, document, operation)
+        versions = self.cache.get_many([self.version_key(model) for model in models])
+        parts = [
+            normalized_hash(query),
+            operation.name.value if operation.name else '',
+            json.dumps(variables or {}, sort_keys=True, default=str),
+            scope,
+            *(f'{key}={value}' for key, value in sorted(versions.items())),
+        ]
+        return f'{self.prefix}response:{query_hash(chr(0).join(parts))}'
+
+    def get(self, key):
+        """Return ``(data, age_in_seconds)`` or ``None``."""
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            response_cache_lookups.inc(labels=('miss',))
+            return None
+        self.hits += 1
+        response_cache_lookups.inc(labels=('hit',))
+        data, stored_at = entry
+        return data, time.time() - stored_at
+
+    def set(self, key, data):
+        self.cache.set(key, (data, time.time()), self.ttl)
+
+    def invalidate(self, *models):
+        for model in models:
+            key = self.version_key(model)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, 1, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+    def clear_stats(self):
+        self.hits = self.misses = 0
+
+
+response_cache = ResponseCache()
+
+
+def models_changed(*models):
+    """
+    Invalidate cached responses that read ``models``.
+
+    Versions are bumped right away, so the writer never reads its own stale
+    result, and again on commit, so a result cached by a concurrent reader
+    from the pre-commit state is not served afterwards. Call this from code
+    paths that write without signals (``bulk_create``, ``update()``).
+    """
+    if not response_cache.enabled:
+        return
+    response_cache.invalidate(*models)
+    transaction.on_commit(lambda: response_cache.invalidate(*models))
+
+
+def model_saved_or_deleted(sender, **kwargs):
+    models_changed(sender)
+
+
+def order_line_saved_or_deleted(sender, **kwargs):
+    # Lines are read as part of their order
+    models_changed(Order)
+
+
+def order_products_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        models_changed(Order)
+
+
+def connect_signals():
+    for model in CACHED_MODELS:
+        post_save.connect(model_saved_or_deleted, sender=model, dispatch_uid=f'crm.rc.save.{model.__name__}')
+        post_delete.connect(model_saved_or_deleted, sender=model, dispatch_uid=f'crm.rc.delete.{model.__name__}')
+    post_save.connect(order_line_saved_or_deleted, sender=OrderLine, dispatch_uid='crm.rc.save.OrderLine')
+    post_delete.connect(order_line_saved_or_deleted, sender=OrderLine, dispatch_uid='crm.rc.delete.OrderLine')
+    m2m_changed.connect(order_products_changed, sender=OrderLine, dispatch_uid='crm.rc.m2m')
@@ -0,0 +1,236 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Trunc
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .bulk import on_commit_batched
+from .models import (
+    Order, OrderLine, ProductSalesRollup, SalesGranularity, SalesRollup, SalesRollupWatermark,
+)
+from .response_cache import models_changed
+
+# Changed orders read, and their hours recomputed, per transaction
+ROLLUP_BATCH_SIZE = getattr(settings, 'CRM_ROLLUP_BATCH_SIZE', 10000)
+# Orders updated more recently than this are left for the next refresh, so a
+# transaction still committing an older ``updated_at`` is not skipped
+ROLLUP_SETTLE_SECONDS = getattr(settings, 'CRM_ROLLUP_SETTLE_SECONDS', 60)
+# Hours closer than this are recomputed as one range
+SPAN_GAP = timedelta(hours=6)
+# Order history aggregated per statement, in at most SPANS_PER_QUERY ranges
+SPAN_MAX = timedelta(days=7)
+SPANS_PER_QUERY = 100
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+ROLLUP_FIELDS = ('order_count', 'units', 'revenue')
+
+
+def truncate(moment, granularity):
+    """The start of the UTC hour or day holding ``moment``."""
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == SalesGranularity.DAY else moment
+
+
+def spans(periods, length, gap=timedelta(0)):
+    """
+    Group the periods of ``length`` starting at ``periods`` into lists of
+    ``(start, end)`` ranges, each list covering at most ``SPAN_MAX`` in at most
+    ``SPANS_PER_QUERY`` ranges. Periods less than ``gap`` apart share a range.
+    """
+    ranges = []
+    for start in sorted(set(periods)):
+        if ranges and start - ranges[-1][1] <= gap and start + length - ranges[-1][0] <= SPAN_MAX:
+            ranges[-1][1] = start + length
+        else:
+            ranges.append([start, start + length])
+    groups, covered = [], SPAN_MAX
+    for start, end in ranges:
+        if covered + (end - start) > SPAN_MAX or len(groups[-1]) == SPANS_PER_QUERY:
+            groups.append([])
+            covered = timedelta(0)
+        groups[-1].append((start, end))
+        covered += end - start
+    return groups
+
+
+def within(field, ranges):
+    """``Q`` matching values of ``field`` in any of the ``[start, end)`` ``ranges``."""
+    condition = Q()
+    for start, end in ranges:
+        condition |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+    return condition
+
+
+def insert_select(model, queryset, rename=()):
+    """
+    Insert the rows ``queryset`` selects into ``model``'s table with one
+    ``INSERT ... SELECT``, so they never travel through Python. Its columns are
+    named after the fields they fill, or mapped to them by ``rename``.
+    """
+    query = queryset.query
+    rename = dict(rename)
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(rename.get(name, name)).column)
+        for name in (*query.values_select, *query.annotation_select)
+    )
+    sql, params = query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {quote(model._meta.db_table)} ({columns}) {sql}", params)
+
+
+def recompute_hours(ranges):
+    """Replace the hour rollups in ``ranges`` by aggregates of the orders placed in them."""
+    utc = dt_timezone.utc
+    for model in (SalesRollup, ProductSalesRollup):
+        model.objects.filter(within('period', ranges), granularity=SalesGranularity.HOUR).delete()
+
+    # A product's revenue is what its lines were sold for
+    lines = OrderLine.objects.order_by().filter(within('order__order_date', ranges))
+    insert_select(ProductSalesRollup, lines.annotate(
+        period=Trunc('order__order_date', 'hour', tzinfo=utc),
+    ).values('product_id', 'period').annotate(
+        granularity=Value(SalesGranularity.HOUR), order_count=Count('id'), units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('unit_price')),
+    ))
+    orders = Order.objects.order_by().filter(within('order_date', ranges))
+    insert_select(SalesRollup, orders.annotate(
+        period=Trunc('order_date', 'hour', tzinfo=utc),
+    ).values('period').annotate(
+        granularity=Value(SalesGranularity.HOUR), order_count=Count('id'), units=Value(0),
+        revenue=Sum('total_amount'),
+    ))
+    # Every unit of an hour is one of a product's
+    product_units = ProductSalesRollup.objects.order_by().filter(
+        granularity=SalesGranularity.HOUR, period=OuterRef('period'),
+    ).values('period').annotate(total=Sum('units')).values('total')
+    SalesRollup.objects.filter(within('period', ranges), granularity=SalesGranularity.HOUR).update(
+        units=Coalesce(Subquery(product_units), 0),
+    )
+
+
+def recompute_days(ranges):
+    """Replace the day rollups in ``ranges`` by sums of their hour rollups."""
+    for model, group in ((SalesRollup, ()), (ProductSalesRollup, ('product_id',))):
+        model.objects.filter(within('period', ranges), granularity=SalesGranularity.DAY).delete()
+        insert_select(model, model.objects.order_by().filter(
+            within('period', ranges), granularity=SalesGranularity.HOUR,
+        ).annotate(day=Trunc('period', 'day', tzinfo=dt_timezone.utc)).values(*group, 'day').annotate(
+            day_granularity=Value(SalesGranularity.DAY), day_order_count=Sum('order_count'),
+            day_units=Sum('units'), day_revenue=Sum('revenue'),
+        ), rename={
+            'day': 'period', 'day_granularity': 'granularity', 'day_order_count': 'order_count',
+            'day_units': 'units', 'day_revenue': 'revenue',
+        })
+
+
+def recompute_sales_rollups(moments):
+    """
+    Recompute the hour and day rollups holding ``moments`` from the orders.
+
+    The hours are aggregated by a fixed set of statements per week of history
+    they span (see ``spans``); the days are then summed from their hours.
+    Call inside a transaction.
+    """
+    hours = {truncate(moment, SalesGranularity.HOUR) for moment in moments}
+    if not hours:
+        return
+    for ranges in spans(hours, HOUR, gap=SPAN_GAP):
+        recompute_hours(ranges)
+    for ranges in spans({truncate(hour, SalesGranularity.DAY) for hour in hours}, DAY):
+        recompute_days(ranges)
+    models_changed(SalesRollup, ProductSalesRollup)
+
+
+def watermark():
+    # Concurrent refreshes take turns on the single row
+    marks = SalesRollupWatermark.objects.all()
+    if connection.features.has_select_for_update:
+        marks = marks.select_for_update()
+    mark = marks.filter(pk=1).first()
+    return mark or SalesRollupWatermark.objects.create(pk=1)
+
+
+def refresh_sales_rollups(batch_size=ROLLUP_BATCH_SIZE, settle=ROLLUP_SETTLE_SECONDS, rebuild=False):
+    """
+    Bring the sales rollups up to date with the orders changed since the last refresh.
+
+    Orders are read in ``(updated_at, id)`` order past the stored watermark,
+    ``batch_size`` at a time, and the hours they were placed in recomputed;
+    each batch and the watermark it reached commit together. ``rebuild``
+    clears the rollups first and recomputes every hour with orders. Returns
+    the number of orders read.
+
+    Deleted orders, and the old hour of an order whose ``order_date`` is
+    edited, are handled by signals.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settle)
+    if rebuild:
+        with transaction.atomic():
+            watermark().delete()
+            for model in (SalesRollup, ProductSalesRollup):
+                model.objects.all().delete()
+            models_changed(SalesRollup, ProductSalesRollup)
+    read = 0
+    while True:
+        with transaction.atomic():
+            mark = watermark()
+            changed = Order.objects.filter(updated_at__lte=cutoff).order_by('updated_at', 'pk')
+            if mark.updated_at is not None:
+                # A range on updated_at, rather than an OR, lets the index return rows in order
+                changed = changed.filter(updated_at__gte=mark.updated_at).exclude(
+                    updated_at=mark.updated_at, pk__lte=mark.order_id,
+                )
+            batch = list(changed.values_list('pk', 'updated_at', 'order_date')[:batch_size])
+            if not batch:
+                break
+            recompute_sales_rollups(order_date for _, _, order_date in batch)
+            mark.order_id, mark.updated_at = batch[-1][:2]
+            mark.save()
+        read += len(batch)
+        if len(batch) < batch_size:
+            break
+    return read
+
+
+def sales_timeseries(granularity, since=None, until=None, product_id=None):
+    """Rollup rows of ``granularity`` with a period in ``[since, until]``, oldest first."""
+    if product_id is None:
+        rows = SalesRollup.objects.all()
+    else:
+        rows = ProductSalesRollup.objects.filter(product_id=product_id)
+    rows = rows.filter(granularity=granularity)
+    if since:
+        rows = rows.filter(period__gte=since)
+    if until:
+        rows = rows.filter(period__lte=until)
+    return list(rows.order_by('period').values('period', *ROLLUP_FIELDS))
+
+
+def order_saving(sender, instance, raw=False, **kwargs):
+    # The watermark only sees the hour an edited order is in now
+    if raw or instance._state.adding:
+        return
+    instance._saved_order_date = Order.objects.filter(pk=instance.pk).values_list('order_date', flat=True).first()
+
+
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    previous = instance.__dict__.pop('_saved_order_date', None)
+    if raw or created or previous is None or previous == instance.order_date:
+        return
+    on_commit_batched(recompute_sales_rollups, [previous, instance.order_date])
+
+
+def order_deleted(sender, instance, **kwargs):
+    # Deleting a customer deletes each of its orders: recompute their hours once, on commit
+    on_commit_batched(recompute_sales_rollups, [instance.order_date])
+
+
+def connect_order_signals():
+    pre_save.connect(order_saving, sender=Order, dispatch_uid='crm.rollups.presave')
+    post_save.connect(order_saved, sender=Order, dispatch_uid='crm.rollups.save')
+    post_delete.connect(order_deleted, sender=Order, dispatch_uid='crm.rollups.delete')
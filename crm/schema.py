@@ -1,40 +1,145 @@
 import graphene
+from graphene.utils.str_converters import to_snake_case
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import F
-from decimal import Decimal
 import re
-from .models import Customer, Order
+from decimal import Decimal
+from .models import Customer, CustomerStats, Order, OrderLine, ProductSalesRollup, SalesRollup
 from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .bulk import (
+    bulk_add_lines, bulk_create_customers, bulk_create_orders, missing_products_message, order_lines,
+    parse_ids, prepare_order,
+)
+from .broadcast import broadcast
+from .events import ORDERS_CHANNEL, STOCK_CHANNEL, stock_changed
+from .inventory import reserve_stock, restock_low_stock, write_transaction
+from .fields import CRMConnectionField
+from .loaders import get_loaders
+from .metrics import bulk_rows
+from .response_cache import models_changed
+from .rollups import sales_timeseries
+from .pagination import CountableConnection
+from .search import get_search_backend, search_orders
+from .stats import CRMStats, record_orders
 from crm.models import Product
 
 
 # Object Types with Node interface for filtering
 class CustomerType(DjangoObjectType):
+    # The order statistics are read from CustomerStats
+    cache_models = (CustomerStats,)
+
+    orders = CRMConnectionField('crm.schema.OrderType', loader='customer_orders')
+    order_count = graphene.Int()
+    lifetime_revenue = graphene.Decimal()
+    first_order_date = graphene.DateTime()
+    last_order_date = graphene.DateTime()
+
     class Meta:
         model = Customer
         fields = '__all__'
         filterset_class = CustomerFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+    def resolve_order_count(self, info):
+        stats = get_loaders(info).customer_stats.load(self.pk)
+        return stats.order_count if stats else 0
+
+    def resolve_lifetime_revenue(self, info):
+        stats = get_loaders(info).customer_stats.load(self.pk)
+        return stats.lifetime_revenue if stats else Decimal('0.00')
+
+    def resolve_first_order_date(self, info):
+        stats = get_loaders(info).customer_stats.load(self.pk)
+        return stats.first_order_date if stats else None
+
+    def resolve_last_order_date(self, info):
+        stats = get_loaders(info).customer_stats.load(self.pk)
+        return stats.last_order_date if stats else None
 
 
 class ProductType(DjangoObjectType):
+    orders = CRMConnectionField('crm.schema.OrderType', loader='product_orders')
+
     class Meta:
         model = Product
-        fields = '__all__'
+        # Lines are reached through their orders, which batch them
+        exclude = ('order_lines',)
         filterset_class = ProductFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+
+class OrderLineType(DjangoObjectType):
+    class Meta:
+        model = OrderLine
+        fields = ('product', 'quantity', 'unit_price')
 
 
 class OrderType(DjangoObjectType):
+    products = CRMConnectionField(ProductType, loader='order_products')
+    lines = graphene.List(graphene.NonNull(OrderLineType), required=True)
+
     class Meta:
         model = Order
         fields = '__all__'
         filterset_class = OrderFilter
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).order_customer.load(self.customer_id)
+
+    def resolve_lines(self, info):
+        return get_loaders(info).order_lines.load(self.pk)
+
+
+# Aggregate Types
+class StatsGranularity(graphene.Enum):
+    DAY = 'day'
+    WEEK = 'week'
+
+
+class RevenueBucketType(graphene.ObjectType):
+    period = graphene.DateTime()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+
+
+class CRMStatsType(graphene.ObjectType):
+    # Read by the aggregates, so the response cache invalidates on their writes
+    cache_models = (Customer, Order)
+
+    customer_count = graphene.Int()
+    order_count = graphene.Int()
+    total_revenue = graphene.Decimal()
+    revenue_buckets = graphene.List(
+        RevenueBucketType, granularity=StatsGranularity(default_value=StatsGranularity.DAY)
+    )
+
+    def resolve_revenue_buckets(self, info, granularity):
+        return self.revenue_buckets(granularity.value)
+
+
+class SalesGranularity(graphene.Enum):
+    HOUR = 'hour'
+    DAY = 'day'
+
+
+class SalesBucketType(graphene.ObjectType):
+    # Read from the rollup tables, not the orders
+    cache_models = (SalesRollup, ProductSalesRollup)
+
+    period = graphene.DateTime()
+    order_count = graphene.Int()
+    units = graphene.Int()
+    revenue = graphene.Decimal()
 
 
 # Input Types
@@ -48,11 +153,20 @@ class ProductInput(graphene.InputObjectType):
     name = graphene.String(required=True)
     price = graphene.Decimal(required=True)
     stock = graphene.Int(default_value=0)
+    reorder_point = graphene.Int()
+    reorder_quantity = graphene.Int()
+
+
+class OrderLineInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
 
 
 class OrderInput(graphene.InputObjectType):
     customer_id = graphene.ID(required=True)
-    product_ids = graphene.List(graphene.ID, required=True)
+    # Each ID is one unit; use `lines` to order several units of a product
+    product_ids = graphene.List(graphene.ID)
+    lines = graphene.List(OrderLineInput)
     order_date = graphene.DateTime()
 
 
@@ -65,6 +179,31 @@ def validate_phone(phone):
     return phone
 
 
+# Helper function turning an `order_by` argument such as "-orderDate,id" into model fields
+def parse_order_by(order_by):
+    return [to_snake_case(key.strip()) for key in order_by.split(',') if key.strip()]
+
+
+# allCustomers order_by keys read from CustomerStats
+CUSTOMER_STATS_ORDERING = ('order_count', 'lifetime_revenue', 'first_order_date', 'last_order_date')
+
+
+def customer_ordering(keys):
+    """Map statistics keys onto the CustomerStats join; customers without orders sort as the lowest values."""
+    ordering, by_stats = [], False
+    for key in keys:
+        name = key.lstrip('-')
+        if name in CUSTOMER_STATS_ORDERING:
+            by_stats = True
+            field = F(f'stats__{name}')
+            key = field.desc(nulls_last=True) if key.startswith('-') else field.asc(nulls_first=True)
+        ordering.append(key)
+    if by_stats:
+        # Every customer without orders ties, so pages need a tiebreaker
+        ordering.append('pk')
+    return ordering
+
+
 # Mutations
 class CreateCustomer(graphene.Mutation):
     class Arguments:
@@ -100,30 +239,12 @@ class BulkCreateCustomers(graphene.Mutation):
     errors = graphene.List(graphene.String)
 
     def mutate(self, info, input):
-        created_customers = []
-        errors = []
-
+        # Validate in memory, check existing emails in chunks and insert with bulk_create
         with transaction.atomic():
-            for idx, customer_data in enumerate(input):
-                try:
-                    validate_email(customer_data.email)
-                    if Customer.objects.filter(email=customer_data.email).exists():
-                        errors.append(f"Customer {idx}: Email already exists - {customer_data.email}")
-                        continue
-                    validate_phone(customer_data.phone)
-
-                    customer = Customer(
-                        name=customer_data.name,
-                        email=customer_data.email,
-                        phone=customer_data.phone or ''
-                    )
-                    customer.save()
-                    created_customers.append(customer)
-                except ValidationError as e:
-                    errors.append(f"Customer {idx}: {str(e)}")
-                except Exception as e:
-                    errors.append(f"Customer {idx}: {str(e)}")
+            created_customers, errors = bulk_create_customers(input)
 
+        bulk_rows.inc(len(created_customers), ('BulkCreateCustomers', 'created'))
+        bulk_rows.inc(len(errors), ('BulkCreateCustomers', 'errored'))
         return BulkCreateCustomers(customers=created_customers, errors=errors)
 
 
@@ -139,11 +260,17 @@ class CreateProduct(graphene.Mutation):
                 raise ValidationError("Price must be positive")
             if input.stock < 0:
                 raise ValidationError("Stock cannot be negative")
+            if input.reorder_point is not None and input.reorder_point < 0:
+                raise ValidationError("Reorder point cannot be negative")
+            if input.reorder_quantity is not None and input.reorder_quantity < 1:
+                raise ValidationError("Reorder quantity must be at least 1")
 
             product = Product(
                 name=input.name,
                 price=input.price,
-                stock=input.stock
+                stock=input.stock,
+                reorder_point=input.reorder_point,
+                reorder_quantity=input.reorder_quantity,
             )
             product.save()
 
@@ -165,78 +292,138 @@ class CreateOrder(graphene.Mutation):
             except Customer.DoesNotExist:
                 raise ValidationError("Invalid customer ID")
 
-            if not input.product_ids:
-                raise ValidationError("At least one product is required")
-
-            products = []
-            total_amount = Decimal('0.00')
-
-            for product_id in input.product_ids:
-                try:
-                    product = Product.objects.get(pk=product_id)
-                    products.append(product)
-                    total_amount += product.price
-                except Product.DoesNotExist:
-                    raise ValidationError(f"Invalid product ID: {product_id}")
-
-            order = Order(
-                customer=customer,
-                order_date=input.order_date,
-                total_amount=total_amount
+            # Resolve every product with one query and report all missing IDs together
+            product_pks, _ = parse_ids(product_id for product_id, _ in order_lines(input))
+            order, lines, quantities = prepare_order(
+                customer, input, Product.objects.in_bulk(product_pks)
             )
-            order.save()
-            order.products.set(products)
+
+            with write_transaction():
+                # Stock is decremented atomically so concurrent checkouts cannot oversell
+                reserve_stock(quantities)
+                order.save()
+                bulk_add_lines([(order, lines)])
 
             return CreateOrder(order=order)
         except ValidationError as e:
             raise Exception(str(e))
 
 
-class UpdateLowStockProducts(graphene.Mutation):
-    products = graphene.List(ProductType)
-    message = graphene.String()
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        input = graphene.List(OrderInput, required=True)
 
-    @transaction.atomic
-    def mutate(self, info):
-        # 1. Find products with stock < 10
-        low_stock_ids = list(Product.objects.filter(stock__lt=10).values_list('id', flat=True))
+    orders = graphene.List(OrderType)
+    errors = graphene.List(graphene.String)
 
-        if not low_stock_ids:
-            return UpdateLowStockProducts(products=[], message="No products required restocking.")
+    def mutate(self, info, input):
+        # Resolve customers/products in bulk and insert orders and their products in chunks
+        with write_transaction():
+            created_orders, errors = bulk_create_orders(input)
+            # bulk_create sends no post_save
+            record_orders(created_orders)
 
-        # 2. Atomically increment stock by 10 using F() expression
-        Product.objects.filter(id__in=low_stock_ids).update(stock=F('stock') + 10)
+        bulk_rows.inc(len(created_orders), ('BulkCreateOrders', 'created'))
+        bulk_rows.inc(len(errors), ('BulkCreateOrders', 'errored'))
+        return BulkCreateOrders(orders=created_orders, errors=errors)
 
-        # 3. Fetch the newly updated products to return them
-        updated_products = Product.objects.filter(id__in=low_stock_ids)
-        message = f"Successfully restocked {len(updated_products)} product(s)."
 
-        return UpdateLowStockProducts(products=updated_products, message=message)
+class UpdateLowStockProducts(graphene.Mutation):
+    class Arguments:
+        dry_run = graphene.Boolean(default_value=False)
+        summary_only = graphene.Boolean(default_value=False)
+        first = graphene.Int()
+        after = graphene.ID()
+
+    products = graphene.List(ProductType)
+    count = graphene.Int()
+    units = graphene.Int()
+    # Pass as ``after`` to carry on; null once every product was examined
+    cursor = graphene.ID()
+    message = graphene.String()
+
+    def mutate(self, info, dry_run, summary_only, first=None, after=None):
+        # Restocked range by range in short transactions, not one long write lock
+        if first is not None and first < 1:
+            raise Exception("first must be at least 1")
+        try:
+            after = int(after or 0)
+        except ValueError:
+            raise Exception(f"Invalid cursor: {after}")
+        result = restock_low_stock(dry_run=dry_run, keep_products=not summary_only, first=first, after=after)
+
+        if not result.count:
+            message = "No products required restocking."
+        elif dry_run:
+            message = f"Would restock {result.count} product(s) with {result.units} unit(s)."
+        else:
+            message = f"Successfully restocked {result.count} product(s) with {result.units} unit(s)."
+        return UpdateLowStockProducts(
+            products=result.products, count=result.count, units=result.units, cursor=result.cursor,
+            message=message,
+        )
 
 # Query with filtering support
 class Query(graphene.ObjectType):
-    all_customers = DjangoFilterConnectionField(CustomerType, order_by=graphene.String())
-    all_products = DjangoFilterConnectionField(ProductType, order_by=graphene.String())
-    all_orders = DjangoFilterConnectionField(OrderType, order_by=graphene.String())
-
-    def resolve_all_customers(self, info, order_by=None, **kwargs):
+    all_customers = CRMConnectionField(
+        CustomerType, order_by=graphene.String(), search=graphene.String(), optimize=True
+    )
+    all_products = CRMConnectionField(
+        ProductType, order_by=graphene.String(), search=graphene.String(), optimize=True
+    )
+    all_orders = CRMConnectionField(
+        OrderType, order_by=graphene.String(), search=graphene.String(), optimize=True, keyset=True
+    )
+    crm_stats = graphene.Field(
+        CRMStatsType, order_date__gte=graphene.DateTime(), order_date__lte=graphene.DateTime()
+    )
+    sales_timeseries = graphene.List(
+        SalesBucketType,
+        granularity=SalesGranularity(default_value=SalesGranularity.DAY),
+        from_=graphene.DateTime(name='from'),
+        to=graphene.DateTime(),
+        product_id=graphene.ID(),
+    )
+
+    def resolve_all_customers(self, info, order_by=None, search=None, **kwargs):
         qs = Customer.objects.all()
+        if search:
+            # Most relevant first unless an explicit order is requested
+            qs = get_search_backend().search(qs, search)
         if order_by:
-            qs = qs.order_by(order_by)
+            qs = qs.order_by(*customer_ordering(parse_order_by(order_by)))
         return qs
 
-    def resolve_all_products(self, info, order_by=None, **kwargs):
+    def resolve_all_products(self, info, order_by=None, search=None, **kwargs):
         qs = Product.objects.all()
+        if search:
+            qs = get_search_backend().search(qs, search)
         if order_by:
-            qs = qs.order_by(order_by)
+            qs = qs.order_by(*parse_order_by(order_by))
         return qs
 
-    def resolve_all_orders(self, info, order_by=None, **kwargs):
+    def resolve_all_orders(self, info, order_by=None, search=None, **kwargs):
         qs = Order.objects.all()
+        if search:
+            # Orders keep their date ordering, which keyset pagination seeks on
+            qs = search_orders(qs, search)
         if order_by:
-            qs = qs.order_by(order_by)
+            qs = qs.order_by(*parse_order_by(order_by))
         return qs
 
+    def resolve_crm_stats(self, info, order_date__gte=None, order_date__lte=None):
+        return CRMStats(since=order_date__gte, until=order_date__lte)
+
+    def resolve_sales_timeseries(self, info, granularity, from_=None, to=None, product_id=None):
+        if product_id is not None:
+            try:
+                found = Product.objects.filter(pk=product_id).exists()
+            except ValueError:
+                found = False
+            if not found:
+                raise Exception(missing_products_message([product_id]))
+        return sales_timeseries(granularity.value, since=from_, until=to, product_id=product_id)
+
 
 # Mutation
 class Mutation(graphene.ObjectType):
@@ -244,4 +431,36 @@ class Mutation(graphene.ObjectType):
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
+
+
+# Subscriptions: events carry primary keys, and every delivery reads the committed row
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(OrderType)
+    product_stock_changed = graphene.Field(ProductType, product_id=graphene.ID())
+    # Without a threshold, each product alerts below its own reorder point
+    low_stock_alert = graphene.Field(ProductType, threshold=graphene.Int())
+
+    async def subscribe_order_created(root, info):
+        async for event in broadcast.subscribe(ORDERS_CHANNEL):
+            yield event['id']
+
+    async def subscribe_product_stock_changed(root, info, product_id=None):
+        async for event in broadcast.subscribe(STOCK_CHANNEL):
+            if product_id is None or str(event['id']) == str(product_id):
+                yield event['id']
+
+    async def subscribe_low_stock_alert(root, info, threshold=None):
+        async for event in broadcast.subscribe(STOCK_CHANNEL):
+            if event['stock'] < (event['reorder_point'] if threshold is None else threshold):
+                yield event['id']
+
+    def resolve_order_created(root, info):
+        return Order.objects.filter(pk=root).first()
+
+    def resolve_product_stock_changed(root, info, product_id=None):
+        return Product.objects.filter(pk=root).first()
+
+    def resolve_low_stock_alert(root, info, threshold=None):
+        return Product.objects.filter(pk=root).first()
@@ -0,0 +1,199 @@
+import json
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+from .models import Customer, CustomerSearch, OrderLine, Product, ProductSearch
+
+
+def search_terms(text):
+    return (text or '').split()
+
+
+class ContainsSearchBackend:
+    """
+    Portable search: ``icontains`` on every searchable field.
+
+    Works on any database but cannot use an index, so it scans the table.
+    Results are ranked exact match first, then prefix matches, then the rest.
+    """
+
+    fields = {
+        Customer: ['name', 'email'],
+        Product: ['name'],
+    }
+
+    def filter(self, queryset, value, fields):
+        """Rows where any of ``fields`` contains ``value``, ignoring case."""
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': value})
+        return queryset.filter(condition)
+
+    def matching(self, queryset, text):
+        """Rows where every term of ``text`` occurs in one of the searchable fields."""
+        for term in search_terms(text):
+            queryset = self.filter(queryset, term, self.fields[queryset.model])
+        return queryset
+
+    def search(self, queryset, text):
+        """``matching`` rows, most relevant first."""
+        field = self.fields[queryset.model][0]
+        return self.matching(queryset, text).annotate(
+            search_rank=Case(
+                When(**{f'{field}__iexact': text}, then=Value(0)),
+                When(**{f'{field}__istartswith': text}, then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField(),
+            )
+        ).order_by('search_rank', 'pk')
+
+
+class FTS5SearchBackend(ContainsSearchBackend):
+    """
+    Search through the SQLite FTS5 trigram indexes created by migration 0004.
+
+    Trigrams match arbitrary substrings, so results are the same as the contains
+    backend, but come from the index instead of a table scan and are ranked by
+    bm25. Terms shorter than three characters have no trigrams and fall back to
+    the contains backend.
+    """
+
+    indexes = {
+        Customer: CustomerSearch,
+        Product: ProductSearch,
+    }
+
+    @staticmethod
+    def phrase(value):
+        return '"' + value.replace('"', '""') + '"'
+
+    def index_matches(self, model, expression):
+        return self.indexes[model].objects.filter(document__match=expression).values('pk')
+
+    def filter(self, queryset, value, fields):
+        if len(value) < 3:
+            return super().filter(queryset, value, fields)
+        expression = f"{{{' '.join(fields)}}} : {self.phrase(value)}"
+        return queryset.filter(pk__in=self.index_matches(queryset.model, expression))
+
+    def expression(self, text):
+        terms = search_terms(text)
+        if terms and all(len(term) >= 3 for term in terms):
+            return ' '.join(self.phrase(term) for term in terms)
+
+    def matching(self, queryset, text):
+        expression = self.expression(text)
+        if expression is None:
+            return super().matching(queryset, text)
+        return queryset.filter(pk__in=self.index_matches(queryset.model, expression))
+
+    def search(self, queryset, text):
+        expression = self.expression(text)
+        if expression is None:
+            return super().search(queryset, text)
+        # Joining the index exposes bm25 as its `rank` column; lower is better
+        return queryset.filter(search_index__document__match=expression).annotate(
+            search_rank=F('search_index__rank')
+        ).order_by('search_rank', 'pk')
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """
+    Return the configured search backend.
+
+    ``CRM_SEARCH_BACKEND`` may name a backend class; by default the FTS5 backend
+    is used when its index tables exist and the contains backend otherwise.
+    """
+    # Keyed by database so switching to the test database re-checks for the index
+    database = connection.settings_dict['NAME']
+    if database not in _backends:
+        path = getattr(settings, 'CRM_SEARCH_BACKEND', None)
+        if path:
+            _backends[database] = import_string(path)()
+        elif CustomerSearch._meta.db_table in connection.introspection.table_names():
+            _backends[database] = FTS5SearchBackend()
+        else:
+            _backends[database] = ContainsSearchBackend()
+    return _backends[database]
+
+
+def search_orders(queryset, text):
+    """Orders whose customer (name or email) or one of whose products matches ``text``."""
+    backend = get_search_backend()
+    customers = backend.matching(Customer.objects.all(), text).values('pk')
+    products = backend.matching(Product.objects.all(), text).values('pk')
+    lines = OrderLine.objects.filter(product__in=products).values('order_id')
+    return queryset.filter(Q(customer__in=customers) | Q(pk__in=lines))
+
+
+def index_trigger(model, suffix):
+    """``(index table, CREATE TRIGGER sql)`` of a ``model`` FTS5 trigger, or ``None`` without one."""
+    search_model = FTS5SearchBackend.indexes.get(model)
+    if connection.vendor != 'sqlite' or search_model is None:
+        return None
+    table = search_model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = %s", [f'{table}_{suffix}'])
+        found = cursor.fetchone()
+    return (table, found[0]) if found else None
+
+
+@contextmanager
+def bulk_indexing(model):
+    """
+    Index rows of ``model`` inserted in bulk with one statement instead of a trigger per row.
+
+    Must run inside a transaction: the FTS5 insert trigger is dropped for the
+    block and restored at its end, so other connections never see it missing.
+    Yields ``index(pks)``, to be called once the rows with ``pks`` are written.
+    """
+    trigger = index_trigger(model, 'ai')
+    if trigger is None:
+        yield lambda pks: None
+        return
+
+    table, sql = trigger
+    columns = ', '.join(ContainsSearchBackend.fields[model])
+
+    def index(pks):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table}(rowid, {columns}) SELECT id, {columns} FROM {model._meta.db_table} "
+                f"WHERE id IN (SELECT value FROM json_each(%s))",
+                [json.dumps(list(pks))],
+            )
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TRIGGER {table}_ai")
+    try:
+        yield index
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+
+def delete_all(model):
+    """
+    Delete every row of ``model`` and empty its FTS5 index, without a trigger per row.
+
+    Must run inside a transaction, for the same reason as ``bulk_indexing``.
+    """
+    trigger = index_trigger(model, 'ad')
+    with connection.cursor() as cursor:
+        if trigger is None:
+            cursor.execute(f"DELETE FROM {model._meta.db_table}")
+            return
+        table, sql = trigger
+        cursor.execute(f"DROP TRIGGER {table}_ad")
+        try:
+            cursor.execute(f"DELETE FROM {model._meta.db_table}")
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('delete-all')")
+        finally:
+            cursor.execute(sql)
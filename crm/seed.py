@@ -0,0 +1,295 @@
+import random
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import lru_cache
+from itertools import accumulate
+from math import ceil, gcd
+
+import django
+from django.db import connection, transaction
+
+from .bulk import insert_rows
+from .importer import reset_sequences, write_rows
+from .models import (
+    Customer, CustomerStats, Order, OrderLine, Product, ProductSalesRollup, SalesRollup, SalesRollupWatermark,
+)
+from .response_cache import models_changed
+from .rollups import refresh_sales_rollups
+from .search import delete_all
+from .stats import rebuild_customer_stats
+
+# customers, products, orders
+SCALES = {
+    'small': (10_000, 1_000, 100_000),
+    'medium': (100_000, 10_000, 1_000_000),
+    'large': (1_000_000, 100_000, 10_000_000),
+}
+# Rows generated, and committed, together
+CHUNK_SIZE = 50_000
+# Product popularity is Zipfian with this exponent
+PRODUCT_ZIPF_EXPONENT = 1.1
+# Buyers are drawn as rank = n * random() ** skew: with 4 the top 20% of
+# customers place two thirds of the orders and many never order at all
+REPEAT_BUYER_SKEW = 4.0
+
+FIRST_NAMES = (
+    "Ada", "Alan", "Amara", "Ana", "Arjun", "Beatriz", "Carlos", "Chen", "Chloe", "Dmitri", "Elena", "Emeka",
+    "Fatima", "Grace", "Hana", "Hugo", "Ines", "Ivan", "Jamal", "Julia", "Kenji", "Lars", "Leila", "Liam",
+    "Lucia", "Mateo", "Mei", "Nadia", "Noah", "Olga", "Omar", "Priya", "Rafael", "Sara", "Sofia", "Tariq",
+    "Wei", "Yara", "Yusuf", "Zoe",
+)
+LAST_NAMES = (
+    "Adeyemi", "Andersen", "Bauer", "Costa", "Dubois", "Fernandes", "Garcia", "Haddad", "Hopper", "Ivanova",
+    "Johnson", "Kim", "Kowalski", "Lovelace", "Martin", "Mensah", "Moreau", "Nakamura", "Novak", "Okafor",
+    "Olsen", "Patel", "Rossi", "Santos", "Schmidt", "Silva", "Smith", "Tanaka", "Turing", "Wang",
+)
+EMAIL_DOMAINS = ("example.com", "example.org", "example.net", "mail.example.com")
+PRODUCT_ADJECTIVES = (
+    "Compact", "Classic", "Deluxe", "Ergonomic", "Portable", "Premium", "Rugged", "Smart", "Solar", "Ultra",
+    "Wireless", "Mini",
+)
+PRODUCT_NOUNS = (
+    "Backpack", "Cable", "Charger", "Desk Lamp", "Headphones", "Keyboard", "Laptop", "Monitor", "Mouse",
+    "Notebook", "Speaker", "Tablet", "Thermos", "Webcam",
+)
+
+
+class Dataset(namedtuple('Dataset', 'customers products orders seed start days', defaults=(42, None, 3 * 365))):
+    """
+    Sizes and seed of a synthetic dataset.
+
+    Every chunk is generated from its own ``random.Random``, seeded by the
+    dataset seed, the kind of row and the chunk number, so the data is the same
+    whichever process, and however many processes, generate it.
+    """
+
+    @classmethod
+    def for_scale(cls, scale, **options):
+        customers, products, orders = SCALES[scale]
+        return cls(customers, products, orders, **options)
+
+    @property
+    def start_time(self):
+        return self.start or datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    @property
+    def span(self):
+        return timedelta(days=self.days)
+
+    def random(self, kind, chunk):
+        return random.Random(f'{self.seed}:{kind}:{chunk}')
+
+    def chunks(self, kind):
+        return range(ceil(getattr(self, kind) / CHUNK_SIZE))
+
+    def pk_range(self, kind, chunk):
+        return range(chunk * CHUNK_SIZE + 1, min((chunk + 1) * CHUNK_SIZE, getattr(self, kind)) + 1)
+
+    def customer_created_at(self, pk):
+        # Customers sign up at a steady rate over the whole span, in primary key order
+        return self.start_time + self.span * ((pk - 1) / self.customers)
+
+
+def stride(count, seed):
+    """A multiplier coprime to ``count``, so ``rank * stride % count`` shuffles ranks onto keys."""
+    value = random.Random(f'{seed}:stride:{count}').randrange(count // 2 + 1, count + count // 2 + 2)
+    while gcd(value, count) != 1:
+        value += 1
+    return value
+
+
+def customer_rows(dataset, chunk):
+    rng = dataset.random('customers', chunk)
+    db_datetime = connection.ops.adapt_datetimefield_value
+    rows = []
+    for pk in dataset.pk_range('customers', chunk):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        roll = rng.random()
+        if roll < 0.2:
+            phone = ''
+        elif roll < 0.7:
+            phone = f"+{rng.randint(1, 99)}-{rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        else:
+            phone = f"{rng.randint(200, 999)}.{rng.randint(100, 999)}.{rng.randint(1000, 9999)}"
+        created_at = db_datetime(dataset.customer_created_at(pk))
+        rows.append([
+            pk, f"{first} {last}", f"{first}.{last}{pk}@{rng.choice(EMAIL_DOMAINS)}".lower(), phone,
+            created_at, created_at,
+        ])
+    return rows
+
+
+def product_rows(dataset, chunk):
+    rng = dataset.random('products', chunk)
+    db_datetime = connection.ops.adapt_datetimefield_value
+    rows = []
+    for pk in dataset.pk_range('products', chunk):
+        # Log-normal prices around $30, ending in .99
+        cents = int(rng.lognormvariate(8.0, 1.0)) // 100 * 100 + 99
+        # The catalogue is built during the first half of the span
+        created_at = db_datetime(dataset.start_time + dataset.span * (pk / dataset.products / 2))
+        rows.append([
+            pk, f"{rng.choice(PRODUCT_ADJECTIVES)} {rng.choice(PRODUCT_NOUNS)} {pk}",
+            Decimal(cents).scaleb(-2), rng.randint(0, 500), created_at, created_at,
+        ])
+    return rows
+
+
+@lru_cache(maxsize=4)
+def product_prices(dataset):
+    """Price in cents by product key (index 0 unused), regenerated from the product chunks."""
+    prices = [0] * (dataset.products + 1)
+    for chunk in dataset.chunks('products'):
+        for row in product_rows(dataset, chunk):
+            prices[row[0]] = int(row[2].scaleb(2))
+    return prices
+
+
+@lru_cache(maxsize=4)
+def product_popularity(dataset):
+    """Cumulative Zipf weights by popularity rank, for ``random.choices``."""
+    return list(accumulate(1 / rank ** PRODUCT_ZIPF_EXPONENT for rank in range(1, dataset.products + 1)))
+
+
+def order_rows(dataset, chunk):
+    """
+    ``(orders, lines)``: ``[pk, customer_id, total_amount, order_date, created_at, updated_at]``
+    and ``(order_id, product_id, quantity, unit_price)``; every line is one unit.
+    """
+    rng = dataset.random('orders', chunk)
+    db_datetime = connection.ops.adapt_datetimefield_value
+    prices = product_prices(dataset)
+    popularity = product_popularity(dataset)
+    ranks = range(dataset.products)
+    customer_stride = stride(dataset.customers, dataset.seed)
+    product_stride = stride(dataset.products, dataset.seed)
+    end = dataset.start_time + dataset.span
+
+    orders, lines = [], []
+    for pk in dataset.pk_range('orders', chunk):
+        buyer_rank = int(dataset.customers * rng.random() ** REPEAT_BUYER_SKEW)
+        customer_pk = buyer_rank * customer_stride % dataset.customers + 1
+        count = min(1 + int(rng.expovariate(0.8)), 8)
+        product_pks = list(dict.fromkeys(
+            rank * product_stride % dataset.products + 1
+            for rank in rng.choices(ranks, cum_weights=popularity, k=count)
+        ))
+        created = dataset.customer_created_at(customer_pk)
+        order_date = db_datetime(created + (end - created) * rng.random())
+        orders.append([
+            pk, customer_pk, Decimal(sum(prices[product_pk] for product_pk in product_pks)).scaleb(-2),
+            order_date, order_date, order_date,
+        ])
+        lines.extend((pk, product_pk, 1, Decimal(prices[product_pk]).scaleb(-2)) for product_pk in product_pks)
+    return orders, lines
+
+
+GENERATORS = {
+    'customers': customer_rows,
+    'products': product_rows,
+    'orders': order_rows,
+}
+
+
+def generate(dataset, kind, chunk):
+    return GENERATORS[kind](dataset, chunk)
+
+
+def generated(dataset, kind, pool=None, ahead=0):
+    """Yield the chunks of ``kind`` in order; with a process ``pool``, up to ``ahead`` are generated in advance."""
+    if pool is None:
+        for chunk in dataset.chunks(kind):
+            yield generate(dataset, kind, chunk)
+        return
+    pending = deque()
+    for chunk in dataset.chunks(kind):
+        pending.append(pool.submit(generate, dataset, kind, chunk))
+        if len(pending) > ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@contextmanager
+def bulk_load_pragmas():
+    """
+    SQLite settings for loading a dataset fast, restored afterwards.
+
+    No fsyncs and an in-memory rollback journal: a crash of the process still
+    rolls back, but losing the machine mid-load can corrupt the file, which is
+    fine for generated data. A 256 MiB page cache keeps the indexes in memory,
+    and foreign keys go unchecked since generated keys are consistent.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    pragmas = {
+        'synchronous': 'OFF', 'journal_mode': 'MEMORY', 'cache_size': '-262144', 'temp_store': 'MEMORY',
+        'foreign_keys': 'OFF',
+    }
+    saved = {}
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}')
+            saved[name] = cursor.fetchone()[0]
+            cursor.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for name, value in saved.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def clear():
+    """Delete every order, customer and product, emptying the search indexes in one statement each."""
+    with transaction.atomic():
+        for model in (
+            OrderLine, CustomerStats, SalesRollup, ProductSalesRollup, SalesRollupWatermark, Order,
+            Customer, Product,
+        ):
+            delete_all(model)
+
+
+def load(dataset, workers=1, on_chunk=None):
+    """
+    Replace the CRM data with ``dataset``.
+
+    Chunks are inserted as they are generated, one transaction each, by this
+    process; with ``workers`` > 1 a process pool generates them. ``on_chunk(kind,
+    rows)`` is called after each commit. Customer statistics and sales rollups
+    are rebuilt from the orders at the end.
+    """
+    fields = {
+        'customers': (Customer, ('name', 'email', 'phone', 'created_at', 'updated_at')),
+        'products': (Product, ('name', 'price', 'stock', 'created_at', 'updated_at')),
+        'orders': (Order, ('customer_id', 'total_amount', 'order_date', 'created_at', 'updated_at')),
+    }
+    line_fields = [OrderLine._meta.get_field(name) for name in ('order', 'product', 'quantity', 'unit_price')]
+    pool = ProcessPoolExecutor(workers, initializer=django.setup) if workers > 1 else None
+    try:
+        with bulk_load_pragmas():
+            clear()
+            for kind in ('customers', 'products', 'orders'):
+                model, names = fields[kind]
+                for rows in generated(dataset, kind, pool, ahead=2 * workers):
+                    with transaction.atomic():
+                        if kind == 'orders':
+                            rows, lines = rows
+                            write_rows(model, names, rows)
+                            insert_rows(OrderLine._meta.db_table, line_fields, lines)
+                        else:
+                            write_rows(model, names, rows)
+                    if on_chunk is not None:
+                        on_chunk(kind, len(rows))
+            rebuild_customer_stats()
+            refresh_sales_rollups(settle=0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    reset_sequences(Customer, Product, Order)
+    # Raw inserts send no post_save
+    models_changed(Customer, Product, Order)
@@ -0,0 +1,244 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Greatest, Least, TruncDay, TruncWeek
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .bulk import BULK_BATCH_SIZE, chunked, existing_values, insert_rows, on_commit_batched
+from .models import Customer, CustomerStats, Order
+from .response_cache import models_changed
+
+# Customers whose statistics are recomputed per transaction by rebuild_customer_stats
+CUSTOMER_STATS_CHUNK_SIZE = getattr(settings, 'CRM_CUSTOMER_STATS_CHUNK_SIZE', 10000)
+
+STATS_FIELDS = ('order_count', 'lifetime_revenue', 'first_order_date', 'last_order_date')
+
+TRUNCATE = {
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+
+
+class CRMStats:
+    """
+    Aggregate figures over the orders placed in ``[since, until]``.
+
+    Every figure is computed in the database and cached on first access, so a
+    report costs a fixed number of queries however many orders exist.
+    """
+
+    def __init__(self, since=None, until=None):
+        self.orders = Order.objects.order_by()
+        if since:
+            self.orders = self.orders.filter(order_date__gte=since)
+        if until:
+            self.orders = self.orders.filter(order_date__lte=until)
+        self._totals = None
+
+    @property
+    def customer_count(self):
+        return Customer.objects.count()
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            self._totals = self.orders.aggregate(
+                order_count=Count('id'),
+                total_revenue=Sum('total_amount'),
+            )
+        return self._totals
+
+    @property
+    def order_count(self):
+        return self.totals['order_count']
+
+    @property
+    def total_revenue(self):
+        return self.totals['total_revenue'] or Decimal('0.00')
+
+    def revenue_buckets(self, granularity='day'):
+        """Order count and revenue per day or week, oldest bucket first."""
+        return list(
+            self.orders
+            .annotate(period=TRUNCATE[granularity]('order_date'))
+            .values('period')
+            .annotate(order_count=Count('id'), revenue=Sum('total_amount'))
+            .order_by('period')
+        )
+
+
+def customer_totals(orders):
+    """Aggregate the customer statistics of ``orders`` (a queryset) in the database, by customer key."""
+    revenue = CustomerStats._meta.get_field('lifetime_revenue')
+    rows = orders.order_by().values('customer_id').annotate(
+        order_count=Count('id'),
+        # Wider than an order total
+        lifetime_revenue=Sum('total_amount', output_field=revenue),
+        first_order_date=Min('order_date'), last_order_date=Max('order_date'),
+    )
+    cent = Decimal(1).scaleb(-revenue.decimal_places)
+    totals = {}
+    for row in rows:
+        # SQLite sums decimals as floats and the aggregate comes back unrounded
+        row['lifetime_revenue'] = row['lifetime_revenue'].quantize(cent)
+        totals[row['customer_id']] = tuple(row[name] for name in STATS_FIELDS)
+    return totals
+
+
+def lock_customers(pks):
+    # Orders of one customer then write their row one after the other
+    if connection.features.has_select_for_update:
+        list(Customer.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk'))
+
+
+def upsert_sql():
+    """The ``ON CONFLICT`` clause adding inserted statistics to the stored ones."""
+    quote = connection.ops.quote_name
+    table = quote(CustomerStats._meta.db_table)
+    least, greatest = ('MIN', 'MAX') if connection.vendor == 'sqlite' else ('LEAST', 'GREATEST')
+    assignments = {
+        'order_count': '{0} + {1}', 'lifetime_revenue': '{0} + {1}',
+        'first_order_date': least + '({0}, {1})', 'last_order_date': greatest + '({0}, {1})',
+    }
+    return f" ON CONFLICT ({quote(CustomerStats._meta.pk.column)}) DO UPDATE SET " + ', '.join(
+        f"{quote(name)} = " + expression.format(f'{table}.{quote(name)}', f'excluded.{quote(name)}')
+        for name, expression in assignments.items()
+    )
+
+
+def record_orders(orders):
+    """
+    Add newly saved ``orders`` (or rows with their ``customer_id``,
+    ``total_amount`` and ``order_date``) to their customers' statistics.
+
+    Call inside the transaction that saved them. Where the backend supports
+    ``INSERT ... ON CONFLICT DO UPDATE`` every batch of customers is inserted
+    or incremented by one statement, so recording an order costs one query.
+    """
+    totals = {}
+    for order in orders:
+        count, revenue, first, last = totals.get(
+            order.customer_id, (0, Decimal('0.00'), order.order_date, order.order_date)
+        )
+        totals[order.customer_id] = (
+            count + 1, revenue + order.total_amount, min(first, order.order_date), max(last, order.order_date),
+        )
+    if not totals:
+        return
+
+    opts = CustomerStats._meta
+    fields = [opts.pk] + [opts.get_field(name) for name in STATS_FIELDS]
+    if connection.features.supports_update_conflicts_with_target:
+        rows = [
+            [field.get_db_prep_save(value, connection) for field, value in zip(fields, (pk, *values))]
+            for pk, values in totals.items()
+        ]
+        insert_rows(opts.db_table, fields, rows, on_conflict=upsert_sql())
+    else:
+        lock_customers(sorted(totals))
+        for pk, (count, revenue, first, last) in totals.items():
+            updated = CustomerStats.objects.filter(pk=pk).update(
+                order_count=F('order_count') + count,
+                lifetime_revenue=F('lifetime_revenue') + revenue,
+                first_order_date=Least('first_order_date', Value(first, output_field=fields[3])),
+                last_order_date=Greatest('last_order_date', Value(last, output_field=fields[4])),
+            )
+            if not updated:
+                CustomerStats.objects.create(
+                    customer_id=pk, order_count=count, lifetime_revenue=revenue,
+                    first_order_date=first, last_order_date=last,
+                )
+    models_changed(CustomerStats)
+
+
+def refresh_customer_stats(customer_pks):
+    """
+    Recompute the statistics of ``customer_pks`` from their orders.
+
+    For writes that cannot be applied incrementally: edited and deleted orders.
+    """
+    pks = sorted(set(customer_pks))
+    if not pks:
+        return
+    lock_customers(pks)
+    for chunk in chunked(pks, BULK_BATCH_SIZE):
+        totals = customer_totals(Order.objects.filter(customer_id__in=chunk))
+        CustomerStats.objects.filter(pk__in=chunk).delete()
+        CustomerStats.objects.bulk_create(
+            CustomerStats(customer_id=pk, **dict(zip(STATS_FIELDS, values))) for pk, values in totals.items()
+        )
+    models_changed(CustomerStats)
+
+
+StatsDrift = namedtuple('StatsDrift', 'customers missing changed stale')
+
+
+def rebuild_customer_stats(chunk_size=CUSTOMER_STATS_CHUNK_SIZE, write=True):
+    """
+    Recompute every customer's statistics from the orders, ``chunk_size`` customers at a time.
+
+    Each chunk is compared with the stored rows and, with ``write``, replaced in
+    its own transaction. Returns a ``StatsDrift`` counting the customers checked
+    and the rows that were missing, differed or belonged to customers without
+    orders.
+    """
+    drift = StatsDrift(0, 0, 0, 0)
+    last_pk = Customer.objects.aggregate(top=Max('pk'))['top'] or 0
+    for start in range(0, last_pk, chunk_size):
+        end = start + chunk_size
+        with transaction.atomic():
+            totals = customer_totals(Order.objects.filter(customer_id__gt=start, customer_id__lte=end))
+            stats = CustomerStats.objects.filter(pk__gt=start, pk__lte=end)
+            stored = {row[0]: row[1:] for row in stats.values_list('pk', *STATS_FIELDS)}
+            drift = StatsDrift(
+                drift.customers + Customer.objects.filter(pk__gt=start, pk__lte=end).count(),
+                drift.missing + len(totals.keys() - stored.keys()),
+                drift.changed + sum(1 for pk, values in totals.items() if pk in stored and stored[pk] != values),
+                drift.stale + len(stored.keys() - totals.keys()),
+            )
+            if write:
+                stats.delete()
+                CustomerStats.objects.bulk_create(
+                    (CustomerStats(customer_id=pk, **dict(zip(STATS_FIELDS, values))) for pk, values in totals.items()),
+                    batch_size=BULK_BATCH_SIZE,
+                )
+    if write:
+        models_changed(CustomerStats)
+    return drift
+
+
+def order_saving(sender, instance, raw=False, **kwargs):
+    # An edit may move the order to another customer, whose statistics lose it
+    if raw or instance._state.adding:
+        return
+    instance._saved_customer_id = Order.objects.filter(pk=instance.pk).values_list('customer_id', flat=True).first()
+
+
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_orders([instance])
+    else:
+        previous = instance.__dict__.pop('_saved_customer_id', None)
+        refresh_customer_stats([instance.customer_id] + ([previous] if previous is not None else []))
+
+
+def refresh_remaining_customers(customer_pks):
+    # Customers deleted along with their orders have no statistics to refresh
+    refresh_customer_stats(existing_values(Customer, 'pk', sorted(customer_pks)))
+
+
+def order_deleted(sender, instance, **kwargs):
+    # Deleting a customer deletes each of its orders: refresh once, on commit
+    on_commit_batched(refresh_remaining_customers, [instance.customer_id])
+
+
+def connect_order_signals():
+    # Orders saved one at a time (CreateOrder, edits); bulk writers record their orders themselves
+    pre_save.connect(order_saving, sender=Order, dispatch_uid='crm.stats.presave')
+    post_save.connect(order_saved, sender=Order, dispatch_uid='crm.stats.save')
+    post_delete.connect(order_deleted, sender=Order, dispatch_uid='crm.stats.delete')
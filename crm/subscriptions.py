@@ -0,0 +1,266 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import transaction
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast
+from graphql.execution.subscribe import create_source_event_stream
+
+from .cost import CLIENT_BUDGET, MAX_QUERY_COST, MAX_QUERY_DEPTH, CostAnalyzer, TokenBucket
+from .documents import document_cache
+from .executor import run_sync
+from .loaders import Loaders
+from .metrics import Counter
+
+TRANSPORT_WS = 'graphql-transport-ws'
+LEGACY_WS = 'graphql-ws'
+
+CONNECTION_INIT_TIMEOUT = getattr(settings, 'GRAPHQL_WS_CONNECTION_INIT_TIMEOUT', 3)
+KEEPALIVE_INTERVAL = getattr(settings, 'GRAPHQL_WS_KEEPALIVE_INTERVAL', 12)
+MAX_OPERATIONS = getattr(settings, 'GRAPHQL_WS_MAX_OPERATIONS', 20)
+
+subscription_operations = Counter(
+    'graphql_ws_operations_total',
+    'Operations started over WebSockets by type.',
+    labelnames=('type',),
+)
+
+
+class GraphQLWebSocket:
+    """
+    ASGI application serving GraphQL over WebSockets.
+
+    Speaks ``graphql-transport-ws`` (the graphql-ws library) and the legacy
+    ``graphql-ws`` protocol of subscriptions-transport-ws, which GraphiQL uses.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    async def __call__(self, scope, receive, send):
+        await GraphQLWebSocketConnection(self.schema, scope, receive, send).run()
+
+
+class GraphQLWebSocketConnection:
+    """
+    One socket and the operations running on it.
+
+    Each operation is a task that sends its results as they come; sends wait
+    on the socket, so a slow client holds back its own operations, whose
+    subscription queues then drop the oldest events. At most ``MAX_OPERATIONS``
+    run per connection. Every operation is charged, once when it starts, to
+    the same per-client ``budget`` as over HTTP.
+    """
+
+    budget = TokenBucket() if CLIENT_BUDGET else None
+
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self.protocol = None
+        self.initialized = False
+        self.closed = False
+        self.operations = {}
+        self.tasks = set()
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        offered = self.scope.get('subprotocols') or []
+        self.protocol = next((protocol for protocol in (TRANSPORT_WS, LEGACY_WS) if protocol in offered), None)
+        if self.protocol is None:
+            await self._send({'type': 'websocket.close', 'code': 4406})
+            return
+        await self._send({'type': 'websocket.accept', 'subprotocol': self.protocol})
+        self.start(self.wait_for_init())
+
+        try:
+            while not self.closed:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or (message.get('bytes') or b'').decode())
+        finally:
+            self.closed = True
+            for task in list(self.tasks):
+                task.cancel()
+
+    def start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def send(self, message):
+        async with self._send_lock:
+            if not self.closed:
+                await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason=''):
+        async with self._send_lock:
+            if not self.closed:
+                self.closed = True
+                await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def wait_for_init(self):
+        await asyncio.sleep(CONNECTION_INIT_TIMEOUT)
+        if not self.initialized:
+            await self.close(4408, "Connection initialisation timeout")
+
+    async def keepalive(self):
+        while not self.closed:
+            await self.send({'type': 'ka'})
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            kind = message['type']
+        except (ValueError, TypeError, KeyError):
+            await self.close(4400, "Invalid message received")
+            return
+
+        if kind == 'connection_init':
+            if self.initialized:
+                await self.close(4429, "Too many initialisation requests")
+                return
+            self.initialized = True
+            await self.send({'type': 'connection_ack'})
+            if self.protocol == LEGACY_WS:
+                self.start(self.keepalive())
+        elif kind == 'ping' and self.protocol == TRANSPORT_WS:
+            await self.send({'type': 'pong'})
+        elif kind == 'pong' and self.protocol == TRANSPORT_WS:
+            pass
+        elif kind in ('subscribe', 'start'):
+            await self.subscribe(message)
+        elif kind in ('complete', 'stop'):
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        elif kind == 'connection_terminate' and self.protocol == LEGACY_WS:
+            await self.close(1000)
+        else:
+            await self.close(4400, f"Unexpected message type: {kind}")
+
+    async def subscribe(self, message):
+        id, payload = message.get('id'), message.get('payload')
+        if not isinstance(id, str) or not isinstance(payload, dict):
+            await self.close(4400, "Invalid message received")
+            return
+        if not self.initialized:
+            await self.close(4401, "Unauthorized")
+            return
+        if id in self.operations:
+            if self.protocol == TRANSPORT_WS:
+                await self.close(4409, f"Subscriber for {id} already exists")
+                return
+            self.operations.pop(id).cancel()
+        if len(self.operations) >= MAX_OPERATIONS:
+            await self.send_errors(id, [GraphQLError(f"At most {MAX_OPERATIONS} operations may run per connection.")])
+            return
+
+        task = self.start(self.run_operation(id, payload))
+        self.operations[id] = task
+        task.add_done_callback(lambda _: self.operations.pop(id, None) if self.operations.get(id) is task else None)
+
+    async def run_operation(self, id, payload):
+        query = payload.get('query')
+        variables = payload.get('variables') or {}
+        operation_name = payload.get('operationName')
+
+        try:
+            if not isinstance(query, str):
+                raise GraphQLError("Must provide query string.")
+            document, errors = document_cache.get(self.schema, query)
+        except GraphQLError as e:
+            errors = [e]
+        if errors:
+            await self.send_errors(id, errors)
+            return
+
+        operation = get_operation_ast(document, operation_name)
+        cost, depth = CostAnalyzer(self.schema).analyze(document, operation_name, variables)
+        if MAX_QUERY_DEPTH is not None and depth > MAX_QUERY_DEPTH:
+            await self.send_errors(id, [GraphQLError(f"Query depth {depth} exceeds the maximum depth of {MAX_QUERY_DEPTH}.")])
+            return
+        if MAX_QUERY_COST is not None and cost > MAX_QUERY_COST:
+            await self.send_errors(id, [GraphQLError(f"Query cost {cost} exceeds the maximum cost of {MAX_QUERY_COST}.")])
+            return
+        if self.budget is not None:
+            # The bucket lives in the cache
+            allowed, remaining, retry_after = await run_sync(self.budget.consume)(self.get_client_id(), cost)
+            if not allowed:
+                await self.send_errors(id, [GraphQLError(
+                    f"Query cost {cost} exceeds the remaining budget of {remaining}; retry in {retry_after} seconds.",
+                )])
+                return
+
+        subscription_operations.inc(labels=(operation.operation.value if operation else 'unknown',))
+        if operation is not None and operation.operation == OperationType.SUBSCRIPTION:
+            stream = await create_source_event_stream(
+                self.schema, document, None, self.get_context(), variables, operation_name
+            )
+            if isinstance(stream, ExecutionResult):
+                await self.send_errors(id, stream.errors)
+                return
+            try:
+                async for event in stream:
+                    # Each event resolves the selection against the database on a worker
+                    result = await run_sync(self.execute)(document, event, variables, operation_name)
+                    await self.send_result(id, result)
+            finally:
+                aclose = getattr(stream, 'aclose', None)
+                if aclose is not None:
+                    await aclose()
+        else:
+            result = await run_sync(self.execute)(document, None, variables, operation_name, operation)
+            await self.send_result(id, result)
+        await self.send({'type': 'complete', 'id': id})
+
+    def get_client_id(self):
+        """Key the cost budget like the HTTP view: by API key, then by address."""
+        headers = dict(self.scope.get('headers') or [])
+        api_key = headers.get(b'x-api-key')
+        if api_key:
+            return f"key:{api_key.decode('latin-1')}"
+        client = self.scope.get('client')
+        return f"ip:{client[0] if client else None}"
+
+    def get_context(self):
+        return SimpleNamespace(loaders=Loaders(), scope=self.scope)
+
+    def execute(self, document, root_value, variables, operation_name, operation=None):
+        options = {
+            'root_value': root_value,
+            'context_value': self.get_context(),
+            'variable_values': variables,
+            'operation_name': operation_name,
+        }
+        if operation is not None and operation.operation == OperationType.MUTATION:
+            with transaction.atomic():
+                result = execute(self.schema, document, **options)
+                if result.errors:
+                    transaction.set_rollback(True)
+                return result
+        return execute(self.schema, document, **options)
+
+    async def send_result(self, id, result):
+        payload = {'data': result.data}
+        if result.errors:
+            payload['errors'] = [error.formatted for error in result.errors]
+        await self.send({'type': 'next' if self.protocol == TRANSPORT_WS else 'data', 'id': id, 'payload': payload})
+
+    async def send_errors(self, id, errors):
+        # The legacy protocol carries a single error object
+        if self.protocol == LEGACY_WS:
+            payload = errors[0].formatted
+        else:
+            payload = [error.formatted for error in errors]
+        await self.send({'type': 'error', 'id': id, 'payload': payload})
@@ -4,64 +4,43 @@ from celery import shared_task
 import requests
 from decimal import Decimal
 
+from . import rollups
+from .client import get_client
+
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
 # Define the GraphQL query
 CRM_REPORT_QUERY = """
 query ReportQuery {
-  allCustomers {
-    totalCount
-  }
-  allOrders {
-    totalCount
-    edges {
-      node {
-        totalAmount
-      }
-    }
+  crmStats {
+    customerCount
+    orderCount
+    totalRevenue
   }
 }
 """
 
-# Define the GraphQL endpoint URL.
-GRAPHQL_ENDPOINT = 'http://127.0.0.1:8000/graphql'
-
 
 @shared_task
 def generate_crm_report():
     """
-    Generates a weekly CRM report by querying the GraphQL endpoint
+    Generates a weekly CRM report by querying the GraphQL schema
     and logs the report to a file.
     """
     try:
-        # 1. Execute the GraphQL query
-        response = requests.post(GRAPHQL_ENDPOINT, json={'query': CRM_REPORT_QUERY})
-
-        # Raise an exception for bad status codes (4xx or 5xx)
-        response.raise_for_status()
-
-        data = response.json().get('data')
+        # 1. Execute the GraphQL query (in-process unless GRAPHQL_TRANSPORT=http)
+        data = get_client().execute(CRM_REPORT_QUERY)
 
         if not data:
-            logger.error(f"GraphQL query failed. Response: {response.json().get('errors')}")
+            logger.error(f"GraphQL query returned no data: {data}")
             return
 
-        # 2. Parse the results
-        customer_count = data.get('allCustomers', {}).get('totalCount', 0)
-        total_orders = data.get('allOrders', {}).get('totalCount', 0)
-
-        # Calculate total revenue from all orders
-        # Note: This simple query fetches all orders. For very large datasets,
-        # you might want a dedicated 'totalRevenue' field in your schema.
-        orders = data.get('allOrders', {}).get('edges', [])
-        total_revenue = Decimal('0.0')
-        for order in orders:
-            if order and order.get('node') and order['node'].get('totalAmount'):
-                try:
-                    total_revenue += Decimal(order['node']['totalAmount'])
-                except (Decimal.InvalidOperation, TypeError):
-                    logger.warning(f"Invalid totalAmount skipped: {order['node']['totalAmount']}")
+        # 2. Parse the results (aggregated by the database, so constant-size)
+        stats = data.get('crmStats') or {}
+        customer_count = stats.get('customerCount', 0)
+        total_orders = stats.get('orderCount', 0)
+        total_revenue = Decimal(stats.get('totalRevenue') or '0.0')
 
         # 3. Format the report string
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -81,5 +60,16 @@ def generate_crm_report():
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Failed to connect to GraphQL endpoint: {e}", exc_info=True)
+        # Re-raise so Celery (and the task metrics) record the run as failed
+        raise
     except Exception as e:
-        logger.error(f"Failed to generate CRM report: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Failed to generate CRM report: {e}", exc_info=True)
+        raise
+
+
+@shared_task
+def refresh_sales_rollups(rebuild=False):
+    """Bring the sales rollup tables up to date with the orders changed since the last run."""
+    read = rollups.refresh_sales_rollups(rebuild=rebuild)
+    logger.info(f"Refreshed the sales rollups from {read} changed order(s)")
+    return read
@@ -1,3 +1,2062 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import unittest
+import warnings
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.validators import validate_email
+from django.db import connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from .broadcast import Broadcast
+from .client import GraphQLClientError, get_client, get_schema
+from .cost import CostAnalyzer, TokenBucket
+from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .export import export
+from .importer import Checkpoint, read_rows, run_import
+from . import seed
+from .documents import PersistedQueries, document_cache, query_hash
+from . import metrics
+from .metrics import REGISTRY, Histogram
+from .models import (
+    Customer, CustomerStats, Product, ProductSalesRollup, Order, OrderLine, SalesRollup, SalesRollupWatermark,
+)
+from .pagination import get_ordering_keys, seek_filter
+from .response_cache import response_cache
+from .inventory import restock_low_stock, write_transaction
+from .rollups import refresh_sales_rollups
+from .schema import validate_phone
+from .search import ContainsSearchBackend, FTS5SearchBackend, get_search_backend
+from .stats import rebuild_customer_stats
+from .subscriptions import GraphQLWebSocket, GraphQLWebSocketConnection
+from .tasks import generate_crm_report, refresh_sales_rollups as refresh_sales_rollups_task
+from .tracing import resolver_duration, resolver_queries
+from .views import AsyncCRMGraphQLView, CRMGraphQLView
+
+
+def setUpModule():
+    # Metrics are dumped per process; keep the test run's out of the real directory
+    global metrics_dir
+    metrics_dir = tempfile.TemporaryDirectory()
+    REGISTRY.directory = metrics_dir.name
+
+
+def tearDownModule():
+    metrics_dir.cleanup()
+
+
+def create_orders(count, products_per_order=3):
+    """Create ``count`` orders, each with its own customer and a few shared products."""
+    products = [
+        Product.objects.create(name=f"Product {i}", price=Decimal('10.00'), stock=5)
+        for i in range(products_per_order)
+    ]
+    orders = []
+    for i in range(count):
+        customer = Customer.objects.create(name=f"Customer {i}", email=f"customer{i}@example.com")
+        order = Order.objects.create(customer=customer, total_amount=Decimal('30.00'))
+        order.products.set(products, through_defaults={'unit_price': Decimal('10.00')})
+        orders.append(order)
+    return orders
+
+
+class GraphQLTestCase(TestCase):
+    def setUp(self):
+        # Cost budgets and persisted queries live in the cache
+        cache.clear()
+
+    def query(self, document, variables=None):
+        response = self.client.post(
+            '/graphql/',
+            json.dumps({'query': document, 'variables': variables}),
+            content_type='application/json',
+        )
+        body = response.json()
+        self.assertNotIn('errors', body, body.get('errors'))
+        return body['data']
+
+    def count_queries(self, document, variables=None):
+        with CaptureQueriesContext(connection) as queries:
+            self.query(document, variables)
+        return len(queries)
+
+
+class DataLoaderTests(GraphQLTestCase):
+    ORDERS_QUERY = """
+        query ($first: Int) {
+          allOrders(first: $first) {
+            edges { node { customer { name } products { edges { node { name } } } } }
+          }
+        }
+    """
+
+    CUSTOMERS_QUERY = """
+        query ($first: Int) {
+          allCustomers(first: $first) {
+            edges { node { orders { edges { node { products { edges { node { name } } } } } } } }
+          }
+        }
+    """
+
+    def test_order_relations_use_constant_queries(self):
+        create_orders(30)
+        small = self.count_queries(self.ORDERS_QUERY, {'first': 2})
+        large = self.count_queries(self.ORDERS_QUERY, {'first': 30})
+        self.assertEqual(small, large)
+        # page joined with customers + products
+        self.assertEqual(large, 2)
+
+    def test_nested_relations_batch_per_level(self):
+        create_orders(20)
+        small = self.count_queries(self.CUSTOMERS_QUERY, {'first': 2})
+        large = self.count_queries(self.CUSTOMERS_QUERY, {'first': 20})
+        self.assertEqual(small, large)
+
+    def test_batched_relations_match_unbatched_data(self):
+        orders = create_orders(3)
+        data = self.query(self.ORDERS_QUERY, {'first': 3})
+        nodes = [edge['node'] for edge in data['allOrders']['edges']]
+        self.assertEqual(
+            sorted(node['customer']['name'] for node in nodes),
+            sorted(order.customer.name for order in orders),
+        )
+        for node in nodes:
+            self.assertEqual(len(node['products']['edges']), 3)
+
+    def test_filtered_relation_falls_back_to_related_manager(self):
+        create_orders(2)
+        data = self.query("""
+            { allOrders { edges { node { products(name: "Product 1") { edges { node { name } } } } } } }
+        """)
+        for edge in data['allOrders']['edges']:
+            names = [product['node']['name'] for product in edge['node']['products']['edges']]
+            self.assertEqual(names, ['Product 1'])
+
+
+class QueryOptimizerTests(GraphQLTestCase):
+    def capture(self, document):
+        with CaptureQueriesContext(connection) as queries:
+            self.query(document)
+        return [query['sql'] for query in queries]
+
+    def test_only_selected_columns_are_read(self):
+        create_orders(2)
+        sql = self.capture('{ allProducts { edges { node { name } } } }')
+        page = sql[-1]
+        self.assertIn('"crm_product"."name"', page)
+        self.assertNotIn('"crm_product"."price"', page)
+        self.assertNotIn('"crm_product"."stock"', page)
+
+    def test_fragments_are_expanded(self):
+        create_orders(2)
+        sql = self.capture("""
+            { allProducts { edges { node { ...ProductFields } } } }
+            fragment ProductFields on ProductType { ... on ProductType { price } }
+        """)
+        self.assertIn('"crm_product"."price"', sql[-1])
+        self.assertNotIn('"crm_product"."stock"', sql[-1])
+
+    def test_customer_is_joined_and_products_prefetched(self):
+        create_orders(5)
+        sql = self.capture("""
+            { allOrders { edges { node { totalAmount customer { name } products { edges { node { name } } } } } } }
+        """)
+        # page joined with customers + prefetched products
+        self.assertEqual(len(sql), 2)
+        self.assertIn('INNER JOIN "crm_customer"', sql[0])
+        self.assertNotIn('"crm_customer"."email"', sql[0])
+        self.assertNotIn('"crm_product"."price"', sql[1])
+
+
+class KeysetPaginationTests(GraphQLTestCase):
+    PAGE_QUERY = """
+        query ($first: Int, $after: String, $orderBy: String) {
+          allOrders(first: $first, after: $after, orderBy: $orderBy) {
+            pageInfo { hasNextPage endCursor }
+            edges { node { id totalAmount } }
+          }
+        }
+    """
+
+    def setUp(self):
+        self.orders = create_orders(10)
+        for index, order in enumerate(self.orders):
+            # Pairs of orders share a total so the id tiebreak is exercised
+            Order.objects.filter(pk=order.pk).update(total_amount=Decimal(index // 2))
+
+    def walk(self, order_by=None, first=3):
+        ids, after = [], None
+        while True:
+            page = self.query(self.PAGE_QUERY, {'first': first, 'after': after, 'orderBy': order_by})
+            connection = page['allOrders']
+            ids.extend(edge['node']['id'] for edge in connection['edges'])
+            if not connection['pageInfo']['hasNextPage']:
+                return ids
+            after = connection['pageInfo']['endCursor']
+
+    def expected_ids(self, *ordering):
+        data = self.query('{ allOrders(first: 100, offset: 0) { edges { node { id } } } }')
+        ids = [edge['node']['id'] for edge in data['allOrders']['edges']]
+        if not ordering:
+            return ids
+        by_pk = {order.pk: global_id for order, global_id in zip(Order.objects.all(), ids)}
+        return [by_pk[pk] for pk in Order.objects.order_by(*ordering).values_list('pk', flat=True)]
+
+    def test_walks_default_ordering(self):
+        self.assertEqual(self.walk(), self.expected_ids())
+
+    def test_walks_custom_ordering_with_ties(self):
+        self.assertEqual(self.walk('-totalAmount'), self.expected_ids('-total_amount', '-id'))
+
+    def test_pages_seek_instead_of_offset_or_count(self):
+        first = self.query(self.PAGE_QUERY, {'first': 3})
+        with CaptureQueriesContext(connection) as queries:
+            self.query(self.PAGE_QUERY, {'first': 3, 'after': first['allOrders']['pageInfo']['endCursor']})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+        self.assertNotIn('COUNT', queries[0]['sql'])
+
+    def test_total_count_is_computed_when_selected(self):
+        data = self.query('{ allOrders(first: 2) { totalCount edges { node { id } } } }')
+        self.assertEqual(data['allOrders']['totalCount'], 10)
+
+    def test_backward_pagination(self):
+        ids = self.expected_ids()
+        data = self.query("""
+            query ($before: String) {
+              allOrders(last: 2, before: $before) { pageInfo { hasPreviousPage } edges { node { id } } }
+            }
+        """, {'before': self.keyset_cursor(5)})
+        self.assertEqual([edge['node']['id'] for edge in data['allOrders']['edges']], ids[3:5])
+        self.assertTrue(data['allOrders']['pageInfo']['hasPreviousPage'])
+
+    def test_related_orderings_fall_back_to_offsets(self):
+        Customer.objects.filter(pk=self.orders[0].customer_id).update(name="Zed")
+        expected = self.expected_ids('-customer__name', '-id')
+        self.assertEqual(self.walk('-customer__name'), expected)
+        data = self.query("""
+            { allOrders(first: 2, orderBy: "-customer__name") { totalCount edges { node { id } } } }
+        """)
+        self.assertEqual(data['allOrders']['totalCount'], 10)
+        self.assertEqual([edge['node']['id'] for edge in data['allOrders']['edges']], expected[:2])
+
+    def keyset_cursor(self, index):
+        data = self.query('{ allOrders(first: 10) { edges { cursor } } }')
+        return data['allOrders']['edges'][index]['cursor']
+
+
+class OffsetPaginationTests(GraphQLTestCase):
+    PAGE_QUERY = """
+        query ($first: Int, $after: String, $offset: Int) {
+          allCustomers(first: $first, after: $after, offset: $offset, orderBy: "name") {
+            pageInfo { hasNextPage endCursor }
+            edges { cursor node { name } }
+          }
+        }
+    """
+
+    def setUp(self):
+        for index in range(7):
+            Customer.objects.create(name=f"Customer {index}", email=f"customer{index}@example.com")
+
+    def test_pages_are_not_counted_unless_total_count_is_selected(self):
+        names, after = [], None
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                page = self.query(self.PAGE_QUERY, {'first': 3, 'after': after})['allCustomers']
+                names.extend(edge['node']['name'] for edge in page['edges'])
+                if not page['pageInfo']['hasNextPage']:
+                    break
+                after = page['pageInfo']['endCursor']
+        self.assertEqual(names, [f"Customer {index}" for index in range(7)])
+        self.assertEqual(len(queries), 3)
+        self.assertFalse(any('COUNT' in query['sql'] for query in queries))
+
+        # Offset cursors match the counted path, so clients can mix the two
+        counted = self.query("""
+            { allCustomers(first: 2, offset: 2, orderBy: "name") { totalCount edges { cursor node { name } } } }
+        """)['allCustomers']
+        uncounted = self.query(self.PAGE_QUERY, {'first': 2, 'offset': 2})['allCustomers']
+        self.assertEqual(counted['totalCount'], 7)
+        self.assertEqual(uncounted['edges'], counted['edges'])
+        self.assertTrue(uncounted['pageInfo']['hasNextPage'])
+
+    def test_backward_pages_are_still_counted(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.query('{ allCustomers(last: 2, orderBy: "name") { edges { node { name } } } }')
+        self.assertEqual([edge['node']['name'] for edge in data['allCustomers']['edges']],
+                         ["Customer 5", "Customer 6"])
+        self.assertIn('COUNT', queries[0]['sql'])
+
+
+class CRMStatsTests(GraphQLTestCase):
+    STATS_QUERY = """
+        {
+          crmStats {
+            customerCount orderCount totalRevenue
+            revenueBuckets(granularity: DAY) { period orderCount revenue }
+          }
+        }
+    """
+
+    def test_aggregates_in_constant_queries(self):
+        orders = create_orders(6)
+        day = datetime(2025, 11, 3, 9, tzinfo=timezone.utc)
+        for index, order in enumerate(orders):
+            Order.objects.filter(pk=order.pk).update(order_date=day + timedelta(days=index % 2))
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.query(self.STATS_QUERY)['crmStats']
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(stats['customerCount'], 6)
+        self.assertEqual(stats['orderCount'], 6)
+        self.assertEqual(Decimal(stats['totalRevenue']), Decimal('180.00'))
+        self.assertEqual([bucket['orderCount'] for bucket in stats['revenueBuckets']], [3, 3])
+        self.assertEqual(Decimal(stats['revenueBuckets'][0]['revenue']), Decimal('90.00'))
+
+    def test_empty_database(self):
+        stats = self.query('{ crmStats { orderCount totalRevenue } }')['crmStats']
+        self.assertEqual(stats['orderCount'], 0)
+        self.assertEqual(Decimal(stats['totalRevenue']), Decimal('0'))
+
+
+class LocalClientTests(TestCase):
+    def test_executes_in_process_with_cached_document(self):
+        create_orders(2)
+        client = get_client('local')
+        document_cache.clear()
+        self.assertEqual(client.execute('{ crmStats { orderCount } }'), {'crmStats': {'orderCount': 2}})
+        client.execute('{ crmStats { orderCount } }')
+        self.assertEqual(document_cache.stats()['hits'], 1)
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(GraphQLClientError):
+            get_client('local').execute('{ noSuchField }')
+
+
+class DocumentCacheTests(GraphQLTestCase):
+    def setUp(self):
+        document_cache.clear()
+
+    def test_repeated_queries_hit_the_cache(self):
+        self.query('{ hello }')
+        self.query('{ hello }')
+        self.assertEqual(document_cache.stats()['misses'], 1)
+        self.assertEqual(document_cache.stats()['hits'], 1)
+
+    def test_cache_is_bounded(self):
+        cache = type(document_cache)(maxsize=2)
+        schema = get_schema()
+        for query in ('{ hello }', '{ crmStats { orderCount } }', '{ __typename }'):
+            cache.get(schema, query)
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_validation_errors_are_cached(self):
+        response = self.client.post('/graphql/', {'query': '{ nope }'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.client.post('/graphql/', {'query': '{ nope }'}, content_type='application/json')
+        self.assertEqual(document_cache.stats()['hits'], 1)
+
+
+class PersistedQueryTests(GraphQLTestCase):
+    QUERY = '{ hello }'
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, body):
+        return self.client.post('/graphql/', body, content_type='application/json').json()
+
+    def extensions(self, query=QUERY):
+        return {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(query)}}
+
+    def test_unknown_hash_then_register(self):
+        body = self.post({'extensions': self.extensions()})
+        self.assertEqual(body['errors'][0]['message'], 'PersistedQueryNotFound')
+        self.post({'query': self.QUERY, 'extensions': self.extensions()})
+        body = self.post({'extensions': self.extensions()})
+        self.assertEqual(body['data'], {'hello': 'Hello, GraphQL!'})
+
+    def test_mismatched_hash_is_rejected(self):
+        body = self.post({'query': '{ __typename }', 'extensions': self.extensions()})
+        self.assertIn('does not match', body['errors'][0]['message'])
+
+    def test_locked_mode_only_runs_manifest_queries(self):
+        locked = PersistedQueries(locked=True)
+        locked.manifest = {query_hash(self.QUERY): self.QUERY}
+        with mock.patch.object(CRMGraphQLView, 'persisted_queries', locked):
+            self.assertEqual(self.post({'extensions': self.extensions()})['data'], {'hello': 'Hello, GraphQL!'})
+            body = self.post({'query': '{ __typename }'})
+            self.assertEqual(body['errors'][0]['message'], 'PersistedQueryNotAllowed')
+            body = self.post({'extensions': self.extensions('{ __typename }')})
+            self.assertEqual(body['errors'][0]['message'], 'PersistedQueryNotFound')
+
+
+class BulkCreateCustomersTests(GraphQLTestCase):
+    MUTATION = """
+        mutation ($input: [CustomerInput]!) {
+          bulkCreateCustomers(input: $input) { customers { email } errors }
+        }
+    """
+
+    def test_rows_are_validated_deduplicated_and_inserted(self):
+        Customer.objects.create(name="Existing", email="taken@example.com")
+        rows = [
+            {'name': "A", 'email': "a@example.com", 'phone': "+1234567890"},
+            {'name': "B", 'email': "taken@example.com"},
+            {'name': "C", 'email': "not-an-email"},
+            {'name': "D", 'email': "a@example.com"},
+            {'name': "E", 'email': "e@example.com", 'phone': "abc"},
+            {'name': "F", 'email': "f@example.com"},
+        ]
+        result = self.query(self.MUTATION, {'input': rows})['bulkCreateCustomers']
+        self.assertEqual([c['email'] for c in result['customers']], ["a@example.com", "f@example.com"])
+        self.assertEqual(result['errors'], [
+            "Customer 1: Email already exists - taken@example.com",
+            "Customer 2: ['Enter a valid email address.']",
+            "Customer 3: Email already exists - a@example.com",
+            "Customer 4: ['Invalid phone format']",
+        ])
+        self.assertEqual(Customer.objects.count(), 3)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def rows(count, offset):
+            return [{'name': f"C{i}", 'email': f"c{i}@example.com"} for i in range(offset, offset + count)]
+
+        small = self.count_queries(self.MUTATION, {'input': rows(5, 0)})
+        large = self.count_queries(self.MUTATION, {'input': rows(150, 100)})
+        self.assertEqual(small, large)
+
+
+class CreateOrderTests(GraphQLTestCase):
+    MUTATION = """
+        mutation ($input: OrderInput!) {
+          createOrder(input: $input) { order { id totalAmount products { totalCount } } }
+        }
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.products = [
+            Product.objects.create(name=f"Item {i}", price=Decimal('2.50'), stock=100) for i in range(20)
+        ]
+
+    def create(self, product_ids):
+        return self.client.post('/graphql/', {
+            'query': self.MUTATION,
+            'variables': {'input': {'customerId': self.customer.pk, 'productIds': product_ids}},
+        }, content_type='application/json').json()
+
+    def test_cart_size_does_not_change_query_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.create([self.products[0].pk])
+        with CaptureQueriesContext(connection) as large:
+            body = self.create([product.pk for product in self.products])
+        self.assertEqual(len(small), len(large))
+        order = body['data']['createOrder']['order']
+        self.assertEqual(Decimal(order['totalAmount']), Decimal('50.00'))
+        self.assertEqual(order['products']['totalCount'], 20)
+
+    def test_all_missing_ids_are_reported(self):
+        body = self.create([self.products[0].pk, 9998, 'abc', 9999])
+        self.assertIn("Invalid product IDs: 9998, abc, 9999", body['errors'][0]['message'])
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class BulkCreateOrdersTests(GraphQLTestCase):
+    MUTATION = """
+        mutation ($input: [OrderInput]!) {
+          bulkCreateOrders(input: $input) { orders { totalAmount } errors }
+        }
+    """
+
+    def test_orders_are_created_in_bulk(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        products = [Product.objects.create(name=f"Item {i}", price=Decimal('1.00'), stock=50) for i in range(3)]
+        ids = [product.pk for product in products]
+        rows = [{'customerId': customer.pk, 'productIds': ids} for _ in range(50)]
+        rows += [
+            {'customerId': 9999, 'productIds': ids},
+            {'customerId': customer.pk, 'productIds': []},
+            {'customerId': customer.pk, 'productIds': [9999]},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            result = self.query(self.MUTATION, {'input': rows})['bulkCreateOrders']
+        self.assertEqual(len(result['orders']), 50)
+        self.assertEqual(result['errors'], [
+            "Order 50: Invalid customer ID",
+            "Order 51: At least one product is required",
+            "Order 52: Invalid product ID: 9999",
+        ])
+        self.assertEqual(OrderLine.objects.count(), 150)
+        # Including the one recording the orders in the customer's statistics
+        self.assertLess(len(queries), 11)
+
+
+class CustomerStatsTests(GraphQLTestCase):
+    CREATE_ORDER = """
+        mutation ($input: OrderInput!) { createOrder(input: $input) { order { id } } }
+    """
+    CUSTOMERS = """
+        query ($orderBy: String) {
+          allCustomers(orderBy: $orderBy) { edges { node {
+            name orderCount lifetimeRevenue firstOrderDate lastOrderDate
+          } } }
+        }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.customers = [
+            Customer.objects.create(name=name, email=f"{name.lower()}@example.com")
+            for name in ("Ada", "Alan", "Grace")
+        ]
+        self.product = Product.objects.create(name="Widget", price=Decimal('12.50'), stock=100)
+
+    def order(self, customer, quantity=1, order_date=None):
+        row = {'customerId': customer.pk, 'lines': [{'productId': self.product.pk, 'quantity': quantity}]}
+        if order_date is not None:
+            row['orderDate'] = order_date.isoformat()
+        return self.query(self.CREATE_ORDER, {'input': row})['createOrder']['order']
+
+    def nodes(self, order_by=None):
+        return [edge['node'] for edge in self.query(self.CUSTOMERS, {'orderBy': order_by})['allCustomers']['edges']]
+
+    def test_create_order_updates_statistics(self):
+        ada, alan, _ = self.customers
+        self.order(ada)
+        self.order(ada, quantity=3)
+        self.order(alan, quantity=2)
+
+        stats = ada.stats
+        stats.refresh_from_db()
+        self.assertEqual((stats.order_count, stats.lifetime_revenue), (2, Decimal('50.00')))
+        orders = Order.objects.filter(customer=ada)
+        self.assertEqual(stats.first_order_date, min(order.order_date for order in orders))
+        self.assertEqual(stats.last_order_date, max(order.order_date for order in orders))
+
+        by_revenue = self.nodes('-lifetimeRevenue')
+        self.assertEqual([node['name'] for node in by_revenue], ["Ada", "Alan", "Grace"])
+        self.assertEqual(Decimal(by_revenue[0]['lifetimeRevenue']), Decimal('50.00'))
+        self.assertEqual(by_revenue[2]['orderCount'], 0)
+        self.assertIsNone(by_revenue[2]['lastOrderDate'])
+        self.assertEqual([node['name'] for node in self.nodes('orderCount,name')], ["Grace", "Alan", "Ada"])
+
+    def test_page_of_statistics_is_one_query(self):
+        for customer in self.customers:
+            self.order(customer)
+        plain = self.count_queries('{ allCustomers { edges { node { name } } } }')
+        self.assertEqual(self.count_queries(self.CUSTOMERS), plain + 1)
+
+    def test_bulk_orders_and_deletes_update_statistics(self):
+        ada, alan, _ = self.customers
+        self.query("""
+            mutation ($input: [OrderInput]!) { bulkCreateOrders(input: $input) { errors } }
+        """, {'input': [
+            {'customerId': ada.pk, 'productIds': [self.product.pk]},
+            {'customerId': ada.pk, 'productIds': [self.product.pk]},
+            {'customerId': alan.pk, 'productIds': [self.product.pk]},
+        ]})
+        self.assertEqual(
+            dict(CustomerStats.objects.values_list('customer_id', 'order_count')), {ada.pk: 2, alan.pk: 1}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(customer=alan).get().delete()
+            Order.objects.filter(customer=ada).first().delete()
+        self.assertEqual(
+            list(CustomerStats.objects.values_list('customer_id', 'order_count', 'lifetime_revenue')),
+            [(ada.pk, 1, Decimal('12.50'))],
+        )
+
+    def test_deleting_a_customer_refreshes_once(self):
+        ada, alan, _ = self.customers
+        for count in (5, 50):
+            customer = Customer.objects.create(name=f"Bulk {count}", email=f"bulk{count}@example.com")
+            self.query("""
+                mutation ($input: [OrderInput]!) { bulkCreateOrders(input: $input) { errors } }
+            """, {'input': [{'customerId': customer.pk, 'productIds': [self.product.pk]}] * count})
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                customer.delete()
+            stats_queries = [query for query in queries if 'customerstats' in query['sql']]
+            rollup_queries = [query for query in queries if 'rollup' in query['sql']]
+            if count == 5:
+                few = (len(stats_queries), len(rollup_queries))
+        # Deleting ten times the orders costs no more statistics or rollup queries
+        self.assertEqual((len(stats_queries), len(rollup_queries)), few)
+        self.assertLessEqual(few[0], 2)
+        self.order(ada)
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.all().delete()
+        self.assertFalse(CustomerStats.objects.exists())
+
+    def test_moving_an_order_updates_both_customers(self):
+        ada, alan, _ = self.customers
+        self.order(ada)
+        self.order(alan, quantity=2)
+        order = Order.objects.get(customer=ada)
+        order.customer = alan
+        order.save()
+        self.assertEqual(
+            list(CustomerStats.objects.values_list('customer_id', 'order_count', 'lifetime_revenue')),
+            [(alan.pk, 2, Decimal('37.50'))],
+        )
+        self.assertEqual(rebuild_customer_stats(write=False)[1:], (0, 0, 0))
+
+    def test_rebuild_command_reports_and_repairs_drift(self):
+        ada, alan, grace = self.customers
+        self.order(ada)
+        self.order(alan)
+        # Writes that bypass the statistics
+        CustomerStats.objects.filter(pk=ada.pk).update(order_count=5)
+        CustomerStats.objects.filter(pk=alan.pk).delete()
+        CustomerStats.objects.create(
+            customer=grace, order_count=1, lifetime_revenue=Decimal('1.00'),
+            first_order_date=datetime(2025, 1, 1, tzinfo=timezone.utc),
+            last_order_date=datetime(2025, 1, 1, tzinfo=timezone.utc),
+        )
+
+        stdout = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_customer_stats', '--check', stdout=stdout)
+        self.assertIn("Checked 3 customers", stdout.getvalue())
+        self.assertIn("1 missing, 1 changed, 1 stale", stdout.getvalue())
+
+        call_command('rebuild_customer_stats', '--chunk-size', '1', stdout=io.StringIO())
+        self.assertEqual(
+            dict(CustomerStats.objects.values_list('customer_id', 'order_count')), {ada.pk: 1, alan.pk: 1}
+        )
+        stdout = io.StringIO()
+        call_command('rebuild_customer_stats', '--check', stdout=stdout)
+        self.assertIn("0 missing, 0 changed, 0 stale", stdout.getvalue())
+
+
+class SalesRollupTests(GraphQLTestCase):
+    TIMESERIES = """
+        query ($granularity: SalesGranularity, $from: DateTime, $to: DateTime, $productId: ID) {
+          salesTimeseries(granularity: $granularity, from: $from, to: $to, productId: $productId) {
+            period orderCount units revenue
+          }
+        }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.widget = Product.objects.create(name="Widget", price=Decimal('12.50'), stock=100)
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('20.00'), stock=100)
+
+    def order(self, order_date, *products):
+        order = Order.objects.create(customer=self.customer, total_amount=sum(product.price for product in products))
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=product, unit_price=product.price) for product in products
+        )
+        # order_date is set on creation; update() leaves updated_at alone
+        Order.objects.filter(pk=order.pk).update(order_date=order_date)
+        order.order_date = order_date
+        return order
+
+    def series(self, granularity='DAY', **variables):
+        return [
+            (bucket['period'], bucket['orderCount'], bucket['units'], Decimal(bucket['revenue']))
+            for bucket in self.query(self.TIMESERIES, {'granularity': granularity, **variables})['salesTimeseries']
+        ]
+
+    def test_refresh_reads_only_changed_orders(self):
+        day = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        self.order(day + timedelta(hours=10, minutes=15), self.widget)
+        self.order(day + timedelta(hours=10, minutes=45), self.widget, self.gadget)
+        self.order(day + timedelta(hours=11, minutes=30), self.gadget)
+        self.order(day + timedelta(days=1, hours=9), self.widget)
+        # Too recent to be read yet
+        self.assertEqual(refresh_sales_rollups(settle=60), 0)
+        self.assertEqual(refresh_sales_rollups(batch_size=3, settle=0), 4)
+
+        self.assertEqual(self.series(), [
+            ('2025-03-01T00:00:00+00:00', 3, 4, Decimal('65.00')),
+            ('2025-03-02T00:00:00+00:00', 1, 1, Decimal('12.50')),
+        ])
+        self.assertEqual(self.series('HOUR', **{'from': '2025-03-01T10:00:00+00:00', 'to': '2025-03-01T23:00:00+00:00'}), [
+            ('2025-03-01T10:00:00+00:00', 2, 3, Decimal('45.00')),
+            ('2025-03-01T11:00:00+00:00', 1, 1, Decimal('20.00')),
+        ])
+        self.assertEqual(self.series(productId=self.widget.pk), [
+            ('2025-03-01T00:00:00+00:00', 2, 2, Decimal('25.00')),
+            ('2025-03-02T00:00:00+00:00', 1, 1, Decimal('12.50')),
+        ])
+
+        self.order(day + timedelta(hours=23), self.gadget)
+        self.assertEqual(refresh_sales_rollups(settle=0), 1)
+        self.assertEqual(refresh_sales_rollups(settle=0), 0)
+        self.assertEqual(self.series()[0], ('2025-03-01T00:00:00+00:00', 4, 5, Decimal('85.00')))
+        mark = SalesRollupWatermark.objects.get()
+        self.assertEqual(mark.order_id, Order.objects.latest('updated_at', 'pk').pk)
+
+    def test_deleted_orders_leave_the_rollups(self):
+        day = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        first = self.order(day + timedelta(hours=10), self.widget)
+        self.order(day + timedelta(hours=12), self.gadget)
+        refresh_sales_rollups(settle=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.series(), [('2025-03-01T00:00:00+00:00', 1, 1, Decimal('20.00'))])
+        self.assertFalse(ProductSalesRollup.objects.filter(product=self.widget).exists())
+
+    def test_moved_orders_leave_their_old_hour(self):
+        day = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        order = self.order(day + timedelta(hours=10), self.widget)
+        refresh_sales_rollups(settle=0)
+        order.order_date = day + timedelta(days=1, hours=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(self.series(), [('2025-03-02T00:00:00+00:00', 1, 1, Decimal('12.50'))])
+        self.assertEqual(self.series('HOUR'), [('2025-03-02T10:00:00+00:00', 1, 1, Decimal('12.50'))])
+
+    def test_rebuild_matches_incremental_refresh(self):
+        start = datetime(2025, 3, 1, tzinfo=timezone.utc)
+        for hours in range(0, 200, 7):
+            self.order(start + timedelta(hours=hours), self.widget, *([self.gadget] if hours % 2 else []))
+        refresh_sales_rollups(batch_size=4, settle=0)
+        columns = ('granularity', 'period', 'order_count', 'units', 'revenue')
+        incremental = list(SalesRollup.objects.order_by('granularity', 'period').values_list(*columns))
+        refresh_sales_rollups(settle=0, rebuild=True)
+        self.assertEqual(list(SalesRollup.objects.order_by('granularity', 'period').values_list(*columns)), incremental)
+        self.assertEqual(sum(row[2] for row in incremental if row[0] == 'day'), Order.objects.count())
+
+    def test_units_and_revenue_come_from_the_lines(self):
+        order = self.order(datetime(2025, 3, 1, 10, tzinfo=timezone.utc), self.widget)
+        order.lines.update(quantity=3, unit_price=Decimal('10.00'))
+        # Repricing the product leaves what was sold alone
+        Product.objects.filter(pk=self.widget.pk).update(price=Decimal('99.00'))
+        refresh_sales_rollups(settle=0)
+        self.assertEqual(self.series(productId=self.widget.pk), [('2025-03-01T00:00:00+00:00', 1, 3, Decimal('30.00'))])
+        self.assertEqual(self.series()[0][:3], ('2025-03-01T00:00:00+00:00', 1, 3))
+
+    def test_refresh_is_scheduled(self):
+        tasks = {entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertIn(refresh_sales_rollups_task.name, tasks)
+
+    def test_unknown_product_is_an_error(self):
+        response = self.client.post('/graphql/', json.dumps({
+            'query': self.TIMESERIES, 'variables': {'productId': '9999'},
+        }), content_type='application/json')
+        self.assertIn("Invalid product ID: 9999", response.json()['errors'][0]['message'])
+
+
+class InventoryTests(GraphQLTestCase):
+    MUTATION = """
+        mutation ($input: OrderInput!) { createOrder(input: $input) { order { totalAmount } } }
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal('999.99'), stock=3)
+        self.mouse = Product.objects.create(name="Mouse", price=Decimal('25.50'), stock=10)
+
+    def order(self, **order_input):
+        return self.client.post('/graphql/', {
+            'query': self.MUTATION,
+            'variables': {'input': {'customerId': self.customer.pk, **order_input}},
+        }, content_type='application/json').json()
+
+    def test_quantities_decrement_stock_and_price_the_order(self):
+        body = self.order(productIds=[self.mouse.pk], lines=[{'productId': self.laptop.pk, 'quantity': 2}])
+        self.assertEqual(Decimal(body['data']['createOrder']['order']['totalAmount']), Decimal('2025.48'))
+        self.laptop.refresh_from_db()
+        self.mouse.refresh_from_db()
+        self.assertEqual((self.laptop.stock, self.mouse.stock), (1, 9))
+
+    def test_lines_keep_the_price_each_unit_was_sold_at(self):
+        body = self.client.post('/graphql/', {
+            'query': """
+                mutation ($input: OrderInput!) {
+                  createOrder(input: $input) { order { lines { product { name } quantity unitPrice } } }
+                }
+            """,
+            'variables': {'input': {'customerId': self.customer.pk, 'lines': [{'productId': self.mouse.pk, 'quantity': 3}]}},
+        }, content_type='application/json').json()
+        self.assertEqual(body['data']['createOrder']['order']['lines'], [
+            {'product': {'name': "Mouse"}, 'quantity': 3, 'unitPrice': '25.50'},
+        ])
+        Product.objects.filter(pk=self.mouse.pk).update(price=Decimal('30.00'))
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, Decimal('76.50'))
+        self.assertEqual(order.total_amount, order.lines.aggregate(total=Sum(F('quantity') * F('unit_price')))['total'])
+
+    def test_insufficient_stock_rejects_the_whole_order(self):
+        body = self.order(lines=[
+            {'productId': self.mouse.pk, 'quantity': 5},
+            {'productId': self.laptop.pk, 'quantity': 4},
+        ])
+        self.assertIn(f"Insufficient stock for product ID: {self.laptop.pk}", body['errors'][0]['message'])
+        self.mouse.refresh_from_db()
+        self.assertEqual(self.mouse.stock, 10)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_bulk_orders_reject_only_rows_that_overflow(self):
+        rows = [
+            {'customerId': self.customer.pk, 'lines': [{'productId': self.laptop.pk, 'quantity': quantity}]}
+            for quantity in (2, 2, 1)
+        ]
+        result = self.query("""
+            mutation ($input: [OrderInput]!) { bulkCreateOrders(input: $input) { errors } }
+        """, {'input': rows})['bulkCreateOrders']
+        self.assertEqual(result['errors'], [f"Order 1: Insufficient stock for product ID: {self.laptop.pk}"])
+        self.assertEqual(Order.objects.count(), 2)
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 0)
+
+
+class RestockTests(GraphQLTestCase):
+    MUTATION = """
+        mutation ($dryRun: Boolean, $summaryOnly: Boolean, $first: Int, $after: ID) {
+          updateLowStockProducts(dryRun: $dryRun, summaryOnly: $summaryOnly, first: $first, after: $after) {
+            products { name stock } count units cursor message
+          }
+        }
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Restocked by the default policy, by their own, or not at all
+        self.products = Product.objects.bulk_create([
+            Product(name="Default", price=Decimal('1.00'), stock=9),
+            Product(name="Stocked", price=Decimal('1.00'), stock=10),
+            Product(name="Own point", price=Decimal('1.00'), stock=40, reorder_point=50, reorder_quantity=100),
+            Product(name="Own quantity", price=Decimal('1.00'), stock=0, reorder_quantity=3),
+            Product(name="Never", price=Decimal('1.00'), stock=0, reorder_point=0),
+        ])
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def restock(self, **variables):
+        return self.query(self.MUTATION, variables)['updateLowStockProducts']
+
+    def test_each_product_is_restocked_by_its_policy(self):
+        result = self.restock()
+        self.assertEqual(result['products'], [
+            {'name': "Default", 'stock': 19}, {'name': "Own point", 'stock': 140}, {'name': "Own quantity", 'stock': 3},
+        ])
+        self.assertEqual((result['count'], result['units'], result['cursor']), (3, 113, None))
+        self.assertEqual(result['message'], "Successfully restocked 3 product(s) with 113 unit(s).")
+        self.assertEqual(self.stock(), [19, 10, 140, 3, 0])
+        # Still below the default point
+        self.assertEqual(self.restock()['message'], "Successfully restocked 1 product(s) with 3 unit(s).")
+
+    def test_dry_run_only_reads(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.restock(dryRun=True)
+        self.assertEqual((result['count'], result['units']), (3, 113))
+        self.assertEqual(result['message'], "Would restock 3 product(s) with 113 unit(s).")
+        self.assertEqual(result['products'][0], {'name': "Default", 'stock': 9})
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries), queries.captured_queries)
+        self.assertEqual(self.stock(), [9, 10, 40, 0, 0])
+
+    def test_summary_pages_through_with_a_cursor(self):
+        first = self.restock(summaryOnly=True, first=2)
+        self.assertEqual((first['products'], first['count'], first['units']), (None, 2, 110))
+        self.assertEqual(first['cursor'], str(self.products[2].pk))
+        rest = self.restock(summaryOnly=True, first=2, after=first['cursor'])
+        self.assertEqual((rest['count'], rest['units'], rest['cursor']), (1, 3, None))
+        self.assertEqual(self.stock(), [19, 10, 140, 3, 0])
+
+    def test_ranges_commit_one_by_one(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = restock_low_stock(keep_products=False, chunk_size=2)
+        self.assertEqual((result.products, result.count, result.units), (None, 3, 113))
+        # Three ranges, each its own transaction; the last has nothing to update
+        self.assertEqual(sum(query['sql'].startswith('SAVEPOINT') for query in queries), 3)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 2)
+
+    def test_invalid_arguments_are_errors(self):
+        for variables, message in (({'first': 0}, "first must be at least 1"), ({'after': 'x'}, "Invalid cursor: x")):
+            body = self.client.post('/graphql/', json.dumps({'query': self.MUTATION, 'variables': variables}),
+                                    content_type='application/json').json()
+            self.assertIn(message, body['errors'][0]['message'])
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    """Hammer one product from many threads; stock must never go negative."""
+
+    ORDERS = 200
+    WORKERS = 16
+    STOCK = 60
+
+    def test_parallel_orders_never_oversell(self):
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        hot = Product.objects.create(name="Hot", price=Decimal('1.00'), stock=self.STOCK)
+        other = Product.objects.create(name="Other", price=Decimal('1.00'), stock=self.STOCK * 10)
+        mutation = 'mutation ($input: OrderInput!) { createOrder(input: $input) { order { id } } }'
+
+        def place(index):
+            # Alternate line order so the lock ordering is exercised
+            products = [hot.pk, other.pk] if index % 2 else [other.pk, hot.pk]
+            try:
+                get_client('local').execute(
+                    mutation, {'input': {'customerId': customer.pk, 'productIds': products}}
+                )
+                return True
+            except GraphQLClientError as e:
+                self.assertIn("Insufficient stock", str(e))
+                return False
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            results = list(pool.map(place, range(self.ORDERS)))
+        elapsed = time.perf_counter() - start
+
+        hot.refresh_from_db()
+        self.assertEqual(hot.stock, 0)
+        self.assertEqual(sum(results), self.STOCK)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        self.assertFalse(Product.objects.filter(stock__lt=0).exists())
+        # Throughput should not collapse under contention (generous bound for slow CI)
+        self.assertGreater(self.ORDERS / elapsed, 10)
+
+    def test_parallel_bulk_orders_wait_for_the_write_lock(self):
+        # Each batch reads customers and products before reserving in the same transaction
+        customer = Customer.objects.create(name="Buyer", email="buyer@example.com")
+        hot = Product.objects.create(name="Hot", price=Decimal('1.00'), stock=self.STOCK)
+        mutation = 'mutation ($input: [OrderInput]!) { bulkCreateOrders(input: $input) { orders { id } errors } }'
+
+        def place(index):
+            try:
+                data = get_client('local').execute(
+                    mutation, {'input': [{'customerId': customer.pk, 'productIds': [hot.pk]}] * 2}
+                )
+                return len(data['bulkCreateOrders']['orders'])
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            placed = sum(pool.map(place, range(self.ORDERS // 4)))
+        hot.refresh_from_db()
+        self.assertEqual((placed, hot.stock), (self.STOCK, 0))
+
+    @skipUnless(connection.vendor == 'sqlite', "BEGIN IMMEDIATE is SQLite specific")
+    def test_only_stock_writes_take_the_write_lock_up_front(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Product.objects.count()
+            with write_transaction():
+                with write_transaction():
+                    Product.objects.count()
+        begins = [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+        self.assertEqual(begins, ['BEGIN', 'BEGIN IMMEDIATE'])
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class FilterIndexTests(TestCase):
+    """
+    Every FilterSet field should be answered by an index search, not a table scan.
+
+    Plans are checked without the default ordering (as counts and sweeps run):
+    without STAT4 statistics SQLite prefers walking the ordering index for
+    one-sided ranges, which is the right call for LIMITed pages.
+    """
+
+    NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    # (filterset, data, index expected in the plan)
+    CASES = [
+        (CustomerFilter, {'created_at': NOW}, 'crm_customer_created_id_idx'),
+        (CustomerFilter, {'created_at__gte': NOW}, 'crm_customer_created_id_idx'),
+        (CustomerFilter, {'created_at__lte': NOW - timedelta(days=1990)}, 'crm_customer_created_id_idx'),
+        (CustomerFilter, {'phone': '+1555000042'}, 'crm_customer_phone_idx'),
+        (CustomerFilter, {'phone_pattern': '+155500004'}, 'crm_customer_phone_idx'),
+        (ProductFilter, {'price': 42}, 'crm_product_price_idx'),
+        (ProductFilter, {'price__gte': 1990}, 'crm_product_price_idx'),
+        (ProductFilter, {'price__lte': 5}, 'crm_product_price_idx'),
+        (ProductFilter, {'stock': 7}, 'crm_product_stock_idx'),
+        (ProductFilter, {'stock__gte': 1990}, 'crm_product_stock_idx'),
+        (ProductFilter, {'stock__lte': 5}, 'crm_product_stock_idx'),
+        (OrderFilter, {'total_amount': 42}, 'crm_order_total_idx'),
+        (OrderFilter, {'total_amount__gte': 1990}, 'crm_order_total_idx'),
+        (OrderFilter, {'total_amount__lte': 5}, 'crm_order_total_idx'),
+        (OrderFilter, {'order_date': NOW}, 'crm_order_date_id_idx'),
+        (OrderFilter, {'order_date__gte': NOW}, 'crm_order_date_id_idx'),
+        (OrderFilter, {'order_date__lte': NOW - timedelta(days=1990)}, 'crm_order_date_id_idx'),
+        (OrderFilter, {'product_id': 42}, 'crm_order_products_product_id'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        rows = 2000
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"C{i}", email=f"c{i}@example.com", phone=f"+1555{i:06d}") for i in range(rows)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"P{i}", price=Decimal(i), stock=i) for i in range(rows)
+        )
+        orders = Order.objects.bulk_create(
+            Order(customer=customer, total_amount=Decimal(i)) for i, customer in enumerate(customers)
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=products[i], unit_price=products[i].price) for i, order in enumerate(orders)
+        )
+        # Spread the timestamps out so date ranges are selective
+        for model in (Customer, Order):
+            for i, pk in enumerate(model.objects.values_list('pk', flat=True)):
+                field = 'created_at' if model is Customer else 'order_date'
+                model.objects.filter(pk=pk).update(**{field: cls.NOW - timedelta(days=i)})
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_filters_search_their_index(self):
+        for filterset_class, data, index in self.CASES:
+            with self.subTest(filterset=filterset_class.__name__, data=data):
+                filterset = filterset_class(data=data, queryset=filterset_class._meta.model.objects.all())
+                self.assertTrue(filterset.is_valid(), filterset.errors)
+                plan = filterset.qs.order_by().explain()
+                self.assertIn(f'USING INDEX {index}', plan)
+                self.assertIn('SEARCH', plan.split(index)[0].splitlines()[-1])
+
+    def test_default_orderings_are_read_from_an_index(self):
+        for model in (Customer, Product, Order):
+            with self.subTest(model=model.__name__):
+                plan = model.objects.all()[:20].explain()
+                self.assertIn('USING INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_keyset_seek_uses_the_pagination_index(self):
+        keys = get_ordering_keys(Order.objects.all())
+        page = Order.objects.order_by('-order_date', '-id').filter(
+            seek_filter(keys, [self.NOW - timedelta(days=100), 1])
+        )[:20]
+        plan = page.explain()
+        self.assertIn('SEARCH crm_order USING INDEX crm_order_date_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SearchTests(GraphQLTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        if not isinstance(get_search_backend(), FTS5SearchBackend):
+            raise unittest.SkipTest("FTS5 trigram index not available")
+        cls.ada = Customer.objects.create(name="Ada Lovelace", email="ada@engine.org")
+        cls.grace = Customer.objects.create(name="Grace Hopper", email="grace@navy.mil")
+        cls.adams = Customer.objects.create(name="John Adams", email="john@example.com")
+        cls.widget = Product.objects.create(name="Widget", price=Decimal('5.00'))
+        cls.gadget = Product.objects.create(name="Gadget Widget", price=Decimal('7.00'))
+        cls.order = Order.objects.create(customer=cls.grace, total_amount=Decimal('12.00'))
+        OrderLine.objects.bulk_create(
+            OrderLine(order=cls.order, product=product, unit_price=product.price) for product in (cls.widget, cls.gadget)
+        )
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_index_matches_the_contains_backend(self):
+        fts, contains = FTS5SearchBackend(), ContainsSearchBackend()
+        for value, fields in [('ada', ['name']), ('ADA', ['name', 'email']), ('.org', ['email']),
+                              ('ce', ['name']), ('ace Hop', ['name'])]:
+            with self.subTest(value=value, fields=fields):
+                self.assertEqual(
+                    self.names(fts.filter(Customer.objects.all(), value, fields)),
+                    self.names(contains.filter(Customer.objects.all(), value, fields)),
+                )
+
+    def test_search_is_answered_from_the_index(self):
+        plan = get_search_backend().search(Customer.objects.all(), 'lovelace').explain()
+        self.assertIn('SCAN crm_customer_fts VIRTUAL TABLE INDEX', plan)
+        self.assertIn('SEARCH crm_customer USING INTEGER PRIMARY KEY', plan)
+
+    def test_index_follows_writes(self):
+        backend = get_search_backend()
+        Customer.objects.filter(pk=self.ada.pk).update(name="Ada King")
+        Customer.objects.bulk_create([Customer(name="Alan Turing", email="alan@bletchley.uk")])
+        self.grace.delete()
+        self.assertEqual(self.names(backend.matching(Customer.objects.all(), 'king')), ["Ada King"])
+        self.assertEqual(self.names(backend.matching(Customer.objects.all(), 'lovelace')), [])
+        self.assertEqual(self.names(backend.matching(Customer.objects.all(), 'turing')), ["Alan Turing"])
+        self.assertEqual(self.names(backend.matching(Customer.objects.all(), 'hopper')), [])
+
+    def test_all_customers_search_is_ranked(self):
+        data = self.query('{ allCustomers(search: "ada") { edges { node { name } } } }')
+        names = [edge['node']['name'] for edge in data['allCustomers']['edges']]
+        self.assertEqual(sorted(names), ["Ada Lovelace", "John Adams"])
+
+        data = self.query('{ allProducts(search: "widget") { edges { node { name } } } }')
+        self.assertEqual(
+            [edge['node']['name'] for edge in data['allProducts']['edges']], ["Widget", "Gadget Widget"]
+        )
+
+    def test_all_orders_search_matches_customers_and_products(self):
+        for search in ('grace', 'gadget', 'navy'):
+            with self.subTest(search=search):
+                data = self.query('query($s: String) { allOrders(search: $s) { totalCount } }', {'s': search})
+                self.assertEqual(data['allOrders']['totalCount'], 1)
+
+    def test_product_name_filter_does_not_repeat_orders(self):
+        data = self.query('{ allOrders(productName: "widget") { totalCount edges { node { id } } } }')
+        self.assertEqual(data['allOrders']['totalCount'], 1)
+        self.assertEqual(len(data['allOrders']['edges']), 1)
+
+    def test_short_terms_fall_back_to_contains(self):
+        data = self.query('{ allCustomers(search: "Ad") { edges { node { name } } } }')
+        self.assertEqual(len(data['allCustomers']['edges']), 2)
+
+
+class CostAnalysisTests(GraphQLTestCase):
+    ORDERS_PAGE = """
+        query($first: Int) {
+            allOrders(first: $first) { edges { node { id customer { email } } } pageInfo { hasNextPage } }
+        }
+    """
+    NESTED = """
+        { allCustomers { edges { node { orders { edges { node {
+            products { edges { node { orders { edges { node { customer { name } } } } } } }
+        } } } } } } }
+    """
+
+    def analyze(self, document, variables=None):
+        return CostAnalyzer(get_schema()).analyze(document_cache.get(get_schema(), document)[0], None, variables)
+
+    def post(self, document, variables=None, **headers):
+        return self.client.post(
+            '/graphql/',
+            json.dumps({'query': document, 'variables': variables}),
+            content_type='application/json',
+            headers=headers,
+        )
+
+    def test_connections_multiply_by_page_size(self):
+        self.assertEqual(self.analyze(self.ORDERS_PAGE, {'first': 100}), (101, 2))
+        self.assertEqual(self.analyze(self.ORDERS_PAGE, {'first': 10}), (11, 2))
+        # Without first/last the relay max limit is assumed
+        self.assertEqual(self.analyze('{ allProducts { edges { node { name } } } }'), (1, 1))
+        self.assertEqual(self.analyze('{ allCustomers { edges { node { orders { totalCount } } } } }'), (101, 2))
+
+    def test_fragments_are_counted(self):
+        document = """
+            { allOrders(first: 5) { edges { node { ...orderFields } } } }
+            fragment orderFields on OrderType { customer { name } products(first: 3) { edges { node { name } } } }
+        """
+        self.assertEqual(self.analyze(document), (1 + 5 * (1 + 1), 2))
+
+    def test_expensive_operations_are_rejected_before_execution(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(self.NESTED)
+        self.assertEqual(response.status_code, 400)
+        error = response.json()['errors'][0]
+        self.assertEqual(error['extensions']['code'], 'MAX_COST_EXCEEDED')
+        self.assertEqual(len(queries), 0)
+
+        with mock.patch.multiple(CRMGraphQLView, max_cost=None, max_depth=4):
+            response = self.post(self.NESTED)
+        self.assertEqual(response.json()['errors'][0]['extensions']['code'], 'MAX_DEPTH_EXCEEDED')
+
+    def test_cost_is_reported_in_extensions(self):
+        body = self.post(self.ORDERS_PAGE, {'first': 10}).json()
+        cost = body['extensions']['cost']
+        self.assertEqual((cost['requested'], cost['depth']), (11, 2))
+        self.assertEqual(cost['budget']['remaining'], cost['budget']['capacity'] - 11)
+
+    def test_budget_is_enforced_per_client(self):
+        with mock.patch.object(CRMGraphQLView, 'budget', TokenBucket(capacity=250, refill_rate=1)):
+            for _ in range(2):
+                self.assertEqual(self.post(self.ORDERS_PAGE, {'first': 100}).status_code, 200)
+            response = self.post(self.ORDERS_PAGE, {'first': 100})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '53')
+            self.assertIn('remaining budget of 48', response.json()['errors'][0]['message'])
+
+            # Another API key has its own bucket
+            response = self.post(self.ORDERS_PAGE, {'first': 100}, X_API_KEY='partner')
+            self.assertEqual(response.status_code, 200)
+
+
+class TracingTests(GraphQLTestCase):
+    QUERY = '{ allOrders(first: 10) { totalCount edges { node { customer { name } products { edges { node { name } } } } } } }'
+
+    def setUp(self):
+        super().setUp()
+        create_orders(5)
+        resolver_duration.clear()
+        resolver_queries.clear()
+
+    def post(self, **headers):
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': self.QUERY}), content_type='application/json', headers=headers
+        )
+        return response.json()
+
+    def test_trace_is_emitted_on_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.post(X_GRAPHQL_TRACE='1')
+        tracing = body['extensions']['tracing']
+        self.assertEqual(tracing['version'], 1)
+        self.assertGreater(tracing['duration'], 0)
+
+        resolvers = {tuple(entry['path']): entry for entry in tracing['execution']['resolvers']}
+        root = resolvers[('allOrders',)]
+        self.assertEqual((root['parentType'], root['fieldName']), ('Query', 'allOrders'))
+        self.assertIn(('allOrders', 'edges', 0, 'node', 'customer', 'name'), resolvers)
+
+        # Every query is attributed to exactly one resolver
+        self.assertEqual(tracing['sql']['count'], len(queries))
+        self.assertEqual(sum(entry['sqlQueries'] for entry in resolvers.values()), len(queries))
+        self.assertEqual(resolvers[('allOrders', 'totalCount')]['sqlQueries'], 1)
+
+    def test_histograms_are_recorded_without_the_header(self):
+        body = self.post()
+        self.assertNotIn('tracing', body['extensions'])
+        durations = resolver_duration.collect()
+        self.assertEqual(sum(durations[('Query', 'allOrders')][:-1]), 1)
+        # One observation per field and operation, however many nodes resolved it
+        self.assertEqual(sum(durations[('OrderType', 'customer')][:-1]), 1)
+        # Plain attribute reads are only timed when a trace is emitted
+        self.assertNotIn(('CustomerType', 'name'), durations)
+        series = resolver_queries.collect()[('OrderTypeConnection', 'totalCount')]
+        self.assertEqual((sum(series[:-1]), series[-1]), (1, 1))
+
+
+class HistogramTests(TestCase):
+    def test_shards_are_merged_on_collect(self):
+        histogram = Histogram('test_seconds', 'Test.', labelnames=('name',), buckets=(1, 5), registry=None)
+
+        def observe(value):
+            for _ in range(100):
+                histogram.observe(value, ('a',))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(observe, [0.5, 1, 3, 10]))
+        self.assertEqual(histogram.collect()[('a',)], [200, 100, 100, 100 * (0.5 + 1 + 3 + 10)])
+
+
+class MetricsTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        REGISTRY.clear()
+        for name in os.listdir(REGISTRY.directory):
+            os.remove(os.path.join(REGISTRY.directory, name))
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode().splitlines()
+
+    def test_operations_and_mutation_outcomes_are_exposed(self):
+        create_orders(2)
+        self.query('query OrdersPage { allOrders(first: 5) { edges { node { id } } } }')
+        self.query("""
+            mutation Import($input: [CustomerInput]!) { bulkCreateCustomers(input: $input) { errors } }
+        """, {'input': [{'name': "Ok", 'email': "ok@example.com"}, {'name': "Bad", 'email': "bad"}]})
+
+        lines = self.scrape()
+        self.assertIn('graphql_operations_total{operation="OrdersPage",type="query",status="success"} 1', lines)
+        self.assertIn('graphql_operation_duration_seconds_count{operation="OrdersPage",type="query"} 1', lines)
+        self.assertIn('graphql_operation_duration_seconds_bucket{operation="OrdersPage",type="query",le="+Inf"} 1', lines)
+        self.assertIn('graphql_mutations_total{mutation="bulkCreateCustomers",status="success"} 1', lines)
+        self.assertIn('crm_bulk_rows_total{mutation="BulkCreateCustomers",outcome="created"} 1', lines)
+        self.assertIn('crm_bulk_rows_total{mutation="BulkCreateCustomers",outcome="errored"} 1', lines)
+        self.assertIn('# TYPE graphql_operation_sql_queries histogram', lines)
+
+    def test_other_processes_are_added_up(self):
+        metrics.bulk_rows.inc(2, ('BulkCreateOrders', 'created'))
+        # PID 1 always runs
+        with open(REGISTRY.path(1), 'w') as f:
+            json.dump({'crm_bulk_rows_total': [[['BulkCreateOrders', 'created'], 3]]}, f)
+        self.assertIn('crm_bulk_rows_total{mutation="BulkCreateOrders",outcome="created"} 5', self.scrape())
+
+        # Dumps replace this process's own file rather than adding to it
+        REGISTRY.dump()
+        REGISTRY.dump()
+        self.assertIn('crm_bulk_rows_total{mutation="BulkCreateOrders",outcome="created"} 5', self.scrape())
+
+    def test_exited_processes_are_folded_into_one_file(self):
+        line = 'crm_bulk_rows_total{mutation="BulkCreateOrders",outcome="created"} %d'
+        metrics.bulk_rows.inc(2, ('BulkCreateOrders', 'created'))
+        exited = subprocess.Popen([sys.executable, '-c', '']).pid
+        os.waitpid(exited, 0)
+        with open(REGISTRY.path(exited), 'w') as f:
+            json.dump({'crm_bulk_rows_total': [[['BulkCreateOrders', 'created'], 3]]}, f)
+        self.assertIn(line % 5, self.scrape())
+        self.assertEqual(sorted(os.listdir(REGISTRY.directory)), ['.lock', 'aggregate.json'])
+        self.assertIn(line % 5, self.scrape())
+
+        # A file left at this process's path by an earlier process with the same PID
+        with open(REGISTRY.path(), 'w') as f:
+            json.dump({'crm_bulk_rows_total': [[['BulkCreateOrders', 'created'], 4]]}, f)
+        REGISTRY.claimed_pid = None
+        REGISTRY.dump()
+        self.assertIn(line % 9, self.scrape())
+
+        # At exit this process's values join the aggregate and its file goes
+        REGISTRY.close()
+        REGISTRY.clear()
+        self.assertFalse(os.path.exists(REGISTRY.path()))
+        self.assertIn(line % 9, self.scrape())
+
+    def test_job_durations_and_failures_are_recorded(self):
+        @metrics.cron_job
+        def broken_job():
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            broken_job()
+        metrics.task_prerun(task_id='1')
+        metrics.task_postrun(task_id='1', task=generate_crm_report, state='SUCCESS')
+
+        lines = self.scrape()
+        self.assertIn('crm_job_runs_total{job="broken_job",kind="cron",status="failure"} 1', lines)
+        self.assertIn('crm_job_runs_total{job="generate_crm_report",kind="celery",status="success"} 1', lines)
+        self.assertIn('crm_job_duration_seconds_count{job="generate_crm_report",kind="celery"} 1', lines)
+
+
+class ResponseCacheTests(GraphQLTestCase):
+    PRODUCTS = '{ allProducts { edges { node { name stock } } } }'
+    ORDERS = '{ allOrders(first: 10) { totalCount edges { node { products { edges { node { name } } } } } } }'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(response_cache, 'ttl', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        response_cache.clear_stats()
+        self.product = Product.objects.create(name="Widget", price=Decimal('5.00'), stock=20)
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def post(self, document, variables=None, **headers):
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': document, 'variables': variables}),
+            content_type='application/json', headers=headers,
+        )
+        body = response.json()
+        self.assertNotIn('errors', body, body.get('errors'))
+        return body
+
+    def stock(self):
+        return self.post(self.PRODUCTS)['data']['allProducts']['edges'][0]['node']['stock']
+
+    def test_polling_is_served_from_the_cache(self):
+        first = self.post(self.PRODUCTS)
+        self.assertEqual(first['extensions']['responseCache'], {'hit': False})
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(9):
+                body = self.post(self.PRODUCTS)
+                self.assertTrue(body['extensions']['responseCache']['hit'])
+                self.assertEqual(body['data'], first['data'])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response_cache.stats(), {'hits': 9, 'misses': 1, 'hit_ratio': 0.9})
+        # Hits are costed and charged to the client's budget too
+        cost = body['extensions']['cost']
+        self.assertEqual(cost['requested'], first['extensions']['cost']['requested'])
+        self.assertLess(cost['budget']['remaining'], first['extensions']['cost']['budget']['remaining'])
+
+    def test_entries_are_keyed_on_the_normalized_document_and_variables(self):
+        self.post(self.PRODUCTS)
+        reformatted = """
+            # Same selection, different formatting
+            {
+              allProducts { edges { node { name   stock } } }
+            }
+        """
+        self.assertTrue(self.post(reformatted)['extensions']['responseCache']['hit'])
+
+        document = 'query($first: Int) { allProducts(first: $first) { edges { node { name } } } }'
+        self.post(document, {'first': 1})
+        self.assertEqual(self.post(document, {'first': 2})['extensions']['responseCache'], {'hit': False})
+        self.assertTrue(self.post(document, {'first': 1})['extensions']['responseCache']['hit'])
+
+        # Bypassed on request, and never used for traced requests or mutations
+        self.assertEqual(self.post(self.PRODUCTS, CACHE_CONTROL='no-cache')['extensions']['responseCache'],
+                         {'hit': False})
+        self.assertNotIn('responseCache', self.post(self.PRODUCTS, X_GRAPHQL_TRACE='1')['extensions'])
+
+    def test_writes_only_invalidate_queries_that_read_the_model(self):
+        self.post(self.PRODUCTS)
+        Customer.objects.create(name="Grace", email="grace@example.com")
+        self.assertTrue(self.post(self.PRODUCTS)['extensions']['responseCache']['hit'])
+
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.product.stock = 7
+        self.product.save()
+        self.assertEqual(self.stock(), 7)
+
+    def test_writes_without_signals_are_not_read_stale(self):
+        # Every read after a write must see it: count the reads that did not
+        stale_reads = 0
+        self.post(self.ORDERS)
+        for quantity in range(1, 4):
+            before = self.stock()
+            self.query("""
+                mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }
+            """, {'input': {'customerId': self.customer.pk, 'lines': [{'productId': self.product.pk, 'quantity': quantity}]}})
+            stale_reads += self.stock() != before - quantity
+            stale_reads += self.post(self.ORDERS)['data']['allOrders']['totalCount'] != quantity
+
+        self.query("""
+            mutation($input: [CustomerInput]!) { bulkCreateCustomers(input: $input) { errors } }
+        """, {'input': [{'name': "Bulk", 'email': "bulk@example.com"}]})
+        data = self.post('{ allCustomers { totalCount } }')
+        stale_reads += data['data']['allCustomers']['totalCount'] != 2
+
+        self.product.stock = 4
+        self.product.save()
+        self.assertEqual(self.stock(), 4)
+        self.query('mutation { updateLowStockProducts { message } }')
+        stale_reads += self.stock() != 14
+        self.assertEqual(stale_reads, 0)
+
+    def test_many_to_many_changes_invalidate_orders(self):
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('5.00'))
+        self.post(self.ORDERS)
+        order.products.add(self.product, through_defaults={'unit_price': self.product.price})
+        edges = self.post(self.ORDERS)['data']['allOrders']['edges']
+        self.assertEqual(edges[0]['node']['products']['edges'][0]['node']['name'], "Widget")
+
+    def test_dependencies_are_bounded(self):
+        with mock.patch.object(response_cache, 'dependencies_size', 2), \
+                mock.patch.object(response_cache, '_dependencies', OrderedDict()):
+            for first in range(5):
+                self.post('{ allProducts(first: %d) { edges { node { name } } } }' % (first + 1))
+            self.post(self.ORDERS)
+            self.assertEqual(len(response_cache._dependencies), 2)
+            self.assertEqual(list(response_cache._dependencies.values())[-1], [Customer, Order, Product])
+
+
+class RootFieldBarrier:
+    """Middleware holding every root field until ``parties`` of them are resolving at once."""
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.threads = set()
+
+    def resolve(self, next, root, info, **args):
+        if info.path.prev is None:
+            self.threads.add(threading.current_thread().name)
+            self.barrier.wait()
+        return next(root, info, **args)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async view runs ORM work on worker threads, so rows must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.product = Product.objects.create(name="Widget", price=Decimal('5.00'), stock=10)
+
+    def post(self, document, variables=None, **view_options):
+        view = AsyncCRMGraphQLView.as_view(**view_options)
+        request = AsyncRequestFactory().post(
+            '/graphql/', json.dumps({'query': document, 'variables': variables}),
+            content_type='application/json',
+        )
+        return json.loads(async_to_sync(view)(request).content)
+
+    def test_root_fields_resolve_concurrently(self):
+        barrier = RootFieldBarrier(3)
+        body = self.post("""
+            { crmStats { customerCount } allCustomers { totalCount } allProducts { edges { node { name } } } }
+        """, middleware=[barrier])
+        self.assertNotIn('errors', body, body.get('errors'))
+        self.assertEqual(body['data']['crmStats'], {'customerCount': 1})
+        self.assertEqual(body['data']['allCustomers'], {'totalCount': 1})
+        self.assertEqual(len(barrier.threads), 3)
+        self.assertTrue(all(name.startswith('graphql') for name in barrier.threads))
+
+    def test_matches_the_sync_view_and_keeps_batching(self):
+        for index in range(5):
+            order = Order.objects.create(customer=self.customer, total_amount=Decimal('5.00'))
+            order.products.add(self.product, through_defaults={'unit_price': self.product.price})
+        document = '{ allOrders(first: 5) { edges { node { customer { name } products { edges { node { name } } } } } } }'
+
+        with CaptureQueriesContext(connection) as sync_queries:
+            sync_body = self.client.post(
+                '/graphql/', json.dumps({'query': document}), content_type='application/json'
+            ).json()
+        async_body = self.post(document)
+        self.assertEqual(async_body['data'], sync_body['data'])
+        self.assertEqual(async_body['extensions']['cost']['requested'], sync_body['extensions']['cost']['requested'])
+
+        # Resolved on a worker thread, so count the SQL through the trace
+        request = AsyncRequestFactory().post(
+            '/graphql/', json.dumps({'query': document}), content_type='application/json',
+            headers={'X-GraphQL-Trace': '1'},
+        )
+        body = json.loads(async_to_sync(AsyncCRMGraphQLView.as_view())(request).content)
+        self.assertEqual(body['extensions']['tracing']['sql']['count'], len(sync_queries))
+
+    def test_mutations_run_in_one_transaction(self):
+        document = 'mutation ($input: OrderInput!) { createOrder(input: $input) { order { totalAmount } } }'
+        body = self.post(document, {'input': {'customerId': self.customer.pk, 'productIds': [self.product.pk]}})
+        self.assertEqual(body['data']['createOrder']['order']['totalAmount'], '5.00')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+
+        body = self.post(document, {'input': {'customerId': self.customer.pk, 'productIds': [0]}})
+        self.assertIn('errors', body)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_errors_and_early_results(self):
+        self.assertEqual(self.post('{ nope }')['errors'][0]['message'], "Cannot query field 'nope' on type 'Query'.")
+        body = self.post('{ hello }')
+        self.assertEqual(body['data'], {'hello': "Hello, GraphQL!"})
+
+    def test_blocking_work_stays_off_the_event_loop(self):
+        calls = []
+
+        def record(name, returns=None):
+            def call(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    calls.append((name, 'event loop'))
+                except RuntimeError:
+                    calls.append((name, 'worker'))
+                return returns(*args) if returns else None
+            return call
+
+        with mock.patch.object(PersistedQueries, 'resolve', autospec=True,
+                               side_effect=record('resolve', lambda self, query, extensions: query)), \
+                mock.patch.object(REGISTRY, 'maybe_dump', side_effect=record('maybe_dump')), \
+                mock.patch.object(response_cache, 'ttl', 60), \
+                mock.patch.object(response_cache, 'set', side_effect=record('cache set')):
+            body = self.post('{ allProducts { edges { node { name } } } }')
+        self.assertEqual(body['data']['allProducts']['edges'], [{'node': {'name': "Widget"}}])
+        self.assertEqual(calls, [('resolve', 'worker'), ('maybe_dump', 'worker'), ('cache set', 'worker')])
+
+
+class BroadcastTests(TestCase):
+    def test_publish_from_any_thread_and_bound_the_queue(self):
+        bus = Broadcast('memory://', queue_size=3)
+
+        async def scenario():
+            stream = bus.subscribe('stock')
+            first = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            self.assertTrue(bus.has_subscribers('stock'))
+            # Published from a request thread while the subscriber falls behind
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [bus.publish('stock', {'id': i}) for i in range(6)]
+            )
+            received = [await first] + [await stream.__anext__() for _ in range(3)]
+            await stream.aclose()
+            return received
+
+        received = async_to_sync(scenario)()
+        # The first event was taken right away; of the next five only the newest three are kept
+        self.assertEqual([event['id'] for event in received], [0, 3, 4, 5])
+        self.assertFalse(bus.has_subscribers('stock'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            Broadcast('kafka://localhost')
+
+
+class WebSocketClient:
+    """Drives the ASGI WebSocket app in process, like a server would."""
+
+    def __init__(self, subprotocols=('graphql-transport-ws',)):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {
+            'type': 'websocket', 'path': '/graphql/', 'subprotocols': list(subprotocols), 'headers': [],
+            'client': ('127.0.0.1', 50000),
+        }
+        self.task = asyncio.ensure_future(
+            GraphQLWebSocket(get_schema())(scope, self.incoming.get, self.outgoing.put)
+        )
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.event()
+
+    async def send(self, message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def event(self):
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def receive(self):
+        event = await self.event()
+        return json.loads(event['text']) if event['type'] == 'websocket.send' else event
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+class SubscriptionTests(TransactionTestCase):
+    """Events resolve on worker threads, so rows must be committed."""
+
+    ORDER_MUTATION = 'mutation ($input: OrderInput!) { createOrder(input: $input) { order { id } } }'
+
+    def setUp(self):
+        cache.clear()
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        self.widget = Product.objects.create(name="Widget", price=Decimal('5.00'), stock=12)
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('7.00'), stock=40)
+
+    def post(self, document, variables=None):
+        body = self.client.post(
+            '/graphql/', json.dumps({'query': document, 'variables': variables}), content_type='application/json'
+        ).json()
+        self.assertNotIn('errors', body, body.get('errors'))
+        return body['data']
+
+    async def start(self, ws, id, query, variables=None):
+        await ws.send({'id': id, 'type': 'subscribe', 'payload': {'query': query, 'variables': variables}})
+        await asyncio.sleep(0.05)
+
+    def test_order_and_stock_events_are_pushed(self):
+        # Widget (9 left) is only low against the threshold, Gadget (39 left) only against its own point
+        Product.objects.filter(pk=self.widget.pk).update(reorder_point=5)
+        Product.objects.filter(pk=self.gadget.pk).update(reorder_point=50)
+
+        async def scenario():
+            ws = WebSocketClient()
+            self.assertEqual(await ws.connect(), {'type': 'websocket.accept', 'subprotocol': 'graphql-transport-ws'})
+            await ws.send({'type': 'connection_init'})
+            self.assertEqual(await ws.receive(), {'type': 'connection_ack'})
+
+            await self.start(ws, 'orders', 'subscription { orderCreated { totalAmount customer { name } } }')
+            await self.start(ws, 'widget', 'subscription ($id: ID) { productStockChanged(productId: $id) { name stock } }',
+                             {'id': str(self.widget.pk)})
+            await self.start(ws, 'low', 'subscription { lowStockAlert(threshold: 10) { name stock } }')
+            await self.start(ws, 'own', 'subscription { lowStockAlert { name stock } }')
+
+            lines = [{'productId': self.widget.pk, 'quantity': 3}, {'productId': self.gadget.pk, 'quantity': 1}]
+            await sync_to_async(self.post)(self.ORDER_MUTATION, {'input': {'customerId': self.customer.pk, 'lines': lines}})
+            messages = {}
+            for _ in range(4):
+                message = await ws.receive()
+                self.assertEqual(message['type'], 'next')
+                messages[message['id']] = message['payload']['data']
+
+            await ws.send({'type': 'ping'})
+            self.assertEqual(await ws.receive(), {'type': 'pong'})
+            await ws.send({'id': 'orders', 'type': 'complete'})
+            await ws.disconnect()
+            return messages
+
+        messages = async_to_sync(scenario)()
+        self.assertEqual(messages['orders'], {'orderCreated': {'totalAmount': '22.00', 'customer': {'name': "Ada"}}})
+        # Only the watched product, and only the products that went low
+        self.assertEqual(messages['widget'], {'productStockChanged': {'name': "Widget", 'stock': 9}})
+        self.assertEqual(messages['low'], {'lowStockAlert': {'name': "Widget", 'stock': 9}})
+        self.assertEqual(messages['own'], {'lowStockAlert': {'name': "Gadget", 'stock': 39}})
+
+    def test_restocking_is_pushed_over_the_legacy_protocol(self):
+        Product.objects.filter(pk=self.widget.pk).update(stock=2)
+
+        async def scenario():
+            ws = WebSocketClient(subprotocols=['graphql-ws'])
+            self.assertEqual((await ws.connect())['subprotocol'], 'graphql-ws')
+            await ws.send({'type': 'connection_init', 'payload': {}})
+            self.assertEqual(await ws.receive(), {'type': 'connection_ack'})
+            self.assertEqual(await ws.receive(), {'type': 'ka'})
+            await ws.send({'id': '1', 'type': 'start', 'payload': {'query': 'subscription { productStockChanged { stock } }'}})
+            await asyncio.sleep(0.05)
+            await sync_to_async(self.post)('mutation { updateLowStockProducts { message } }')
+            message = await ws.receive()
+            await ws.send({'id': '1', 'type': 'stop'})
+            await ws.send({'type': 'connection_terminate'})
+            self.assertEqual((await ws.event())['type'], 'websocket.close')
+            await ws.disconnect()
+            return message
+
+        message = async_to_sync(scenario)()
+        self.assertEqual(message, {'type': 'data', 'id': '1', 'payload': {'data': {'productStockChanged': {'stock': 12}}}})
+
+    def test_queries_and_errors_over_the_socket(self):
+        async def scenario():
+            ws = WebSocketClient()
+            await ws.connect()
+            await ws.send({'type': 'connection_init'})
+            await ws.receive()
+            await ws.send({'id': 'q', 'type': 'subscribe', 'payload': {'query': '{ crmStats { customerCount } }'}})
+            results = [await ws.receive(), await ws.receive()]
+            await ws.send({'id': 'bad', 'type': 'subscribe', 'payload': {'query': 'subscription { nope }'}})
+            results.append(await ws.receive())
+            await ws.send({'id': 'twice', 'type': 'subscribe', 'payload': {'query': 'subscription { orderCreated { id } }'}})
+            await ws.send({'id': 'twice', 'type': 'subscribe', 'payload': {'query': 'subscription { orderCreated { id } }'}})
+            results.append(await ws.event())
+            await ws.disconnect()
+            return results
+
+        data, complete, error, close = async_to_sync(scenario)()
+        self.assertEqual(data, {'type': 'next', 'id': 'q', 'payload': {'data': {'crmStats': {'customerCount': 1}}}})
+        self.assertEqual(complete, {'type': 'complete', 'id': 'q'})
+        self.assertEqual(error['type'], 'error')
+        self.assertIn("Cannot query field 'nope'", error['payload'][0]['message'])
+        self.assertEqual((close['type'], close['code']), ('websocket.close', 4409))
+
+    def test_operations_share_the_http_budget(self):
+        # Spend all but one token as the same address over HTTP would
+        budget = TokenBucket(capacity=5, refill_rate=0.001)
+        budget.consume('ip:127.0.0.1', 4)
+
+        async def scenario():
+            ws = WebSocketClient(subprotocols=['graphql-ws'])
+            await ws.connect()
+            await ws.send({'type': 'connection_init', 'payload': {}})
+            await ws.receive()
+            await ws.receive()
+            results = []
+            for id in ('1', '2'):
+                await ws.send({'id': id, 'type': 'start', 'payload': {'query': '{ crmStats { customerCount } }'}})
+                results.append(await ws.receive())
+                if results[-1]['type'] == 'data':
+                    self.assertEqual(await ws.receive(), {'type': 'complete', 'id': id})
+            await ws.disconnect()
+            return results
+
+        with mock.patch.object(GraphQLWebSocketConnection, 'budget', budget):
+            allowed, rejected = async_to_sync(scenario)()
+        self.assertEqual(allowed, {'type': 'data', 'id': '1', 'payload': {'data': {'crmStats': {'customerCount': 1}}}})
+        # The legacy protocol sends one error object, not a list
+        self.assertEqual(rejected['type'], 'error')
+        self.assertIn("exceeds the remaining budget of 0", rejected['payload']['message'])
+
+    def test_protocol_violations_close_the_socket(self):
+        async def close_code(subprotocols, *messages):
+            ws = WebSocketClient(subprotocols)
+            accepted = await ws.connect()
+            if accepted['type'] == 'websocket.close':
+                return accepted['code']
+            for message in messages:
+                await ws.send(message)
+            event = await ws.event()
+            while event['type'] != 'websocket.close':
+                event = await ws.event()
+            await ws.disconnect()
+            return event['code']
+
+        async def scenario():
+            return [
+                await close_code(['mqtt']),
+                await close_code(['graphql-transport-ws'], {'id': '1', 'type': 'subscribe', 'payload': {'query': '{ hello }'}}),
+                await close_code(['graphql-transport-ws'], {'type': 'connection_init'}, {'type': 'connection_init'}),
+                await close_code(['graphql-transport-ws'], {'no': 'type'}),
+            ]
+
+        self.assertEqual(async_to_sync(scenario)(), [4406, 4401, 4429, 4400])
+
+    def test_subscriptions_are_refused_over_http(self):
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': 'subscription { orderCreated { id } }'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("WebSockets", response.json()['errors'][0]['message'])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = Customer.objects.create(name="Ada", email="ada@example.com")
+        cls.bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        cls.pen = Product.objects.create(name="Pen", price=Decimal('1.50'), stock=5)
+        cls.ink = Product.objects.create(name="Ink, blue", price=Decimal('3.00'), stock=5)
+        for index in range(5):
+            order = Order.objects.create(
+                customer=cls.ada if index % 2 else cls.bob, total_amount=Decimal(10 * (index + 1))
+            )
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, product=product, unit_price=product.price) for product in (cls.pen, cls.ink)
+            )
+        cls.viewer = User.objects.create_user('viewer')
+        cls.viewer.user_permissions.add(*Permission.objects.filter(codename__in=['view_order', 'view_customer']))
+
+    def test_rows_stream_in_chunks_with_their_prefetches(self):
+        with CaptureQueriesContext(connection) as queries:
+            lines = export(
+                'orders', 'ndjson', fields='id,total_amount,customer_name,product_names,quantities,unit_prices',
+                chunk_size=2,
+            )
+            self.assertEqual(len(queries), 0)
+            rows = [json.loads(line) for line in lines]
+        # One streamed SELECT joining customers, then one lines prefetch per chunk
+        self.assertEqual(len(queries), 1 + 3)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], {
+            'id': rows[0]['id'], 'total_amount': '10.00', 'customer_name': "Bob", 'product_names': ["Pen", "Ink, blue"],
+            'quantities': [1, 1], 'unit_prices': ['1.50', '3.00'],
+        })
+
+    def test_rows_are_scoped_by_the_connection_filters(self):
+        rows = [json.loads(line) for line in export(
+            'orders', 'ndjson', filters={'total_amount__gte': '20', 'customer_name': 'Ada'}, fields=['total_amount'],
+        )]
+        self.assertEqual(rows, [{'total_amount': '20.00'}, {'total_amount': '40.00'}])
+        customers = [json.loads(line)['email'] for line in export('customers', 'ndjson', search='bob')]
+        self.assertEqual(customers, ["bob@example.com"])
+
+        with self.assertRaisesMessage(ValidationError, "Unknown columns: secret"):
+            export('orders', 'csv', fields='id,secret')
+        with self.assertRaisesMessage(ValidationError, "total_amount__gte"):
+            export('orders', 'csv', filters={'total_amount__gte': 'lots'})
+
+    def test_endpoint_streams_gzipped_csv(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(
+            '/export/orders.csv', {'fields': 'id,customer_email,product_ids', 'total_amount__lte': '20'},
+            headers={'Accept-Encoding': 'gzip'},
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'customer_email', 'product_ids'])
+        self.assertEqual([row[1:] for row in rows[1:]], [
+            ["bob@example.com", f"{self.pen.pk};{self.ink.pk}"],
+            ["ada@example.com", f"{self.pen.pk};{self.ink.pk}"],
+        ])
+
+        response = self.client.get('/export/orders.ndjson', {'fields': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/export/products.csv').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get('/export/orders.csv').status_code, 403)
+
+    async def test_endpoint_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.viewer)
+        for headers, decode in (({}, bytes), ({'Accept-Encoding': 'gzip'}, gzip.decompress)):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                response = await self.async_client.get(
+                    '/export/orders.ndjson', {'fields': 'total_amount'}, headers=headers,
+                )
+                self.assertTrue(response.is_async)
+                body = decode(b''.join([chunk async for chunk in response.streaming_content]))
+            self.assertEqual(
+                [json.loads(line)['total_amount'] for line in body.decode().splitlines()],
+                ['10.00', '20.00', '30.00', '40.00', '50.00'],
+            )
+            self.assertFalse([warning for warning in caught if 'synchronous iterators' in str(warning.message)])
+
+    def test_command_writes_csv_with_quoting(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv.gz')
+            call_command('export_crm', 'products', '--format', 'csv', '--fields', 'name,price',
+                         '--filter', 'price__gte=2', '--output', path)
+            with gzip.open(path, 'rt', newline='') as f:
+                self.assertEqual(list(csv.reader(f)), [['name', 'price'], ["Ink, blue", '3.00']])
+
+        out = io.StringIO()
+        call_command('export_crm', 'customers', '--fields', 'name', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['{"name": "Ada"}', '{"name": "Bob"}'])
+        with self.assertRaisesMessage(CommandError, "Filters are NAME=VALUE"):
+            call_command('export_crm', 'customers', '--filter', 'name')
+
+
+class ImportTests(TestCase):
+    def write(self, directory, name, text):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_customers_are_validated_like_create_customer(self):
+        Customer.objects.create(name="Ada", email="ada@example.com")
+        text = (
+            "name,email,phone\n"
+            "Grace Hopper,grace@navy.mil,+1234567890\n"
+            "Bad Email,not-an-email,\n"
+            "Bad Phone,phone@example.com,abc\n"
+            "Ada Again,ada@example.com,\n"
+            "Grace Twice,grace@navy.mil,\n"
+            ",nameless@example.com,\n"
+            "Alan Turing,alan@example.com,\n"
+        )
+        errors = []
+        result = run_import('customers', read_rows(io.StringIO(text), 'csv'), batch_size=3,
+                            on_error=lambda number, message: errors.append((number, message)))
+
+        self.assertEqual((result.offset, result.created, result.rejected), (7, 2, 5))
+        self.assertEqual(errors, [
+            (2, "Enter a valid email address."),
+            (3, "Invalid phone format"),
+            (4, "Email already exists - ada@example.com"),
+            (5, "Email already exists - grace@navy.mil"),
+            (6, "name is required"),
+        ])
+        self.assertEqual(Customer.objects.get(email="grace@navy.mil").phone, "+1234567890")
+        # Imported rows are searchable and the per-row trigger is back for later writes
+        if isinstance(get_search_backend(), FTS5SearchBackend):
+            Customer.objects.create(name="Grace Kelly", email="kelly@example.com")
+            self.assertEqual(
+                sorted(get_search_backend().matching(Customer.objects.all(), "grace").values_list('name', flat=True)),
+                ["Grace Hopper", "Grace Kelly"],
+            )
+
+    def test_orders_resolve_keys_from_memory(self):
+        ada = Customer.objects.create(name="Ada", email="ada@example.com")
+        products = io.StringIO(
+            '{"id": 501, "name": "Pen", "price": "1.50", "stock": 5}\n'
+            '{"id": 502, "name": "Ink", "price": "3.00"}\n'
+            '{"name": "Free", "price": "0"}\n'
+            'not json\n'
+        )
+        errors = []
+        result = run_import('products', read_rows(products, 'ndjson'),
+                            on_error=lambda number, message: errors.append(number))
+        self.assertEqual((result.created, errors), (2, [3, 4]))
+
+        orders = io.StringIO(
+            '{"customer_email": "ada@example.com", "product_ids": [501, 502], "order_date": "2025-01-02T03:04:05Z"}\n'
+            f'{{"customer_id": {ada.pk}, "product_ids": "501;501", "total_amount": "9.99"}}\n'
+            '{"customer_email": "nobody@example.com", "product_ids": [501]}\n'
+            f'{{"customer_id": {ada.pk}, "product_ids": [501, 999]}}\n'
+        )
+        errors = []
+        with CaptureQueriesContext(connection) as queries:
+            result = run_import('orders', read_rows(orders, 'ndjson'),
+                                on_error=lambda number, message: errors.append((number, message)))
+        self.assertEqual(result.created, 2)
+        self.assertEqual(errors, [(3, "Invalid customer ID"), (4, "Invalid product ID: 999")])
+        # Key maps are loaded once; the batch is written with a fixed number of
+        # statements, plus the 9 recomputing the sales rollups of its hours
+        self.assertLessEqual(len(queries), 12 + 9)
+
+        first, second = Order.objects.order_by('pk')
+        self.assertEqual(first.total_amount, Decimal('4.50'))
+        self.assertEqual(first.order_date, datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc))
+        self.assertEqual(sorted(first.products.values_list('pk', flat=True)), [501, 502])
+        self.assertEqual((second.total_amount, second.products.count()), (Decimal('9.99'), 1))
+        self.assertEqual(second.lines.values_list('quantity', 'unit_price').get(), (2, Decimal('1.50')))
+        self.assertEqual(
+            list(SalesRollup.objects.filter(granularity='day', period__year=2025).values_list('order_count', 'units')),
+            [(1, 2)],
+        )
+        # Stock is not reserved for history
+        self.assertEqual(Product.objects.get(pk=501).stock, 5)
+        stats = CustomerStats.objects.get(pk=ada.pk)
+        self.assertEqual((stats.order_count, stats.lifetime_revenue), (2, Decimal('14.49')))
+        self.assertEqual((stats.first_order_date, stats.last_order_date), (first.order_date, second.order_date))
+
+    def test_order_lines_take_quantities_and_unit_prices(self):
+        Customer.objects.create(name="Ada", email="ada@example.com")
+        Product.objects.bulk_create([
+            Product(pk=501, name="Pen", price=Decimal('1.50')), Product(pk=502, name="Ink", price=Decimal('3.00')),
+        ])
+        orders = io.StringIO(
+            'customer_email,product_ids,quantities,unit_prices\n'
+            'ada@example.com,501;502,4;1,1.25;3.00\n'
+            'ada@example.com,501;502,2,\n'
+        )
+        errors = []
+        result = run_import('orders', read_rows(orders, 'csv'),
+                            on_error=lambda number, message: errors.append((number, message)))
+        self.assertEqual(errors, [(2, "quantities and unit_prices must match product_ids")])
+        order = Order.objects.get()
+        self.assertEqual((result.created, order.total_amount), (1, Decimal('8.00')))
+        self.assertEqual(
+            list(order.lines.order_by('product_id').values_list('quantity', 'unit_price')),
+            [(4, Decimal('1.25')), (1, Decimal('3.00'))],
+        )
+
+    def test_interrupted_import_resumes_from_its_checkpoint(self):
+        text = "name,email\n" + "".join(f"Customer {i},customer{i}@example.com\n" for i in range(5))
+
+        def interrupted(rows):
+            for number, row in enumerate(rows):
+                if number == 3:
+                    raise KeyboardInterrupt
+                yield row
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write(directory, 'customers.csv', text)
+            checkpoint = Checkpoint(f'{path}.checkpoint', 'customers', path)
+            with self.assertRaises(KeyboardInterrupt):
+                with open(path, newline='') as f:
+                    run_import('customers', interrupted(read_rows(f, 'csv')), batch_size=2, checkpoint=checkpoint)
+            # The first batch committed; the one being read when it stopped did not
+            self.assertEqual(Customer.objects.count(), 2)
+            self.assertEqual(checkpoint.load()['offset'], 2)
+
+            out = io.StringIO()
+            call_command('crm_import', 'customers', path, '--batch-size', '2', stdout=out)
+            self.assertIn("Resuming after row 2", out.getvalue())
+            self.assertIn("5 created, 0 rejected of 5 rows (3 read", out.getvalue())
+            self.assertEqual(Customer.objects.count(), 5)
+            self.assertIsNone(checkpoint.load())
+
+            # Stopped right after a batch committed: its checkpoint committed with it
+            Customer.objects.all().delete()
+            with mock.patch('crm.importer.import_rows') as import_rows, self.assertRaises(KeyboardInterrupt):
+                import_rows.inc.side_effect = KeyboardInterrupt
+                with open(path, newline='') as f:
+                    run_import('customers', read_rows(f, 'csv'), batch_size=2, checkpoint=checkpoint)
+            self.assertEqual((Customer.objects.count(), checkpoint.load()['offset']), (2, 2))
+            out = io.StringIO()
+            call_command('crm_import', 'customers', path, '--batch-size', '2', stdout=out, stderr=io.StringIO())
+            self.assertIn("5 created, 0 rejected", out.getvalue())
+            self.assertEqual(Customer.objects.count(), 5)
+
+            # A checkpoint for a different file is refused
+            checkpoint.save(offset=2, created=2, rejected=0)
+            self.write(directory, 'customers.csv', text + "Late,late@example.com\n")
+            with self.assertRaisesMessage(CommandError, "pass --restart"):
+                call_command('crm_import', 'customers', path, stdout=io.StringIO())
+
+
+class SeedTests(TransactionTestCase):
+    dataset = seed.Dataset(customers=40, products=12, orders=150, seed=3)
+
+    def test_generated_rows_are_deterministic_and_valid(self):
+        orders, lines = seed.order_rows(self.dataset, 0)
+        self.assertEqual((orders, lines), seed.order_rows(self.dataset, 0))
+        self.assertNotEqual(orders, seed.order_rows(self.dataset._replace(seed=4), 0)[0])
+        # Chunks come out the same from a process pool
+        with ProcessPoolExecutor(2) as pool:
+            self.assertEqual(list(seed.generated(self.dataset, 'orders', pool, ahead=2)), [(orders, lines)])
+
+        for _, name, email, phone, *_ in seed.customer_rows(self.dataset, 0):
+            validate_email(email)
+            validate_phone(phone)
+        self.assertEqual({customer_id for _, customer_id, *_ in orders} - set(range(1, 41)), set())
+        self.assertEqual({product_id for _, product_id, *_ in lines} - set(range(1, 13)), set())
+        prices = {pk: price for pk, _, price, *_ in seed.product_rows(self.dataset, 0)}
+        self.assertTrue(all(quantity == 1 and price == prices[pk] for _, pk, quantity, price in lines))
+
+    def test_load_replaces_the_data(self):
+        Customer.objects.create(name="Old", email="old@example.com")
+        chunks = []
+        seed.load(self.dataset, on_chunk=lambda kind, rows: chunks.append((kind, rows)))
+
+        self.assertEqual(chunks, [('customers', 40), ('products', 12), ('orders', 150)])
+        self.assertEqual(
+            (Customer.objects.count(), Product.objects.count(), Order.objects.count()), (40, 12, 150)
+        )
+        self.assertFalse(Customer.objects.filter(email="old@example.com").exists())
+        self.assertEqual(rebuild_customer_stats(write=False), (40, 0, 0, 0))
+        self.assertEqual(
+            sum(CustomerStats.objects.values_list('order_count', flat=True)), Order.objects.count()
+        )
+        for order in Order.objects.prefetch_related('products').select_related('customer')[:20]:
+            self.assertEqual(order.total_amount, sum(product.price for product in order.products.all()))
+            self.assertGreaterEqual(order.order_date, order.customer.created_at)
+        customer = Customer.objects.get(pk=1)
+        self.assertIn(customer, get_search_backend().matching(Customer.objects.all(), customer.email))
+        # The next row created normally gets a fresh key
+        self.assertEqual(Customer.objects.create(name="New", email="new@example.com").pk, 41)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys')
+            self.assertEqual(cursor.fetchone()[0], 1)
@@ -0,0 +1,135 @@
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.utils import timezone
+from graphene.relay.node import GlobalID
+from graphene.types.resolver import dict_or_attr_resolver
+from graphql import MiddlewareManager, default_field_resolver
+
+from .metrics import COUNT_BUCKETS, Histogram
+
+TRACING_ENABLED = getattr(settings, 'GRAPHQL_TRACING', True)
+TRACE_HEADER = 'X-GraphQL-Trace'
+
+resolver_duration = Histogram(
+    'graphql_resolver_duration_seconds',
+    'Time spent in each field resolver per operation.',
+    labelnames=('parent_type', 'field'),
+)
+resolver_queries = Histogram(
+    'graphql_resolver_sql_queries',
+    'SQL queries run by each field resolver per operation.',
+    labelnames=('parent_type', 'field'),
+    buckets=COUNT_BUCKETS,
+)
+
+
+def nanoseconds(seconds):
+    return int(seconds * 1e9)
+
+
+class Trace:
+    """
+    Resolver timings and SQL queries of one operation.
+
+    Installed as a ``connection.execute_wrapper`` it counts every query, and
+    ``TracingMiddleware`` attributes them to the resolver that was running.
+    Per field totals always go to the resolver histograms; the per path
+    entries of the Apollo tracing format are only kept when ``emit`` is set.
+    Under the async view root fields resolve in parallel threads, so a
+    resolver's SQL count can include queries of a sibling root field.
+    """
+
+    def __init__(self, emit=False):
+        self.emit = emit
+        self.started_at = timezone.now()
+        self.start = self.end = time.perf_counter()
+        self.sql_count = 0
+        self.sql_duration = 0.0
+        self.fields = {}
+        self.resolvers = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_duration += time.perf_counter() - start
+
+    def resolve(self, next, root, info, args):
+        queries, sql_duration = self.sql_count, self.sql_duration
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            duration = time.perf_counter() - start
+            key = (info.parent_type.name, info.field_name)
+            field = self.fields.get(key)
+            if field is None:
+                field = self.fields[key] = [0.0, 0]
+            field[0] += duration
+            field[1] += self.sql_count - queries
+            if self.emit:
+                self.resolvers.append({
+                    'path': info.path.as_list(),
+                    'parentType': info.parent_type.name,
+                    'fieldName': info.field_name,
+                    'returnType': str(info.return_type),
+                    'startOffset': nanoseconds(start - self.start),
+                    'duration': nanoseconds(duration),
+                    'sqlQueries': self.sql_count - queries,
+                    'sqlDuration': nanoseconds(self.sql_duration - sql_duration),
+                })
+
+    def finish(self):
+        self.end = time.perf_counter()
+        for labels, (duration, queries) in self.fields.items():
+            resolver_duration.observe(duration, labels)
+            resolver_queries.observe(queries, labels)
+
+    def as_extension(self):
+        """The trace in the Apollo tracing format, plus SQL totals."""
+        duration = self.end - self.start
+        return {
+            'version': 1,
+            'startTime': self.started_at.isoformat(),
+            'endTime': (self.started_at + timedelta(seconds=duration)).isoformat(),
+            'duration': nanoseconds(duration),
+            'execution': {'resolvers': self.resolvers},
+            'sql': {'count': self.sql_count, 'duration': nanoseconds(self.sql_duration)},
+        }
+
+
+class TracingMiddleware:
+    """Graphene middleware timing every resolver of operations that carry a ``Trace``."""
+
+    def resolve(self, next, root, info, **args):
+        trace = getattr(info.context, 'trace', None)
+        if trace is None:
+            return next(root, info, **args)
+        return trace.resolve(next, root, info, args)
+
+
+def is_attribute_resolver(resolver):
+    # Relay ids only encode the already loaded primary key
+    return resolver is default_field_resolver or (
+        isinstance(resolver, partial) and resolver.func in (dict_or_attr_resolver, GlobalID.id_resolver)
+    )
+
+
+class TracingMiddlewareManager(MiddlewareManager):
+    """
+    Applies the middlewares to every resolver except plain attribute lookups.
+
+    Those are most of the resolver calls of a large result and only read values
+    already loaded, so leaving them unwrapped keeps tracing cheap when no trace
+    is emitted. Their SQL still counts towards the operation totals.
+    """
+
+    def get_field_resolver(self, field_resolver):
+        if is_attribute_resolver(field_resolver):
+            return field_resolver
+        return super().get_field_resolver(field_resolver)
@@ -1,3 +1,535 @@
-from django.shortcuts import render
+import json
+import time
+from collections import namedtuple
+from inspect import isawaitable
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    ExecutionResult, FieldNode, MiddlewareManager, OperationType, execute, get_operation_ast,
+    validate_schema,
+)
+from graphql.error import GraphQLError
+
+from .cost import (
+    CLIENT_BUDGET, MAX_QUERY_COST, MAX_QUERY_DEPTH, CostAnalyzer, QueryCostError, TokenBucket,
+)
+from .executor import ThreadedExecutionContext, run_sync
+from .export import EXPORTS, FORMATS, export
+from .documents import PersistedQueryError, document_cache, persisted_queries
+from .loaders import Loaders
+from .metrics import (
+    REGISTRY, mutations, operation_duration, operation_label, operation_queries, operations,
+)
+from .response_cache import response_cache
+from .tracing import TRACE_HEADER, TRACING_ENABLED, Trace, TracingMiddlewareManager
+
+PreparedOperation = namedtuple(
+    "PreparedOperation", "schema document operation_ast cache_key extensions execute_options"
+)
+
+# (full, attribute resolvers skipped) managers per middleware stack, kept across
+# requests so each resolver is wrapped once per process rather than per request
+_middleware_managers = {}
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQL endpoint that gives every request its own set of DataLoaders,
+    reuses parsed and validated documents and accepts persisted query hashes.
+
+    Operations deeper than ``max_depth`` or costlier than ``max_cost`` are
+    rejected before they run, the rest are charged to the client's ``budget``,
+    and the computed cost is reported under ``extensions.cost``. Requests sending
+    the ``X-GraphQL-Trace`` header get an Apollo trace under ``extensions.tracing``.
+    When ``response_cache`` is enabled, query results are served from it.
+    """
+
+    document_cache = document_cache
+    persisted_queries = persisted_queries
+    max_depth = MAX_QUERY_DEPTH
+    max_cost = MAX_QUERY_COST
+    budget = TokenBucket() if CLIENT_BUDGET else None
+    tracing = TRACING_ENABLED
+    response_cache = response_cache
+
+    def get_context(self, request):
+        request.loaders = Loaders()
+        if self.tracing:
+            request.trace = Trace(emit=bool(request.headers.get(TRACE_HEADER)))
+        return request
+
+    def get_middleware(self, request):
+        if not self.middleware or isinstance(self.middleware, MiddlewareManager):
+            return self.middleware
+        key = tuple(type(middleware) for middleware in self.middleware)
+        if key not in _middleware_managers:
+            _middleware_managers[key] = (
+                MiddlewareManager(*self.middleware),
+                TracingMiddlewareManager(*self.middleware),
+            )
+        full, untraced_attributes = _middleware_managers[key]
+        trace = getattr(request, "trace", None)
+        return full if trace is not None and trace.emit else untraced_attributes
+
+    def record_operation(self, request, operation_ast, result, duration):
+        name = operation_label(operation_ast.name.value if operation_ast.name else None)
+        kind = operation_ast.operation.value
+        operation_duration.observe(duration, (name, kind))
+        operations.inc(labels=(name, kind, "error" if result.errors else "success"))
+        trace = getattr(request, "trace", None)
+        if trace is not None:
+            operation_queries.observe(trace.sql_count, (name,))
+        if operation_ast.operation == OperationType.MUTATION:
+            failed = {error.path[0] for error in result.errors or [] if error.path}
+            for selection in operation_ast.selection_set.selections:
+                if isinstance(selection, FieldNode):
+                    key = selection.alias.value if selection.alias else selection.name.value
+                    status = "error" if key in failed else "success"
+                    mutations.inc(labels=(selection.name.value, status))
+        REGISTRY.maybe_dump()
+
+    def run_operation(self, request, schema, document, execute_options):
+        trace = getattr(request, "trace", None)
+        if trace is None:
+            return execute(schema, document, **execute_options)
+        with connection.execute_wrapper(trace):
+            result = execute(schema, document, **execute_options)
+        trace.finish()
+        return result
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except Exception:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+
+        try:
+            query = self.persisted_queries.resolve(query, extensions)
+        except PersistedQueryError as e:
+            # Served with 200 so APQ clients retry with the full query text
+            raise HttpError(HttpResponse(status=200), str(e))
+
+        return query, variables, operation_name, id
+
+    def get_client_id(self, request):
+        """Key the cost budget by API key, then by user, then by address."""
+        api_key = request.headers.get("X-Api-Key")
+        if api_key:
+            return f"key:{api_key}"
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+    def check_cost(self, request, schema, document, operation_name, variables):
+        """Return the ``cost`` extension for the operation, or raise if it may not run."""
+        cost, depth = CostAnalyzer(schema).analyze(document, operation_name, variables)
+        extension = {
+            "requested": cost,
+            "depth": depth,
+            "maxCost": self.max_cost,
+            "maxDepth": self.max_depth,
+        }
+
+        if self.max_depth is not None and depth > self.max_depth:
+            raise QueryCostError(
+                f"Query depth {depth} exceeds the maximum depth of {self.max_depth}.",
+                extensions={"code": "MAX_DEPTH_EXCEEDED", "cost": extension},
+            )
+        if self.max_cost is not None and cost > self.max_cost:
+            raise QueryCostError(
+                f"Query cost {cost} exceeds the maximum cost of {self.max_cost}.",
+                extensions={"code": "MAX_COST_EXCEEDED", "cost": extension},
+            )
+
+        if self.budget is not None:
+            allowed, remaining, retry_after = self.budget.consume(self.get_client_id(request), cost)
+            extension["budget"] = {
+                "remaining": remaining,
+                "capacity": self.budget.capacity,
+                "refillRate": self.budget.refill_rate,
+            }
+            if not allowed:
+                response = HttpResponse(status=429)
+                response["Retry-After"] = str(retry_after)
+                raise HttpError(
+                    response,
+                    f"Query cost {cost} exceeds the remaining budget of {remaining}; "
+                    f"retry in {retry_after} seconds.",
+                )
+        return extension
+
+    def get_cache_scope(self, request):
+        """Responses are only shared between requests with the same identity."""
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return "anonymous"
+
+    def get_response_cache_key(self, request, schema, query, document, operation_ast, variables):
+        if (
+            not self.response_cache.enabled
+            or operation_ast is None
+            or operation_ast.operation != OperationType.QUERY
+            or request.headers.get(TRACE_HEADER)
+        ):
+            return None
+        return self.response_cache.key(
+            schema, query, document, operation_ast, variables, self.get_cache_scope(request)
+        )
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.encode_result(request, execution_result, id, show_graphiql)
+
+    def encode_result(self, request, execution_result, id, show_graphiql=False):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        prepared = self.prepare_operation(request, query, variables, operation_name, show_graphiql)
+        if not isinstance(prepared, PreparedOperation):
+            return prepared
+        return self.execute_prepared(request, prepared)
+
+    def prepare_operation(self, request, query, variables, operation_name, show_graphiql=False):
+        """
+        Parse, validate and cost the operation.
+
+        Returns a ``PreparedOperation`` to execute, or the ``ExecutionResult``
+        (or ``None`` for GraphiQL) to answer with right away.
+        """
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        try:
+            document, validation_errors = self.document_cache.get(
+                schema,
+                query,
+                self.validation_rules,
+                graphene_settings.MAX_VALIDATION_ERRORS,
+            )
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        if operation_ast is not None and operation_ast.operation == OperationType.SUBSCRIPTION:
+            return ExecutionResult(
+                data=None,
+                errors=[GraphQLError("Subscriptions are served over WebSockets (graphql-transport-ws).")],
+            )
+
+        # Cached responses are costed and charged like executed ones
+        try:
+            extensions = {"cost": self.check_cost(request, schema, document, operation_name, variables)}
+        except QueryCostError as e:
+            return ExecutionResult(data=None, errors=[e])
+
+        cache_key = self.get_response_cache_key(
+            request, schema, query, document, operation_ast, variables
+        )
+        if cache_key and "no-cache" not in request.headers.get("Cache-Control", ""):
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                data, age = cached
+                extensions["responseCache"] = {"hit": True, "age": round(age, 3)}
+                return ExecutionResult(data=data, extensions=extensions)
+
+        try:
+            execute_options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options[
+                    "execution_context_class"
+                ] = self.execution_context_class
+        except Exception as e:
+            return ExecutionResult(errors=[e], extensions=extensions)
+
+        return PreparedOperation(schema, document, operation_ast, cache_key, extensions, execute_options)
+
+    def execute_prepared(self, request, prepared):
+        try:
+            start = time.perf_counter()
+
+            if (
+                prepared.operation_ast is not None
+                and prepared.operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = self.run_operation(
+                        request, prepared.schema, prepared.document, prepared.execute_options
+                    )
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+            else:
+                result = self.run_operation(
+                    request, prepared.schema, prepared.document, prepared.execute_options
+                )
+
+            return self.complete_operation(request, prepared, result, time.perf_counter() - start)
+        except Exception as e:
+            return ExecutionResult(errors=[e], extensions=prepared.extensions)
+
+    def complete_operation(self, request, prepared, result, duration):
+        """Record the operation, cache its result and attach the extensions."""
+        extensions = prepared.extensions
+        if prepared.operation_ast is not None:
+            self.record_operation(request, prepared.operation_ast, result, duration)
+
+        if prepared.cache_key and not result.errors:
+            self.response_cache.set(prepared.cache_key, result.data)
+            extensions["responseCache"] = {"hit": False}
+
+        trace = getattr(request, "trace", None)
+        if trace is not None and trace.emit:
+            extensions["tracing"] = trace.as_extension()
+        result.extensions = extensions
+        return result
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """
+    ``CRMGraphQLView`` that does not hold a thread while a request waits.
+
+    Resolving persisted queries, preparing the operation (which may read the
+    session and cache), the ORM work and recording the result (cache writes,
+    metrics dumps) run on the bounded ``crm.executor`` pool. The root fields of a
+    query resolve concurrently, one worker thread each; mutations and
+    anything else run start to end on a single worker so they keep one
+    connection and transaction. Served for ``/graphql/`` under ASGI.
+    """
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in ("get", "post"):
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                # Rendering the page needs no database access
+                return super().dispatch(request, *args, **kwargs)
+
+            if self.batch:
+                responses = [await self.get_response_async(request, entry) for entry in data]
+                result = "[{}]".format(
+                    ",".join([response[0] for response in responses])
+                )
+                status_code = (
+                    responses
+                    and max(responses, key=lambda response: response[1])[1]
+                    or 200
+                )
+            else:
+                result, status_code = await self.get_response_async(request, data)
+
+            return HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+    async def get_response_async(self, request, data):
+        # Persisted queries are looked up in the cache, which may block
+        query, variables, operation_name, id = await run_sync(self.get_graphql_params)(request, data)
+
+        prepared = await run_sync(self.prepare_operation)(request, query, variables, operation_name)
+        if not isinstance(prepared, PreparedOperation):
+            execution_result = prepared
+        elif (
+            prepared.operation_ast is None
+            or prepared.operation_ast.operation != OperationType.QUERY
+        ):
+            execution_result = await run_sync(self.execute_prepared)(request, prepared)
+        else:
+            execution_result = await self.execute_query_async(request, prepared)
+        return self.encode_result(request, execution_result, id)
+
+    async def execute_query_async(self, request, prepared):
+        execute_options = dict(
+            prepared.execute_options, execution_context_class=ThreadedExecutionContext
+        )
+        try:
+            start = time.perf_counter()
+            result = execute(prepared.schema, prepared.document, **execute_options)
+            if isawaitable(result):
+                result = await result
+            trace = getattr(request, "trace", None)
+            if trace is not None:
+                trace.finish()
+            # Caches the result and may dump the metrics file, so not on the event loop
+            return await run_sync(self.complete_operation)(
+                request, prepared, result, time.perf_counter() - start
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e], extensions=prepared.extensions)
+
+
+def metrics_view(request):
+    """Metrics of every process in the Prometheus text exposition format."""
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def buffered(lines, size=64 * 1024):
+    """Join text lines into blocks of about ``size`` bytes, so the server writes few large chunks."""
+    block, length = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        block.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(block)
+            block, length = [], 0
+    if block:
+        yield b"".join(block)
+
+
+async def iterate_in_thread(iterator):
+    """
+    Yield the items of a sync ``iterator``, each pulled on the thread the view
+    ran in, where its database connection and cursor live. Under ASGI this
+    streams chunk by chunk, where Django would collect a sync iterator into a list.
+    """
+    done = object()
+    pull = sync_to_async(next, thread_sensitive=True)
+    while True:
+        item = await pull(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def export_view(request, name, format):
+    """
+    Stream every row of an export as NDJSON or CSV, gzipped when the client accepts it.
+
+    Query parameters are the filters of the matching GraphQL connection, plus
+    ``search`` and ``fields`` (comma separated columns). Requires the model's
+    view permission.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    definition = EXPORTS.get(name)
+    if definition is None or format not in FORMATS:
+        raise Http404("Unknown export.")
+    if not request.user.has_perm(f"crm.view_{definition.model._meta.model_name}"):
+        return HttpResponseForbidden()
+
+    try:
+        lines = export(
+            name, format, filters=request.GET,
+            search=request.GET.get("search"), fields=request.GET.get("fields"),
+        )
+    except ValidationError as e:
+        return JsonResponse({"errors": e.messages}, status=400)
+
+    content = buffered(lines)
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    if gzipped:
+        content = compress_sequence(content)
+    if isinstance(request, ASGIRequest):
+        content = iterate_in_thread(content)
+    response = StreamingHttpResponse(content, content_type=f"{FORMATS[format]}; charset=utf-8")
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["Content-Disposition"] = f'attachment; filename="{name}.{format}"'
+    return response
@@ -1,4 +1,17 @@
+"""
+Seed the database.
+
+Without arguments, replaces the data with a handful of sample customers,
+products and orders. With --scale (or explicit sizes) it loads a generated
+dataset instead, the same for the same --seed:
+
+    python seed_db.py --scale large --workers 4
+    python seed_db.py --customers 5000 --products 200 --orders 20000 --seed 7
+"""
+import argparse
 import os
+import sys
+import time
 import django
 from decimal import Decimal
 from django.utils import timezone
@@ -7,7 +20,8 @@ from django.utils import timezone
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderLine
+from crm.seed import SCALES, Dataset, load
 
 
 def clear_database():
@@ -102,7 +116,9 @@ def create_orders(customers, products):
         )
 
         # Add products to order
-        order.products.set(order_data["products"])
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=product, unit_price=product.price) for product in order_data["products"]
+        )
         created_orders.append(order)
 
         product_names = ", ".join([p.name for p in order_data["products"]])
@@ -112,8 +128,8 @@ def create_orders(customers, products):
     return created_orders
 
 
-def main():
-    """Main function to seed the database."""
+def seed_sample():
+    """Replace the data with the sample customers, products and orders."""
     print("=" * 60)
     print("Starting database seeding process...")
     print("=" * 60 + "\n")
@@ -141,5 +157,49 @@ def main():
         raise
 
 
+def seed_generated(dataset, workers):
+    """Replace the data with a generated dataset, reporting progress per chunk."""
+    print(
+        f"Generating {dataset.customers:,} customers, {dataset.products:,} products and "
+        f"{dataset.orders:,} orders (seed {dataset.seed}, {workers} worker(s))..."
+    )
+    done = {'customers': 0, 'products': 0, 'orders': 0}
+    start = time.perf_counter()
+
+    def on_chunk(kind, rows):
+        done[kind] += rows
+        elapsed = time.perf_counter() - start
+        print(f"  {kind}: {done[kind]:,}/{getattr(dataset, kind):,} ({elapsed:.0f}s)", flush=True)
+
+    load(dataset, workers=workers, on_chunk=on_chunk)
+    elapsed = time.perf_counter() - start
+    total = sum(done.values())
+    print(f"Loaded {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/sec)")
+
+
+def main():
+    """Main function to seed the database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=list(SCALES), help="Customers/products/orders: " + ", ".join(
+        f"{name} {customers:,}/{products:,}/{orders:,}" for name, (customers, products, orders) in SCALES.items()
+    ))
+    parser.add_argument('--customers', type=int)
+    parser.add_argument('--products', type=int)
+    parser.add_argument('--orders', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=1, help="Processes generating rows.")
+    args = parser.parse_args()
+
+    sizes = {name: getattr(args, name) for name in ('customers', 'products', 'orders')}
+    if args.scale is None and not any(sizes.values()):
+        seed_sample()
+        return
+    defaults = dict(zip(sizes, SCALES[args.scale or 'small']))
+    sizes = {name: size if size is not None else defaults[name] for name, size in sizes.items()}
+    if sizes['customers'] < 1 or sizes['products'] < 1:
+        sys.exit("At least one customer and one product are needed to generate orders.")
+    seed_generated(Dataset(**sizes, seed=args.seed), args.workers)
+
+
 if __name__ == "__main__":
     main()